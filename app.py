@@ -2,15 +2,43 @@
 # SecureShop - Codeathon Project
 
 from flask import (Flask, render_template, request, redirect,
-                   url_for, session, jsonify, flash)
-from flask_wtf.csrf import CSRFProtect, CSRFError
-import bcrypt
+                   url_for, session, jsonify, flash, Response, make_response)
+from urllib.parse import urlencode
+from flask_wtf.csrf import CSRFProtect, CSRFError, generate_csrf
 import pymysql
 import pymysql.cursors
-import razorpay
 import os
+import random
+import threading
+import time
 from functools import wraps
-from werkzeug.utils import secure_filename
+from database import get_db, init_pool
+from assets import init_assets
+from avatars import discard_avatar, init_avatars, save_avatar
+from product_images import image_url_for, init_product_images
+from catalog_cache import CatalogCache
+from catalog_changes import ChangeFeed
+from sessions import init_sessions
+from conditional import make_etag, not_modified, with_validators
+from checkout import to_paise
+from jobs import enqueue_failure, enqueue_finalize, job_status
+from payments import GatewayBusy, init_gateway
+from passwords import HasherBusy, PasswordHasher
+from images import ImageBusy, ImagePipeline, InvalidImage
+from metrics import init_metrics, track
+from pagination import encode_cursor, encode_key, decode_cursor
+from fragments import FragmentCache, personalize, placeholder_csrf_token
+from idsets import MembershipCache
+import autocomplete
+import search_index as search_rows
+from autocomplete import Autocomplete
+from search_index import SearchIndex
+import sampling
+from sampling import SamplePool
+import facets
+from facets import FacetIndex
+import recommend
+from recommend import Recommender
 
 # ══════════════════════════════════════
 # APP SETUP
@@ -29,28 +57,356 @@ app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024  # 2MB max
 RAZORPAY_KEY_ID     = 'rzp_test_SKIe1sKK4EMoni'   # ← Replace with yours
 RAZORPAY_KEY_SECRET = 's2nLhLjbnOhXPuqWvey3isBW'    # ← Replace with yours
 
+# One keep-alive client per worker; a slow gateway costs a request at most
+# (retries + 1) × connect timeout + read timeout + backoff.
+# RAZORPAY_BASE_URL points the client at fake_razorpay.py for offline testing.
+app.config['RAZORPAY_BASE_URL']        = os.environ.get('RAZORPAY_BASE_URL')
+app.config['RAZORPAY_CONNECT_TIMEOUT'] = float(os.environ.get('RAZORPAY_CONNECT_TIMEOUT', 3))  # seconds
+app.config['RAZORPAY_READ_TIMEOUT']    = float(os.environ.get('RAZORPAY_READ_TIMEOUT', 10))    # seconds
+app.config['RAZORPAY_RETRIES']         = int(os.environ.get('RAZORPAY_RETRIES', 2))
+app.config['RAZORPAY_WORKERS']         = int(os.environ.get('RAZORPAY_WORKERS', 8))
+
+payment_gateway = init_gateway(app, RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET)
+
 # ── CSRF Protection ──
 csrf = CSRFProtect(app)
 
 # ══════════════════════════════════════
-# DATABASE CONNECTION
+# SESSIONS (signed cookie or server-side)
 # ══════════════════════════════════════
-import os
-import pymysql
-from urllib.parse import urlparse
+# SESSION_STORE=memory | sqlite:///path | unix:///path keeps session data on
+# the server and only a signed id in the cookie (see sessions.py); the
+# cart / favourites working set can then be much bigger.
+app.config['SESSION_STORE']      = os.environ.get('SESSION_STORE', 'cookie')
+app.config['SESSION_LOCAL_SIZE'] = int(os.environ.get('SESSION_LOCAL_SIZE', 4096))  # entries
 
-DATABASE_URL = os.environ.get("DATABASE_URL")
+session_store = init_sessions(app)
 
-url = urlparse(DATABASE_URL)
+# ══════════════════════════════════════
+# STATIC ASSET BUNDLES
+# ══════════════════════════════════════
+# asset_url('css/site.css') in templates → fingerprinted, minified bundle
+# from build_assets.py, served as immutable at /assets/ (by nginx in
+# production; see README)
+init_assets(app)
+
+# ══════════════════════════════════════
+# PASSWORD HASHING (bcrypt process pool)
+# ══════════════════════════════════════
+# Logins beyond workers + queue in flight are turned away at once (503)
+# instead of stalling the other routes. Raising BCRYPT_ROUNDS re-hashes
+# each user at the new cost on their next login.
+app.config['BCRYPT_ROUNDS']         = int(os.environ.get('BCRYPT_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_QUEUE']   = int(os.environ.get('PASSWORD_HASH_QUEUE',
+                                                         4 * app.config['PASSWORD_HASH_WORKERS']))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))  # seconds
+
+password_hasher = PasswordHasher(
+    rounds    = app.config['BCRYPT_ROUNDS'],
+    workers   = app.config['PASSWORD_HASH_WORKERS'],
+    max_queue = app.config['PASSWORD_HASH_QUEUE'],
+    timeout   = app.config['PASSWORD_HASH_TIMEOUT'],
+)
 
-connection = pymysql.connect(
-    host=url.hostname,
-    user=url.username,
-    password=url.password,
-    database=url.path[1:],   # remove /
-    port=url.port,
-    cursorclass=pymysql.cursors.DictCursor
+# ══════════════════════════════════════
+# IMAGE UPLOADS (decode + thumbnail pool)
+# ══════════════════════════════════════
+# Profile pictures are decoded and cut to small WebP/JPEG thumbnails in
+# these processes, never on a request thread; uploads beyond workers +
+# queue get a "try again" instead of waiting. Thumbnails are served
+# immutable from /avatars/ (see avatars.py, and `python avatars.py gc`).
+app.config['IMAGE_WORKERS'] = int(os.environ.get('IMAGE_WORKERS', min(2, os.cpu_count() or 1)))
+app.config['IMAGE_QUEUE']   = int(os.environ.get('IMAGE_QUEUE', 4 * app.config['IMAGE_WORKERS']))
+app.config['IMAGE_TIMEOUT'] = float(os.environ.get('IMAGE_TIMEOUT', 15))  # seconds
+
+image_pipeline = ImagePipeline(
+    workers   = app.config['IMAGE_WORKERS'],
+    max_queue = app.config['IMAGE_QUEUE'],
+    timeout   = app.config['IMAGE_TIMEOUT'],
 )
+init_avatars(app)
+
+# ══════════════════════════════════════
+# DATABASE CONNECTION POOL
+# ══════════════════════════════════════
+# Size DB_POOL_MAX_SIZE to at least the gunicorn --threads count per worker;
+# /health/db shows in-use and wait-time numbers to check the sizing.
+app.config['DATABASE_URL']          = os.environ.get('DATABASE_URL')
+app.config['DB_POOL_MIN_SIZE']      = int(os.environ.get('DB_POOL_MIN_SIZE', 2))
+app.config['DB_POOL_MAX_SIZE']      = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+app.config['DB_POOL_TIMEOUT']       = float(os.environ.get('DB_POOL_TIMEOUT', 5))        # seconds
+app.config['DB_POOL_RECYCLE']       = int(os.environ.get('DB_POOL_RECYCLE', 1800))      # seconds
+app.config['DB_POOL_PING_INTERVAL'] = int(os.environ.get('DB_POOL_PING_INTERVAL', 30))  # seconds
+app.config['DB_POOL_IDLE_TIMEOUT']  = int(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))  # seconds
+
+db_pool = init_pool(app)
+
+# ══════════════════════════════════════
+# REQUEST METRICS (/metrics)
+# ══════════════════════════════════════
+# Per-endpoint latency, SQL count/time, render and gateway time. Requests
+# slower than SLOW_REQUEST_SECONDS are printed with every query (0 = off).
+app.config['SLOW_REQUEST_SECONDS'] = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))  # seconds
+
+metrics = init_metrics(app, db_pool)
+
+# ══════════════════════════════════════
+# CATALOG CACHE (products + categories)
+# ══════════════════════════════════════
+app.config['CATALOG_CACHE_TTL']  = int(os.environ.get('CATALOG_CACHE_TTL', 300))   # seconds
+app.config['CATALOG_CACHE_SIZE'] = int(os.environ.get('CATALOG_CACHE_SIZE', 2048)) # entries
+
+catalog = CatalogCache(maxsize=app.config['CATALOG_CACHE_SIZE'],
+                       ttl=app.config['CATALOG_CACHE_TTL'])
+
+# ══════════════════════════════════════
+# PRODUCT IMAGES (/img/ variants)
+# ══════════════════════════════════════
+# product_image(product, 'thumb' | 'card' | 'hero') in templates → a local
+# resized copy of image_url, fetched once in the background and then
+# served as immutable (see product_images.py; import_catalog.py pre-warms).
+app.config['PRODUCT_IMAGE_FOLDER']          = os.environ.get('PRODUCT_IMAGE_FOLDER',
+                                                             'static/product_images')
+app.config['PRODUCT_IMAGE_CONNECT_TIMEOUT'] = float(os.environ.get('PRODUCT_IMAGE_CONNECT_TIMEOUT', 3))  # seconds
+app.config['PRODUCT_IMAGE_READ_TIMEOUT']    = float(os.environ.get('PRODUCT_IMAGE_READ_TIMEOUT', 10))   # seconds
+app.config['PRODUCT_IMAGE_FETCH_THREADS']   = int(os.environ.get('PRODUCT_IMAGE_FETCH_THREADS', 4))
+
+def _product_image_source(product_id):
+    product = catalog.cached_product(product_id) or catalog.product(get_db(), product_id)
+    return product['image_url'] if product else None
+
+product_images = init_product_images(app, image_pipeline, _product_image_source)
+
+# ══════════════════════════════════════
+# SEARCH INDEX + AUTOCOMPLETE TRIE
+# ══════════════════════════════════════
+app.config['SEARCH_INDEX_MAX_AGE'] = int(os.environ.get('SEARCH_INDEX_MAX_AGE', 600))  # seconds
+
+search_index = SearchIndex()
+completer    = Autocomplete(k=8)
+_index_build_lock = threading.Lock()
+
+def _build_search(conn):
+    # Trie first: the index's version bump is what /search validators see
+    completer.build(autocomplete.load_rows(conn))
+    search_index.build(search_rows.load_rows(conn))
+
+# ══════════════════════════════════════
+# FACETED BROWSE (/products)
+# ══════════════════════════════════════
+# Price/rating/category filters and their counts from NumPy columns of the
+# catalog (see facets.py); rebuilt every FACET_INDEX_MAX_AGE seconds.
+app.config['FACET_INDEX_MAX_AGE'] = int(os.environ.get('FACET_INDEX_MAX_AGE', 600))  # seconds
+
+facet_index = FacetIndex()
+_facet_build_lock = threading.Lock()
+
+def _build_facets(conn):
+    facet_index.build(facets.load_rows(conn))
+
+# ══════════════════════════════════════
+# RANDOM PICKS (replaces ORDER BY RAND())
+# ══════════════════════════════════════
+app.config['SAMPLE_POOL_MAX_AGE'] = int(os.environ.get('SAMPLE_POOL_MAX_AGE', 300))  # seconds
+
+sample_pool = SamplePool()
+_sample_build_lock = threading.Lock()
+
+def _build_samples(conn):
+    sample_pool.build(sampling.load_rows(conn))
+
+# ══════════════════════════════════════
+# "USERS ALSO BOUGHT" RECOMMENDATIONS
+# ══════════════════════════════════════
+# Rebuilt from all orders + favourites every RECOMMEND_MAX_AGE seconds;
+# in between, new order lines and favourites are folded in every
+# RECOMMEND_REFRESH seconds.
+app.config['RECOMMEND_TOP_N']           = int(os.environ.get('RECOMMEND_TOP_N', 12))
+app.config['RECOMMEND_FAVORITE_WEIGHT'] = float(os.environ.get('RECOMMEND_FAVORITE_WEIGHT', 0.5))
+app.config['RECOMMEND_REFRESH']         = int(os.environ.get('RECOMMEND_REFRESH', 60))    # seconds
+app.config['RECOMMEND_MAX_AGE']         = int(os.environ.get('RECOMMEND_MAX_AGE', 3600))  # seconds
+
+recommender = Recommender(top_n=app.config['RECOMMEND_TOP_N'],
+                          favorite_weight=app.config['RECOMMEND_FAVORITE_WEIGHT'])
+_recommend_lock = threading.Lock()
+
+def _build_recommendations(conn):
+    recommender.build(recommend.load_order_lines(conn), recommend.load_favorites(conn))
+
+def _update_recommendations(conn):
+    recommender.update(recommend.load_order_lines(conn, recommender.lines_after),
+                       recommend.load_favorites(conn, recommender.favorites_after))
+
+# ══════════════════════════════════════
+# HELPER: KEEP IN-MEMORY STRUCTURES FRESH
+# ══════════════════════════════════════
+def _in_background(lock, build):
+    """Run build(conn) on a pooled connection in a thread, unless a run
+    holding `lock` is already going"""
+    if not lock.acquire(blocking=False):
+        return
+    def run():
+        conn = None
+        try:
+            conn = db_pool.acquire()
+            build(conn)
+        except Exception as e:
+            print(f"Background rebuild error: {e}")
+        finally:
+            if conn is not None:
+                db_pool.release(conn)
+            lock.release()
+    threading.Thread(target=run, daemon=True).start()
+
+def _ensure_fresh(structure, max_age, lock, build):
+    """Build on first use (in the request); once older than max_age,
+    rebuild in a background thread while the old copy keeps serving"""
+    if structure.built_at is None:
+        with lock:
+            if structure.built_at is None:
+                build(get_db())
+    elif time.monotonic() - structure.built_at > max_age:
+        _in_background(lock, build)
+    return structure
+
+def get_search_index():
+    return _ensure_fresh(search_index, app.config['SEARCH_INDEX_MAX_AGE'],
+                         _index_build_lock, _build_search)
+
+def get_sample_pool():
+    return _ensure_fresh(sample_pool, app.config['SAMPLE_POOL_MAX_AGE'],
+                         _sample_build_lock, _build_samples)
+
+def get_facet_index(wait=False):
+    """The facet index; until its first build is done, None (the build
+    runs in the background) unless wait=True builds it in the request"""
+    if wait or facet_index.is_built:
+        return _ensure_fresh(facet_index, app.config['FACET_INDEX_MAX_AGE'],
+                             _facet_build_lock, _build_facets)
+    _in_background(_facet_build_lock, _build_facets)
+    return None
+
+def get_recommender():
+    """The recommender, or None while its first build runs. Unlike the
+    search index it is never built inside a request - reading every order
+    takes too long - so callers fall back to random picks until then."""
+    now = time.monotonic()
+    if not recommender.is_built or now - recommender.built_at > app.config['RECOMMEND_MAX_AGE']:
+        _in_background(_recommend_lock, _build_recommendations)
+    elif now - recommender.updated_at > app.config['RECOMMEND_REFRESH']:
+        _in_background(_recommend_lock, _update_recommendations)
+    return recommender if recommender.is_built else None
+
+def refresh_products(db, product_ids):
+    """Call after writing products: drops cached rows, updates the
+    search index, autocomplete trie and random-pick pools in place"""
+    ids = set(product_ids)
+    if not ids:
+        return
+    rows      = {r['id']: r for r in search_rows.load_rows(db, ids)}
+    catalog.invalidate_products(ids, rows)
+    completes = ({r['id']: r for r in autocomplete.load_rows(db, ids)}
+                 if search_index.is_built else {})
+    for product_id in ids:
+        row = rows.get(product_id)
+        if row:
+            sample_pool.set_stock(product_id, row['category'], row['stock'])
+            if facet_index.is_built:
+                facet_index.upsert(row)
+            if search_index.is_built:
+                completer.upsert(completes[product_id])
+                search_index.upsert(row)
+        else:
+            sample_pool.remove(product_id)
+            facet_index.remove(product_id)
+            completer.remove(product_id)
+            search_index.remove(product_id)
+
+# ══════════════════════════════════════
+# CATALOG CHANGES FROM OTHER PROCESSES
+# ══════════════════════════════════════
+# import_catalog.py logs every product it writes to catalog_changes; each
+# worker polls that log and refreshes just those products. A backlog over
+# CATALOG_CHANGES_BATCH drops the whole catalog cache instead.
+app.config['CATALOG_CHANGES_POLL']  = float(os.environ.get('CATALOG_CHANGES_POLL', 5))  # seconds
+app.config['CATALOG_CHANGES_BATCH'] = int(os.environ.get('CATALOG_CHANGES_BATCH', 2000))
+
+catalog_feed = ChangeFeed(interval=app.config['CATALOG_CHANGES_POLL'],
+                          batch=app.config['CATALOG_CHANGES_BATCH'])
+
+@app.before_request
+def apply_catalog_changes():
+    if request.endpoint in ('static', 'asset', 'avatar') or not catalog_feed.due():
+        return
+    try:
+        db     = get_db()
+        result = catalog_feed.poll(db)
+        if result is None:
+            return
+        product_ids, too_many = result
+        if too_many:
+            catalog.clear()
+            search_index.mark_stale()
+            sample_pool.mark_stale()
+            facet_index.mark_stale()
+        else:
+            refresh_products(db, product_ids)
+    except Exception as e:
+        print(f"Catalog change feed error: {e}")
+
+def pick_products(db, k, category=sampling.ALL, exclude=()):
+    """k random in-stock product rows, fetched through the catalog cache"""
+    ids  = get_sample_pool().sample(k, category, exclude)
+    rows = catalog.products_by_ids(db, ids)
+    return [rows[i] for i in ids if i in rows]
+
+def recommended_products(db, k, user_id=None, product_id=None, category=sampling.ALL):
+    """k in-stock "users also bought" rows: neighbours of product_id, or
+    picks for user_id (best sellers if they have no history yet), topped
+    up with random in-stock picks"""
+    rec = get_recommender()
+    ids = []
+    if rec is not None and product_id is not None:
+        ids = rec.neighbours(product_id, 3 * k)
+    elif rec is not None:
+        ids = rec.for_user(user_id, 3 * k) if user_id else []
+        if not ids:
+            best = rec.popular(8 * k)
+            ids  = random.sample(best, min(len(best), 3 * k))
+    rows  = catalog.products_by_ids(db, ids)
+    picks = [rows[i] for i in ids if i in rows and (rows[i]['stock'] or 0) > 0][:k]
+    if len(picks) < k:
+        exclude = {p['id'] for p in picks} | {product_id}
+        picks  += pick_products(db, k - len(picks), category=category, exclude=exclude)
+    return picks
+
+# ══════════════════════════════════════
+# HOME PAGE FRAGMENT CACHE
+# ══════════════════════════════════════
+app.config['FRAGMENT_CACHE_TTL'] = int(os.environ.get('FRAGMENT_CACHE_TTL', 300))  # seconds
+
+fragment_cache = FragmentCache(ttl=app.config['FRAGMENT_CACHE_TTL'])
+
+def _render_fragment(template, **context):
+    return render_template(template, csrf_token=placeholder_csrf_token, **context)
+
+def home_fragments():
+    """Slider, category strip and featured grid - rendered once per catalog
+    version, then only this visitor's CSRF token is filled in"""
+    version = catalog.version
+    html = {
+        'slider': fragment_cache.get_or_render('slider', version, lambda: _render_fragment(
+            'partials/home_slider.html',
+            slider_products=catalog.featured(get_db(), 12)[:5])),
+        'categories': fragment_cache.get_or_render('categories', version, lambda: _render_fragment(
+            'partials/home_categories.html',
+            categories=catalog.categories(get_db()))),
+        'featured': fragment_cache.get_or_render('featured', version, lambda: _render_fragment(
+            'partials/home_featured.html',
+            featured_products=catalog.featured(get_db(), 12))),
+    }
+    return {name: personalize(fragment, generate_csrf) for name, fragment in html.items()}
 
 # ══════════════════════════════════════
 # HELPER: ALLOWED IMAGE EXTENSIONS
@@ -78,12 +434,63 @@ def login_required(f):
     return decorated_function
 
 # ══════════════════════════════════════
-# HELPER: GET CART COUNT
+# HELPER: CART STATE + CART COUNT
 # ══════════════════════════════════════
-def get_cart_count(user_id):
-    """Returns total number of items in user's cart"""
-    if not user_id:
-        return 0
+# The cart lines {cart id: (product id, quantity)} and the badge count live
+# in the session and are kept current by every cart write below, so the
+# badge and the AJAX totals need no cart query. They are re-read from the
+# cart table once older than CART_COUNT_MAX_AGE, or as soon as a write
+# shows they drifted (e.g. the cart changed from another browser).
+app.config['CART_COUNT_MAX_AGE'] = int(os.environ.get('CART_COUNT_MAX_AGE', 300))  # seconds
+# Bigger carts keep only the count (cookie size; roomier server-side)
+CART_LINES_MAX = 100 if session_store is None else 2000
+
+def set_cart_count(count):
+    """Store an exact count (one just read from or written to the cart table)"""
+    session['cart_count']    = int(count)
+    session['cart_count_at'] = time.time()
+
+def store_cart_lines(lines):
+    """Store exact cart lines and the count that follows from them"""
+    if len(lines) <= CART_LINES_MAX:
+        session['cart_lines'] = {str(cart_id): [product_id, qty]
+                                 for cart_id, (product_id, qty) in lines.items()}
+    else:
+        session.pop('cart_lines', None)
+    set_cart_count(sum(qty for _, qty in lines.values()))
+
+def cached_cart_lines():
+    """Cart lines from the session, or None if unknown or too old"""
+    raw = session.get('cart_lines')
+    age = time.time() - session.get('cart_count_at', 0)
+    if raw is None or age >= app.config['CART_COUNT_MAX_AGE']:
+        return None
+    return {int(cart_id): (product_id, qty) for cart_id, (product_id, qty) in raw.items()}
+
+def load_cart_lines(db, user_id):
+    """Re-read the user's cart lines from the table (reconciliation path)"""
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT id, product_id, quantity FROM cart WHERE user_id = %s", (user_id,)
+    )
+    lines = {r['id']: (r['product_id'], r['quantity']) for r in cursor.fetchall()}
+    cursor.close()
+    store_cart_lines(lines)
+    return lines
+
+def cart_stamp():
+    """When the session's cart lines were stored (None if they aren't)"""
+    return session.get('cart_count_at') if 'cart_lines' in session else None
+
+def cart_totals(db, lines):
+    """(total price, item count) using cached product prices - no cart join"""
+    prices = catalog.products_by_ids(db, {product_id for product_id, _ in lines.values()})
+    total  = sum(float(prices[product_id]['price']) * qty
+                 for product_id, qty in lines.values() if product_id in prices)
+    return total, sum(qty for _, qty in lines.values())
+
+def reconcile_cart_count(user_id):
+    """Re-read the count from the cart table and store it in the session"""
     try:
         db = get_db()
         cursor = db.cursor()
@@ -94,58 +501,137 @@ def get_cart_count(user_id):
         result = cursor.fetchone()
         cursor.close()
         db.close()
-        return int(result['total']) if result else 0
-    except:
+    except Exception:
+        return session.get('cart_count', 0)
+    set_cart_count(result['total'] if result else 0)
+    return session['cart_count']
+
+def get_cart_count(user_id):
+    """Returns total number of items in user's cart"""
+    if not user_id:
         return 0
+    cached = session.get('cart_count')
+    age    = time.time() - session.get('cart_count_at', 0)
+    if cached is not None and age < app.config['CART_COUNT_MAX_AGE']:
+        return cached
+    return reconcile_cart_count(user_id)
+
+# ══════════════════════════════════════
+# HELPER: FAVOURITE IDS (cached in session)
+# ══════════════════════════════════════
+# Newest first. Kept current by toggle_favorite and re-read once older
+# than FAVORITES_MAX_AGE; the product rows come from the catalog cache.
+app.config['FAVORITES_MAX_AGE'] = int(os.environ.get('FAVORITES_MAX_AGE', 300))  # seconds
+# Bigger lists are re-read each time (cookie size; roomier server-side)
+FAVORITES_MAX = 200 if session_store is None else 5000
+
+def store_favorite_ids(ids):
+    if len(ids) <= FAVORITES_MAX:
+        session['fav_ids']    = list(ids)
+        session['fav_ids_at'] = time.time()
+    else:
+        session.pop('fav_ids', None)
+
+def get_favorite_ids(db, user_id):
+    cached = session.get('fav_ids')
+    age    = time.time() - session.get('fav_ids_at', 0)
+    if cached is not None and age < app.config['FAVORITES_MAX_AGE']:
+        return cached
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT product_id FROM favorites
+        WHERE user_id = %s
+        ORDER BY added_at DESC
+    """, (user_id,))
+    ids = [r['product_id'] for r in cursor.fetchall()]
+    cursor.close()
+    store_favorite_ids(ids)
+    return ids
+
+def favorite_stamp():
+    return session.get('fav_ids_at') if 'fav_ids' in session else None
+
+# ══════════════════════════════════════
+# HELPER: FAVOURITE / CART MEMBERSHIP SETS
+# ══════════════════════════════════════
+# Listing cards ask "is this a favourite / in the cart?" - answered from a
+# compact per-user IdSet (see idsets.py) that toggle_favorite and the cart
+# routes update in place, instead of a list scan per card.
+app.config['MEMBERSHIP_CACHE_SIZE'] = int(os.environ.get('MEMBERSHIP_CACHE_SIZE', 10000))  # entries
+
+member_sets = MembershipCache(maxsize=app.config['MEMBERSHIP_CACHE_SIZE'],
+                              ttl=max(app.config['FAVORITES_MAX_AGE'], app.config['CART_COUNT_MAX_AGE']))
+
+def favorite_set(db, user_id):
+    ids = get_favorite_ids(db, user_id)
+    return member_sets.get('fav', user_id, favorite_stamp(), ids)
+
+def cart_set(lines, user_id):
+    return member_sets.get('cart', user_id, cart_stamp(),
+                           (product_id for product_id, _ in lines.values()))
+
+# ══════════════════════════════════════
+# CONDITIONAL RESPONSES (ETag / 304)
+# ══════════════════════════════════════
+# Product and listing pages are validated from catalog timestamps plus
+# the session values they render, and answer 304 before any query when
+# the browser's copy is current. /search JSON is the same for everyone:
+# public, cacheable for SEARCH_CACHE_SECONDS, validated by index version.
+app.config['SEARCH_CACHE_SECONDS'] = int(os.environ.get('SEARCH_CACHE_SECONDS', 30))  # seconds
+
+def visitor_state(cart_lines=False, favorites=False):
+    """Session values rendered into the page, or None if one of them is
+    too old (or too big) to be trusted without a query"""
+    if session.get('_flashes'):
+        return None
+    # Every page carries the CSRF token (base.html); with no token yet,
+    # rendering the page is what creates one
+    csrf_token = session.get('csrf_token')
+    if csrf_token is None:
+        return None
+    now = time.time()
+    if now - session.get('cart_count_at', 0) >= app.config['CART_COUNT_MAX_AGE']:
+        return None
+    if cart_lines and session.get('cart_lines') is None:
+        return None
+    if favorites and (session.get('fav_ids') is None or
+                      now - session.get('fav_ids_at', 0) >= app.config['FAVORITES_MAX_AGE']):
+        return None
+    return (csrf_token, session.get('user_id'), session.get('user_name'),
+            session.get('cart_count'), session.get('cart_lines') if cart_lines else None,
+            session.get('fav_ids') if favorites else None)
+
+def cached_page(key, last_modified, **needs):
+    """304 if the browser's copy of this page is current, else None"""
+    state = visitor_state(**needs)
+    if state is None or last_modified is None:
+        return None
+    return not_modified(make_etag(key, state), last_modified)
+
+def validated_page(html, key, last_modified, **needs):
+    """The rendered page with validators for the next cached_page() check"""
+    response = make_response(html)
+    state    = visitor_state(**needs)
+    if state is not None and last_modified is not None:
+        with_validators(response, make_etag(key, state), last_modified)
+    return response
 
 # ══════════════════════════════════════════════════════════
 # ROUTE 1: HOME PAGE
 # ══════════════════════════════════════════════════════════
 @app.route('/')
 def home():
-    db = get_db()
-    cursor = db.cursor()
+    # Hero slider, categories and featured grid (cached, shared by everyone)
+    fragments = home_fragments()
 
-    # Featured products (top rated, in stock)
-    cursor.execute("""
-        SELECT * FROM products
-        WHERE stock > 0
-        ORDER BY rating DESC
-        LIMIT 12
-    """)
-    featured_products = cursor.fetchall()
-
-    # Hero slider products (top 5)
-    cursor.execute("""
-        SELECT * FROM products
-        WHERE stock > 0
-        ORDER BY rating DESC
-        LIMIT 5
-    """)
-    slider_products = cursor.fetchall()
-
-    # All categories
-    cursor.execute("SELECT DISTINCT category FROM products ORDER BY category")
-    categories = cursor.fetchall()
-
-    # AI Recommendations - "Users also bought" (random popular products)
-    cursor.execute("""
-        SELECT * FROM products
-        WHERE stock > 0
-        ORDER BY RAND()
-        LIMIT 6
-    """)
-    recommended = cursor.fetchall()
-
-    cursor.close()
-    db.close()
+    # AI Recommendations - "Users also bought" (co-purchases of what this
+    # shopper bought or favourited; best sellers when logged out)
+    recommended = recommended_products(get_db(), 6, user_id=session.get('user_id'))
 
     cart_count = get_cart_count(session.get('user_id'))
 
     return render_template('home.html',
-                           featured_products=featured_products,
-                           slider_products=slider_products,
-                           categories=categories,
+                           fragments=fragments,
                            recommended=recommended,
                            cart_count=cart_count)
 
@@ -181,10 +667,12 @@ def register():
             return render_template('register.html')
 
         # ── Hash password with bcrypt (SECURITY) ──
-        hashed_password = bcrypt.hashpw(
-            password.encode('utf-8'),
-            bcrypt.gensalt()
-        ).decode('utf-8')
+        try:
+            with track('hashing'):
+                hashed_password = password_hasher.hash(password)
+        except HasherBusy:
+            flash('We are busy right now. Please try again in a moment.', 'error')
+            return render_template('register.html'), 503
 
         db = get_db()
         cursor = db.cursor()
@@ -241,11 +729,19 @@ def login():
         cursor.close()
         db.close()
 
-        # Check password using bcrypt
-        if user and bcrypt.checkpw(
-            password.encode('utf-8'),
-            user['password'].encode('utf-8')
-        ):
+        # Check password using bcrypt (on the hashing pool)
+        try:
+            with track('hashing'):
+                valid = bool(user) and password_hasher.verify(password, user['password'])
+        except HasherBusy:
+            flash('Too many logins right now. Please try again in a moment.', 'error')
+            return render_template('login.html'), 503
+
+        if valid:
+            # Upgrade hashes made with an older BCRYPT_ROUNDS
+            if password_hasher.needs_rehash(user['password']):
+                rehash_password(user['id'], password)
+
             # Set session variables
             session.permanent  = True
             session['user_id']    = user['id']
@@ -260,6 +756,25 @@ def login():
 
     return render_template('login.html')
 
+def rehash_password(user_id, password):
+    """Store a new hash at the current cost; skipped if the pool is busy"""
+    hashed = password_hasher.rehash(password)
+    if hashed is None:
+        return
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.execute(
+            "UPDATE users SET password = %s WHERE id = %s", (hashed, user_id)
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"Rehash error: {e}")
+    finally:
+        cursor.close()
+        db.close()
+
 # ══════════════════════════════════════════════════════════
 # ROUTE 4: LOGOUT
 # ══════════════════════════════════════════════════════════
@@ -275,43 +790,58 @@ def logout():
 @app.route('/profile')
 @login_required
 def profile():
+    per_page      = 10
+    fav_per_page  = 24
+    before        = decode_cursor(request.args.get('orders_before'))
+
     db = get_db()
     cursor = db.cursor()
 
-    # Get user details
+    # Get user details (order_count / total_spent are kept by checkout)
     cursor.execute(
         "SELECT * FROM users WHERE id = %s", (session['user_id'],)
     )
     user = cursor.fetchone()
 
-    # Get order history
-    cursor.execute("""
-        SELECT o.*, COUNT(oi.id) as item_count
-        FROM orders o
-        LEFT JOIN order_items oi ON o.id = oi.order_id
-        WHERE o.user_id = %s
-        GROUP BY o.id
-        ORDER BY o.created_at DESC
-    """, (session['user_id'],))
+    # One page of order history, newest first - keyset on
+    # idx_user_created, so page N costs the same as page 1
+    if before:
+        cursor.execute("""
+            SELECT * FROM orders
+            WHERE user_id = %s AND (created_at, id) < (%s, %s)
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (session['user_id'], before[0], before[1], per_page + 1))
+    else:
+        cursor.execute("""
+            SELECT * FROM orders
+            WHERE user_id = %s
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (session['user_id'], per_page + 1))
     orders = cursor.fetchall()
+    cursor.close()
 
-    # Get favourites
-    cursor.execute("""
-        SELECT p.* FROM favorites f
-        JOIN products p ON f.product_id = p.id
-        WHERE f.user_id = %s
-        ORDER BY f.added_at DESC
-    """, (session['user_id'],))
-    favorites = cursor.fetchall()
+    next_cursor = ''
+    if len(orders) > per_page:
+        orders      = orders[:per_page]
+        next_cursor = encode_key(orders[-1]['created_at'], orders[-1]['id'])
+
+    # Favourites: ids from the session, rows from the catalog cache
+    fav_ids   = get_favorite_ids(db, session['user_id'])
+    rows      = catalog.products_by_ids(db, fav_ids[:fav_per_page])
+    favorites = [rows[i] for i in fav_ids[:fav_per_page] if i in rows]
 
     cart_count = get_cart_count(session['user_id'])
-    cursor.close()
     db.close()
 
     return render_template('user_profile.html',
                            user=user,
                            orders=orders,
+                           older_orders=next_cursor,
+                           newer_orders=before is not None,
                            favorites=favorites,
+                           favorite_count=len(fav_ids),
                            cart_count=cart_count)
 
 # ══════════════════════════════════════════════════════════
@@ -322,27 +852,34 @@ def profile():
 def update_profile():
     name   = request.form.get('name', '').strip()
     mobile = request.form.get('mobile', '').strip()
+    file   = request.files.get('profile_image')
+
+    # Streamed to disk and thumbnailed on the image pool before a DB
+    # connection is taken; the original upload is not kept
+    image = None
+    if file and file.filename and allowed_file(file.filename):
+        try:
+            with track('image'):
+                image = save_avatar(image_pipeline, file, app.config['UPLOAD_FOLDER'],
+                                    app.config['MAX_CONTENT_LENGTH'])
+        except InvalidImage:
+            flash('That file is not a usable image. Please upload a JPEG, PNG, GIF or WebP.', 'error')
+            return redirect(url_for('profile'))
+        except ImageBusy:
+            flash('We are busy right now. Please try again in a moment.', 'error')
+            return redirect(url_for('profile'))
 
     db = get_db()
     cursor = db.cursor()
     try:
-        if 'profile_image' in request.files:
-            file = request.files['profile_image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(
-                    f"user_{session['user_id']}_{file.filename}"
-                )
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-                cursor.execute("""
-                    UPDATE users SET name=%s, mobile=%s, profile_image=%s
-                    WHERE id=%s
-                """, (name, mobile, filename, session['user_id']))
-            else:
-                cursor.execute(
-                    "UPDATE users SET name=%s, mobile=%s WHERE id=%s",
-                    (name, mobile, session['user_id'])
-                )
+        old_image = None
+        if image:
+            cursor.execute("SELECT profile_image FROM users WHERE id=%s", (session['user_id'],))
+            old_image = (cursor.fetchone() or {}).get('profile_image')
+            cursor.execute("""
+                UPDATE users SET name=%s, mobile=%s, profile_image=%s
+                WHERE id=%s
+            """, (name, mobile, image, session['user_id']))
         else:
             cursor.execute(
                 "UPDATE users SET name=%s, mobile=%s WHERE id=%s",
@@ -350,6 +887,9 @@ def update_profile():
             )
 
         db.commit()
+        if image and old_image != image:
+            # Thumbnails nobody points at any more (`avatars.py gc` catches the rest)
+            discard_avatar(cursor, app.config['UPLOAD_FOLDER'], old_image)
         session['user_name'] = name
         flash('✅ Profile updated successfully!', 'success')
 
@@ -368,74 +908,108 @@ def update_profile():
 @app.route('/products')
 @login_required
 def products():
-    category = request.args.get('category', '').strip()
+    selected = [c.strip() for c in request.args.getlist('category') if c.strip()]
+    category = selected[0] if len(selected) == 1 else ''
     sort     = request.args.get('sort', '').strip()
     page     = max(1, int(request.args.get('page', 1)))
+    after    = decode_cursor(request.args.get('after'))
+    before   = decode_cursor(request.args.get('before'))
     per_page = 20
-    offset   = (page - 1) * per_page
-
-    db = get_db()
-    cursor = db.cursor()
 
-    # Build dynamic query
-    where  = "WHERE stock > 0"
-    params = []
+    # Facet filters: any number of categories and price buckets, one minimum rating
+    price_buckets = sorted({int(b) for b in request.args.getlist('price')
+                            if b.isdigit() and int(b) <= len(facets.PRICE_EDGES)})
+    min_rating    = request.args.get('rating', type=int)
+    if min_rating not in facets.RATING_STEPS:
+        min_rating = None
+
+    # Nothing in the catalog or this shopper's cart/favourites changed since
+    # their last view of this exact page → 304 without touching MySQL
+    page_key = ('products', request.query_string)
+    cached   = cached_page(page_key, catalog.last_modified(),
+                           cart_lines=True, favorites=True)
+    if cached:
+        return cached
 
-    if category:
-        where += " AND category = %s"
-        params.append(category)
-
-    order = {
-        'price_asc':  "ORDER BY price ASC",
-        'price_desc': "ORDER BY price DESC",
-        'rating':     "ORDER BY rating DESC",
-    }.get(sort, "ORDER BY id DESC")
+    db = get_db()
 
-    cursor.execute(
-        f"SELECT * FROM products {where} {order} LIMIT %s OFFSET %s",
-        params + [per_page, offset]
-    )
-    products_list = cursor.fetchall()
+    # Page + counts for every facet in one pass over the column arrays. Until
+    # the index is first built, plain category/sort listings use the keyset
+    # SQL path below; filters it can't express wait for the build. The
+    # keyset path (Prev/Next cursors, cached page anchors) is warm-up only:
+    # once the index is up, pages are slices of it and an after/before
+    # cursor from a warm-up page is ignored in favour of `page`.
+    filtered = len(selected) > 1 or bool(price_buckets or min_rating)
+    index    = get_facet_index(wait=filtered)
+    result   = None
+    if index is not None:
+        result = index.query(selected, price_buckets, min_rating, sort,
+                             offset=(page - 1) * per_page, limit=per_page)
+        rows          = catalog.products_by_ids(db, result.ids)
+        products_list = [rows[i] for i in result.ids if i in rows]
+        total         = result.total
+        prev_cursor   = next_cursor = ''
+    else:
+        # Total count for pagination (cached, one GROUP BY for all categories)
+        total = catalog.count(db, category)
+
+        # Keyset pagination: Prev/Next carry a cursor; numbered links jump via
+        # the cached page-boundary keys, so no page ever needs an OFFSET scan
+        if after or before:
+            products_list = catalog.listing(db, category, sort, per_page,
+                                            after=after, before=before)
+        elif page == 1:
+            products_list = catalog.listing(db, category, sort, per_page)
+        else:
+            anchors = catalog.page_anchors(db, category, sort, per_page)
+            if page - 2 < len(anchors):
+                products_list = catalog.listing(db, category, sort, per_page,
+                                                after=anchors[page - 2])
+            else:
+                products_list = []
 
-    # Total count for pagination
-    cursor.execute(
-        f"SELECT COUNT(*) as total FROM products {where}",
-        params
-    )
-    total      = cursor.fetchone()['total']
+        prev_cursor = encode_cursor(sort, products_list[0])  if products_list else ''
+        next_cursor = encode_cursor(sort, products_list[-1]) if products_list else ''
     total_pages = max(1, (total + per_page - 1) // per_page)
 
-    # All categories
-    cursor.execute("SELECT DISTINCT category FROM products ORDER BY category")
-    categories = cursor.fetchall()
+    # All categories (the facet counts carry their own)
+    categories = catalog.categories(db) if result is None else []
 
     # User's favourites and cart items (to show active states)
-    cursor.execute(
-        "SELECT product_id FROM favorites WHERE user_id = %s",
-        (session['user_id'],)
-    )
-    fav_ids = [r['product_id'] for r in cursor.fetchall()]
-
-    cursor.execute(
-        "SELECT product_id FROM cart WHERE user_id = %s",
-        (session['user_id'],)
-    )
-    cart_ids = [r['product_id'] for r in cursor.fetchall()]
+    fav_ids = favorite_set(db, session['user_id'])
+    lines   = cached_cart_lines()
+    if lines is None:
+        lines = load_cart_lines(db, session['user_id'])
+    cart_ids = cart_set(lines, session['user_id'])
 
     cart_count = get_cart_count(session['user_id'])
-    cursor.close()
+    modified   = catalog.last_modified(db)
     db.close()
 
-    return render_template('products.html',
+    # Current filters as a query string, for the pagination links
+    filter_query = urlencode([('category', c) for c in selected] + [('sort', sort)] +
+                             [('price', b) for b in price_buckets] +
+                             ([('rating', min_rating)] if min_rating else []))
+
+    html = render_template('products.html',
                            products=products_list,
                            categories=categories,
-                           current_category=category,
+                           facets=result,
+                           selected_categories=selected,
+                           price_buckets=price_buckets,
+                           min_rating=min_rating,
+                           filter_query=filter_query,
+                           current_category=', '.join(selected),
                            current_sort=sort,
                            page=page,
+                           total=total,
                            total_pages=total_pages,
+                           prev_cursor=prev_cursor,
+                           next_cursor=next_cursor,
                            fav_ids=fav_ids,
                            cart_ids=cart_ids,
                            cart_count=cart_count)
+    return validated_page(html, page_key, modified, cart_lines=True, favorites=True)
 
 # ══════════════════════════════════════════════════════════
 # ROUTE 8: PRODUCT DETAIL PAGE
@@ -443,33 +1017,33 @@ def products():
 @app.route('/product/<int:product_id>')
 @login_required
 def product_detail(product_id):
+    # Validated by the product's own updated_at (the related picks may go
+    # stale in the browser's copy - they are random anyway)
+    product = catalog.cached_product(product_id)
+    if product:
+        cached = cached_page(('product', product_id), product.get('updated_at'))
+        if cached:
+            return cached
+
     db = get_db()
-    cursor = db.cursor()
 
-    cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
-    product = cursor.fetchone()
+    product = catalog.product(db, product_id)
 
     if not product:
         flash('Product not found!', 'error')
         return redirect(url_for('products'))
 
-    # Related products (same category, different product)
-    cursor.execute("""
-        SELECT * FROM products
-        WHERE category = %s AND id != %s AND stock > 0
-        ORDER BY RAND()
-        LIMIT 4
-    """, (product['category'], product_id))
-    related = cursor.fetchall()
+    # Related products (bought together with this one, then same category)
+    related = recommended_products(db, 4, product_id=product_id,
+                                   category=product['category'])
 
     cart_count = get_cart_count(session['user_id'])
-    cursor.close()
-    db.close()
 
-    return render_template('product_detail.html',
+    html = render_template('product_detail.html',
                            product=product,
                            related=related,
                            cart_count=cart_count)
+    return validated_page(html, ('product', product_id), product.get('updated_at'))
 
 # ══════════════════════════════════════════════════════════
 # ROUTE 9: LIVE SEARCH (AJAX - returns JSON)
@@ -477,56 +1051,36 @@ def product_detail(product_id):
 @app.route('/search')
 def search():
     query = request.args.get('q', '').strip()
+    public = f"public, max-age={app.config['SEARCH_CACHE_SECONDS']}"
 
     if not query or len(query) < 2:
-        return jsonify({'products': [], 'suggestions': []})
-
-    db = get_db()
-    cursor = db.cursor()
-
-    # Search products
-    cursor.execute("""
-        SELECT id, name, price, image_url, category, rating
-        FROM products
-        WHERE (name LIKE %s OR category LIKE %s) AND stock > 0
-        LIMIT 8
-    """, (f'%{query}%', f'%{query}%'))
-    products_found = cursor.fetchall()
+        response = jsonify({'products': [], 'suggestions': []})
+        response.headers['Cache-Control'] = public
+        return response
+
+    # The index version is per process, hence the pid in the tag
+    index = get_search_index()
+    etag  = make_etag('search', os.getpid(), index.version, query)
+    cached = not_modified(etag, cache_control=public)
+    if cached:
+        return cached
+
+    # Ranked product matches (name/category substring or all words), with
+    # the dropdown-sized image instead of the original
+    products_found = [dict(p.as_json(), image_url=image_url_for(p.id, p.image_url, 'thumb'))
+                      for p in index.search(query, limit=8)]
 
     # Build smart suggestions like "jeans for Men", "jeans for Women"
-    cursor.execute("""
-        SELECT DISTINCT category FROM products
-        WHERE name LIKE %s OR category LIKE %s
-    """, (f'%{query}%', f'%{query}%'))
-    matching_categories = cursor.fetchall()
-
-    suggestions = []
-    for cat in matching_categories:
-        suggestions.append(f"{query.title()} for {cat['category']}")
-
-    # Also add direct name suggestions
-    cursor.execute("""
-        SELECT DISTINCT name FROM products
-        WHERE name LIKE %s
-        LIMIT 4
-    """, (f'{query}%',))
-    name_matches = cursor.fetchall()
-    for n in name_matches:
-        if n['name'] not in suggestions:
-            suggestions.append(n['name'])
-
-    cursor.close()
-    db.close()
+    # plus the best name completions, straight from the prefix trie
+    suggestions = [f"{query.title()} for {category}"
+                   for category in completer.categories(query)]
+    suggestions += completer.complete(query, limit=4)
 
-    # Convert Decimal to float for JSON
-    for p in products_found:
-        p['price']  = float(p['price'])
-        p['rating'] = float(p['rating'])
-
-    return jsonify({
+    response = jsonify({
         'products':    products_found,
-        'suggestions': suggestions[:8]
+        'suggestions': list(dict.fromkeys(suggestions))[:8]
     })
+    return with_validators(response, etag, cache_control=public)
 
 # ══════════════════════════════════════════════════════════
 # ROUTE 10: SEARCH RESULTS PAGE (Full page with slider)
@@ -539,27 +1093,18 @@ def search_results():
     if not query:
         return redirect(url_for('products'))
 
-    db = get_db()
-    cursor = db.cursor()
+    db    = get_db()
+    index = get_search_index()
 
-    cursor.execute("""
-        SELECT * FROM products
-        WHERE (name LIKE %s OR category LIKE %s) AND stock > 0
-        ORDER BY rating DESC
-        LIMIT 50
-    """, (f'%{query}%', f'%{query}%'))
-    results = cursor.fetchall()
+    # Ranked ids from the index, full rows from the catalog cache
+    ids     = [p.id for p in index.search(query, limit=50)]
+    rows    = catalog.products_by_ids(db, ids)
+    results = [rows[i] for i in ids if i in rows]
 
     # Related categories for suggestion chips
-    cursor.execute("""
-        SELECT DISTINCT category FROM products
-        WHERE name LIKE %s OR category LIKE %s
-    """, (f'%{query}%', f'%{query}%'))
-    related_categories = cursor.fetchall()
+    related_categories = [{'category': c} for c in index.categories(query)]
 
     cart_count = get_cart_count(session['user_id'])
-    cursor.close()
-    db.close()
 
     return render_template('search_results.html',
                            results=results,
@@ -583,24 +1128,26 @@ def add_to_cart():
     db = get_db()
     cursor = db.cursor()
     try:
-        # Check if already in cart
-        cursor.execute(
-            "SELECT id, quantity FROM cart WHERE user_id=%s AND product_id=%s",
-            (session['user_id'], product_id)
-        )
-        existing = cursor.fetchone()
+        # Insert or add to the existing line in one statement (unique_cart_item);
+        # LAST_INSERT_ID(id) makes lastrowid the cart id in both cases
+        cursor.execute("""
+            INSERT INTO cart (user_id, product_id, quantity) VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE quantity = quantity + %s, id = LAST_INSERT_ID(id)
+        """, (session['user_id'], product_id, quantity, quantity))
+        inserted = cursor.rowcount == 1
+        cart_id  = cursor.lastrowid
+        db.commit()
 
-        if existing:
-            cursor.execute(
-                "UPDATE cart SET quantity = quantity + %s WHERE id = %s",
-                (quantity, existing['id'])
-            )
+        lines = cached_cart_lines()
+        if lines is None or (cart_id in lines) == inserted:
+            load_cart_lines(db, session['user_id'])
         else:
-            cursor.execute(
-                "INSERT INTO cart (user_id, product_id, quantity) VALUES (%s,%s,%s)",
-                (session['user_id'], product_id, quantity)
-            )
-        db.commit()
+            _, old_qty = lines.get(cart_id, (None, 0))
+            lines[cart_id] = (int(product_id), old_qty + quantity)
+            stamp = cart_stamp()
+            store_cart_lines(lines)
+            member_sets.update('cart', session['user_id'], stamp, cart_stamp(),
+                               add=[int(product_id)])
 
         cart_count = get_cart_count(session['user_id'])
         return jsonify({
@@ -636,6 +1183,8 @@ def cart():
 
     total = sum(float(item['price']) * item['quantity'] for item in cart_items)
     cart_count = sum(item['quantity'] for item in cart_items)
+    store_cart_lines({item['cart_id']: (item['id'], item['quantity'])
+                      for item in cart_items})
 
     cursor.close()
     db.close()
@@ -657,22 +1206,25 @@ def remove_from_cart():
     db = get_db()
     cursor = db.cursor()
     try:
+        cart_id = int(cart_id)
         cursor.execute(
             "DELETE FROM cart WHERE id = %s AND user_id = %s",
             (cart_id, session['user_id'])
         )
+        removed = cursor.rowcount > 0
         db.commit()
 
-        # Recalculate totals
-        cursor.execute("""
-            SELECT COALESCE(SUM(p.price * c.quantity), 0) as total,
-                   COALESCE(SUM(c.quantity), 0) as count
-            FROM cart c JOIN products p ON c.product_id = p.id
-            WHERE c.user_id = %s
-        """, (session['user_id'],))
-        result     = cursor.fetchone()
-        total      = float(result['total'])
-        cart_count = int(result['count'])
+        # Recalculate totals from the cached lines + cached prices
+        lines = cached_cart_lines()
+        if lines is None or (cart_id in lines) != removed:
+            lines = load_cart_lines(db, session['user_id'])
+        else:
+            product_id, _ = lines.pop(cart_id, (None, 0))
+            stamp = cart_stamp()
+            store_cart_lines(lines)
+            member_sets.update('cart', session['user_id'], stamp, cart_stamp(),
+                               remove=[product_id] if product_id else [])
+        total, cart_count = cart_totals(db, lines)
 
         return jsonify({
             'success':    True,
@@ -702,21 +1254,25 @@ def update_cart():
     db = get_db()
     cursor = db.cursor()
     try:
+        cart_id = int(cart_id)
         cursor.execute(
             "UPDATE cart SET quantity=%s WHERE id=%s AND user_id=%s",
             (quantity, cart_id, session['user_id'])
         )
+        changed = cursor.rowcount > 0
         db.commit()
 
-        cursor.execute("""
-            SELECT COALESCE(SUM(p.price * c.quantity), 0) as total,
-                   COALESCE(SUM(c.quantity), 0) as count
-            FROM cart c JOIN products p ON c.product_id = p.id
-            WHERE c.user_id = %s
-        """, (session['user_id'],))
-        result     = cursor.fetchone()
-        total      = float(result['total'])
-        cart_count = int(result['count'])
+        # Recalculate totals from the cached lines + cached prices
+        lines = cached_cart_lines()
+        if (lines is None or cart_id not in lines or
+                changed == (lines[cart_id][1] == quantity)):
+            lines = load_cart_lines(db, session['user_id'])
+        else:
+            lines[cart_id] = (lines[cart_id][0], quantity)
+            stamp = cart_stamp()
+            store_cart_lines(lines)
+            member_sets.update('cart', session['user_id'], stamp, cart_stamp())
+        total, cart_count = cart_totals(db, lines)
 
         return jsonify({
             'success':    True,
@@ -748,11 +1304,17 @@ def toggle_favorite():
         )
         existing = cursor.fetchone()
 
+        fav_ids = session.get('fav_ids')
+        stamp   = favorite_stamp()
         if existing:
             cursor.execute(
                 "DELETE FROM favorites WHERE id = %s", (existing['id'],)
             )
             db.commit()
+            if fav_ids is not None:
+                store_favorite_ids([i for i in fav_ids if i != int(product_id)])
+            member_sets.update('fav', session['user_id'], stamp, favorite_stamp(),
+                               remove=[int(product_id)])
             return jsonify({
                 'success': True,
                 'action':  'removed',
@@ -764,6 +1326,10 @@ def toggle_favorite():
                 (session['user_id'], product_id)
             )
             db.commit()
+            if fav_ids is not None:
+                store_favorite_ids([int(product_id)] + fav_ids)
+            member_sets.update('fav', session['user_id'], stamp, favorite_stamp(),
+                               add=[int(product_id)])
             return jsonify({
                 'success': True,
                 'action':  'added',
@@ -798,7 +1364,9 @@ def payment():
         return redirect(url_for('cart'))
 
     total = sum(float(item['price']) * item['quantity'] for item in cart_items)
-    cart_count = get_cart_count(session['user_id'])
+    cart_count = sum(item['quantity'] for item in cart_items)
+    store_cart_lines({item['cart_id']: (item['id'], item['quantity'])
+                      for item in cart_items})
 
     cursor.close()
     db.close()
@@ -812,6 +1380,9 @@ def payment():
 # ══════════════════════════════════════════════════════════
 # ROUTE 17: CREATE RAZORPAY ORDER (AJAX)
 # ══════════════════════════════════════════════════════════
+# Razorpay order id → paise, for the last few orders created in a session
+PAYMENT_ORDERS_KEPT = 5
+
 @app.route('/payment/create-order', methods=['POST'])
 @login_required
 def create_payment_order():
@@ -825,30 +1396,36 @@ def create_payment_order():
         WHERE c.user_id = %s
     """, (session['user_id'],))
     result = cursor.fetchone()
-    total  = float(result['total']) if result else 0
+    amount = to_paise(result['total']) if result else 0
 
     cursor.close()
     db.close()
 
-    if total <= 0:
+    if amount <= 0:
         return jsonify({'success': False, 'message': 'Cart is empty'})
 
     try:
-        client     = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-        order_data = {
-            'amount':          int(total * 100),  # paise
-            'currency':        'INR',
-            'payment_capture': 1
-        }
-        razorpay_order = client.order.create(data=order_data)
+        with track('gateway'):
+            razorpay_order = payment_gateway.create_order(
+                amount,  # paise
+                currency        = 'INR',
+                payment_capture = 1
+            )
+
+        # What this order is for, so the worker can check the cart still matches
+        recent = list(session.get('payment_orders', {}).items())[-(PAYMENT_ORDERS_KEPT - 1):]
+        session['payment_orders'] = dict(recent, **{razorpay_order['id']: amount})
 
         return jsonify({
             'success':  True,
             'order_id': razorpay_order['id'],
-            'amount':   int(total * 100),
+            'amount':   amount,
             'currency': 'INR'
         })
 
+    except GatewayBusy as e:
+        print(f"Razorpay error: {e}")
+        return jsonify({'success': False, 'message': 'Payment service is busy, please try again'})
     except Exception as e:
         print(f"Razorpay error: {e}")
         return jsonify({'success': False, 'message': 'Payment setup failed'})
@@ -865,64 +1442,73 @@ def verify_payment():
     signature  = data.get('razorpay_signature')
 
     db = get_db()
-    cursor = db.cursor()
 
     try:
         # Verify Razorpay signature (SECURITY CHECK)
-        client = razorpay.Client(auth=(RAZORPAY_KEY_ID, RAZORPAY_KEY_SECRET))
-        client.utility.verify_payment_signature({
-            'razorpay_order_id':   order_id,
-            'razorpay_payment_id': payment_id,
-            'razorpay_signature':  signature
-        })
-
-        # Get cart items
-        cursor.execute("""
-            SELECT c.quantity, p.id as product_id, p.price
-            FROM cart c JOIN products p ON c.product_id = p.id
-            WHERE c.user_id = %s
-        """, (session['user_id'],))
-        cart_items = cursor.fetchall()
-        total = sum(float(i['price']) * i['quantity'] for i in cart_items)
-
-        # Create order record
-        cursor.execute("""
-            INSERT INTO orders (user_id, total_amount, payment_status, transaction_id)
-            VALUES (%s, %s, 'paid', %s)
-        """, (session['user_id'], total, payment_id))
-        new_order_id = cursor.lastrowid
-
-        # Save each item in order_items
-        for item in cart_items:
-            cursor.execute("""
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (%s, %s, %s, %s)
-            """, (new_order_id, item['product_id'], item['quantity'], item['price']))
-
-        # Clear cart after successful payment
-        cursor.execute(
-            "DELETE FROM cart WHERE user_id = %s", (session['user_id'],)
-        )
-        db.commit()
-
-        return jsonify({'success': True, 'order_id': new_order_id})
-
+        with track('gateway'):
+            payment_gateway.verify_signature(order_id, payment_id, signature)
     except Exception as e:
-        # Payment verification failed
+        # Payment verification failed - the worker records it
         print(f"Payment verify error: {e}")
         try:
-            cursor.execute("""
-                INSERT INTO orders (user_id, total_amount, payment_status, transaction_id)
-                VALUES (%s, 0, 'failed', %s)
-            """, (session['user_id'], payment_id or 'unknown'))
-            db.commit()
-        except:
-            pass
+            enqueue_failure(db, session['user_id'], order_id, payment_id)
+        except Exception as e:
+            print(f"Payment queue error: {e}")
+        finally:
+            db.close()
         return jsonify({'success': False, 'message': 'Payment verification failed'})
+
+    # Order + items + stock + cart are written by worker.py; the browser
+    # polls /payment/status/<job_id> until the order exists
+    amount = session.get('payment_orders', {}).get(order_id)
+    if amount is None:
+        # Paid from another session (or an older tab): ask the gateway
+        try:
+            with track('gateway'):
+                amount = payment_gateway.fetch_order(order_id)['amount']
+        except Exception as e:
+            print(f"Razorpay error: {e}")
+    try:
+        job_id = enqueue_finalize(db, session['user_id'], order_id, payment_id, amount)
+    except Exception as e:
+        print(f"Payment queue error: {e}")
+        return jsonify({'success': False,
+                        'message': 'Payment received but not confirmed yet. Contact support.'})
     finally:
-        cursor.close()
         db.close()
 
+    return jsonify({'success':    True,
+                    'job_id':     job_id,
+                    'status_url': url_for('payment_status', job_id=job_id)})
+
+# ══════════════════════════════════════════════════════════
+# ROUTE 18b: PAYMENT STATUS (AJAX polling)
+# ══════════════════════════════════════════════════════════
+@app.route('/payment/status/<int:job_id>')
+@login_required
+def payment_status(job_id):
+    db  = get_db()
+    job = job_status(db, job_id, session['user_id'])
+
+    if not job:
+        db.close()
+        return jsonify({'success': False, 'message': 'Payment not found'}), 404
+
+    if job['status'] == 'done':
+        store_cart_lines({})
+        # Stock changes reach every worker's caches through catalog_changes
+        recommender.mark_stale()   # fold this order in on the next page view
+        db.close()
+        return jsonify({'success': True, 'status': 'done', 'order_id': job['order_id']})
+
+    if job['status'] == 'failed':
+        load_cart_lines(db, session['user_id'])   # cart is left as it was
+        db.close()
+        return jsonify({'success': False, 'status': 'failed', 'message': job['last_error']})
+
+    db.close()
+    return jsonify({'success': True, 'status': job['status']})
+
 # ══════════════════════════════════════════════════════════
 # ROUTE 19: ORDER SUCCESS PAGE
 # ══════════════════════════════════════════════════════════
@@ -967,7 +1553,9 @@ def buy_now(product_id):
             "INSERT INTO cart (user_id, product_id, quantity) VALUES (%s,%s,1)",
             (session['user_id'], product_id)
         )
+        cart_id = cursor.lastrowid
         db.commit()
+        store_cart_lines({cart_id: (product_id, 1)})
     except:
         db.rollback()
     finally:
@@ -976,15 +1564,62 @@ def buy_now(product_id):
 
     return redirect(url_for('payment'))
 
+# ══════════════════════════════════════════════════════════
+# ROUTE 21: HEALTH ENDPOINTS (JSON)
+# ══════════════════════════════════════════════════════════
+@app.route('/health/db')
+def db_health():
+    return jsonify(db_pool.stats())
+
+@app.route('/health/cache')
+def cache_health():
+    return jsonify({'catalog':     catalog.stats(),
+                    'fragments':   fragment_cache.stats(),
+                    'changes':     catalog_feed.stats(),
+                    'memberships': member_sets.stats(),
+                    'facets':      facet_index.stats()})
+
+@app.route('/health/payments')
+def payments_health():
+    return jsonify(payment_gateway.stats())
+
+@app.route('/health/passwords')
+def passwords_health():
+    return jsonify(password_hasher.stats())
+
+@app.route('/health/images')
+def images_health():
+    return jsonify({'pipeline':       image_pipeline.stats(),
+                    'product_images': product_images.stats()})
+
+@app.route('/health/recommendations')
+def recommendations_health():
+    return jsonify(recommender.stats())
+
+@app.route('/health/sessions')
+def sessions_health():
+    return jsonify(session_store.stats() if session_store else {'store': 'cookie'})
+
+# ══════════════════════════════════════════════════════════
+# ROUTE 22: PROMETHEUS METRICS
+# ══════════════════════════════════════════════════════════
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # ══════════════════════════════════════════════════════════
 # ERROR HANDLERS
 # ══════════════════════════════════════════════════════════
 @app.errorhandler(404)
 def page_not_found(e):
+    # Reuse the cached home fragments; fall back to an empty page if the
+    # catalog can't be reached
+    try:
+        fragments = home_fragments()
+    except Exception:
+        fragments = {}
     return render_template('home.html',
-                           featured_products=[],
-                           slider_products=[],
-                           categories=[],
+                           fragments=fragments,
                            recommended=[],
                            cart_count=0), 404
 
@@ -0,0 +1,111 @@
+# assets.py - Fingerprinted CSS/JS bundles (built by build_assets.py)
+#
+# Templates ask for a bundle by name - {{ asset_url('js/site.js') }} - and
+# get /assets/js/site.3f9c2e1a7b.js from static/dist/manifest.json. The
+# hashed name changes whenever the content does, so those files are sent
+# with a one-year immutable Cache-Control and browsers never revalidate
+# them. Put nginx (or a CDN) in front of /assets/ to keep them off the
+# app workers entirely; the route here is the fallback, and it serves the
+# precompressed .br / .gz variant when the browser accepts it.
+#
+# The Procfile runs build_assets.py before gunicorn starts. Without a
+# manifest (e.g. `python app.py` in development) the bundle is
+# concatenated from its sources - again only when one of them changes -
+# and sent with a content-hash ETag, so browsers revalidate with a 304.
+
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import Response, abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+# bundle → source files under static/, in load order
+BUNDLES = {
+    'css/site.css':     ['css/style.css'],
+    'css/auth.css':     ['css/auth.css'],
+    'css/cart.css':     ['css/cart.css'],
+    'css/home.css':     ['css/home.css'],
+    'css/products.css': ['css/products.css'],
+    'css/profile.css':  ['css/profile.css'],
+    'js/site.js':       ['js/main.js', 'js/search.js'],
+    'js/cart.js':       ['js/cart.js'],
+    'js/payment.js':    ['js/payment.js'],
+}
+
+DIST_DIR       = 'dist'            # under static/
+MANIFEST_NAME  = 'manifest.json'
+IMMUTABLE      = 'public, max-age=31536000, immutable'
+ENCODINGS      = (('br', '.br'), ('gzip', '.gz'))   # preferred first
+
+
+def bundle_source(static_folder, bundle):
+    """The bundle's source files joined, unminified"""
+    parts = []
+    for name in BUNDLES[bundle]:
+        with open(os.path.join(static_folder, name), encoding='utf-8') as f:
+            parts.append(f.read())
+    return '\n'.join(parts)
+
+
+def _dev_bundle(static_folder, bundle, cache):
+    """(source, etag) of an unbuilt bundle, re-read when a source's mtime changes"""
+    mtimes = tuple(os.stat(os.path.join(static_folder, name)).st_mtime_ns
+                   for name in BUNDLES[bundle])
+    entry  = cache.get(bundle)
+    if entry is None or entry[0] != mtimes:
+        source = bundle_source(static_folder, bundle)
+        etag   = hashlib.sha256(source.encode('utf-8')).hexdigest()[:20]
+        entry  = cache[bundle] = (mtimes, source, etag)
+    return entry[1], entry[2]
+
+
+def load_manifest(static_folder):
+    """{bundle: hashed file under static/dist}, or {} if not built"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_assets(app):
+    """Register asset_url() for templates and the /assets/ route"""
+    manifest = load_manifest(app.static_folder)
+    dist     = os.path.join(app.static_folder, DIST_DIR)
+    unbuilt  = {}                  # bundle → (source mtimes, source, etag)
+    if not manifest:
+        print("Asset manifest not found - serving unbundled sources (run build_assets.py)")
+
+    def asset_url(bundle):
+        return url_for('asset', filename=manifest.get(bundle, bundle))
+
+    @app.route('/assets/<path:filename>')
+    def asset(filename):
+        if filename in BUNDLES and filename not in manifest.values():
+            # No build, so no fingerprint to make long caching safe - revalidate
+            source, etag = _dev_bundle(app.static_folder, filename, unbuilt)
+            response = Response(source, mimetype=mimetypes.guess_type(filename)[0])
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+
+        path = safe_join(dist, filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(path)[0]
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                response = send_file(path + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_file(path, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.extensions['assets'] = manifest
+    return manifest
@@ -0,0 +1,199 @@
+# autocomplete.py - Prefix trie for live-search suggestions
+#
+# Every product name (and every word-suffix of it, so "jea" finds
+# "Slim Fit Jeans") plus every category is stored in a character trie.
+# Each node keeps its best `k` completions, weighted by rating and units
+# sold, and the categories found under it, so a lookup is just a walk of
+# len(prefix) nodes - no SQL and no sorting per keystroke.
+
+import heapq
+import math
+import re
+import threading
+
+from search_index import normalize
+
+POPULARITY_WEIGHT = 0.5   # weight = rating + 0.5 * ln(1 + units sold)
+CATEGORY_WEIGHT   = 10.0  # categories outrank single product names
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+class _Node:
+    __slots__ = ('children', 'terminal', 'top', 'categories')
+
+    def __init__(self):
+        self.children   = {}
+        self.terminal   = {}    # display text → (weight, categories), texts ending here
+        self.top        = []    # best k (-weight, display) in this subtree
+        self.categories = ()    # categories of every text in this subtree
+
+
+class Autocomplete:
+    def __init__(self, k=8):
+        self.k         = k
+        self._lock     = threading.RLock()
+        self._root     = _Node()
+        self._products = {}   # product id → (name, category, weight)
+        self._texts    = {}   # display text → {product id: (weight, category)}
+
+    # ══════════════════════════════════════
+    # BUILD / INCREMENTAL UPDATES
+    # ══════════════════════════════════════
+    def build(self, rows):
+        fresh = Autocomplete(self.k)
+        for row in rows:
+            fresh._register(row)
+        for text in fresh._texts:
+            weight, categories = fresh._summary(text)
+            for key in self._keys(text):
+                fresh._walk(key, create=True)[-1].terminal[text] = (weight, categories)
+        fresh._rollup(fresh._root)
+        with self._lock:
+            self._root     = fresh._root
+            self._products = fresh._products
+            self._texts    = fresh._texts
+
+    def upsert(self, row):
+        with self._lock:
+            touched = self._unregister(row['id'])
+            touched.update(self._register(row))
+            for text in touched:
+                self._refresh_text(text)
+
+    def remove(self, product_id):
+        with self._lock:
+            for text in self._unregister(product_id):
+                self._refresh_text(text)
+
+    def _register(self, row):
+        sold   = int(row.get('sold') or 0)
+        weight = float(row['rating'] or 0) + POPULARITY_WEIGHT * math.log1p(sold)
+        name, category = row['name'], row['category']
+        self._products[row['id']] = (name, category, weight)
+        self._texts.setdefault(name, {})[row['id']] = (weight, category)
+        self._texts.setdefault(category, {})[row['id']] = (CATEGORY_WEIGHT, category)
+        return {name, category}
+
+    def _unregister(self, product_id):
+        entry = self._products.pop(product_id, None)
+        if entry is None:
+            return set()
+        name, category, _ = entry
+        for text in (name, category):
+            owners = self._texts.get(text)
+            if owners is not None:
+                owners.pop(product_id, None)
+                if not owners:
+                    del self._texts[text]
+        return {name, category}
+
+    def _summary(self, text):
+        owners = self._texts[text].values()
+        return max(w for w, _ in owners), frozenset(c for _, c in owners)
+
+    def _refresh_text(self, text):
+        """Re-store one display text and repair the top-k along its paths"""
+        for key in self._keys(text):
+            path = self._walk(key, create=text in self._texts)
+            if not path:
+                continue
+            if text in self._texts:
+                path[-1].terminal[text] = self._summary(text)
+            else:
+                path[-1].terminal.pop(text, None)
+            for node in reversed(path):
+                self._recompute(node)
+
+    @staticmethod
+    def _keys(text):
+        """Trie keys for a text: the whole text and each later word onward"""
+        norm   = normalize(text)
+        starts = [m.start() for m in _WORD_RE.finditer(norm)]
+        return {norm} | {norm[i:] for i in starts[1:]}
+
+    def _walk(self, key, create=False):
+        node, path = self._root, [self._root]
+        for ch in key:
+            child = node.children.get(ch)
+            if child is None:
+                if not create:
+                    return []
+                child = node.children[ch] = _Node()
+            node = child
+            path.append(node)
+        return path
+
+    def _recompute(self, node):
+        candidates = [(-w, text) for text, (w, _) in node.terminal.items()]
+        categories = set()
+        for _, cats in node.terminal.values():
+            categories |= cats
+        for child in node.children.values():
+            candidates.extend(child.top)
+            categories.update(child.categories)
+        node.top        = self._best(candidates)
+        node.categories = tuple(sorted(categories))
+
+    def _best(self, candidates):
+        # The same display text can reach a node through several children
+        best = {}
+        for neg_w, text in candidates:
+            if text not in best or neg_w < best[text]:
+                best[text] = neg_w
+        return heapq.nsmallest(self.k, ((w, t) for t, w in best.items()))
+
+    def _rollup(self, node):
+        # Post-order, iteratively - names can be deeper than the recursion limit allows
+        stack = [(node, False)]
+        while stack:
+            current, done = stack.pop()
+            if done:
+                self._recompute(current)
+            else:
+                stack.append((current, True))
+                stack.extend((child, False) for child in current.children.values())
+
+    # ══════════════════════════════════════
+    # LOOKUPS - O(len(prefix))
+    # ══════════════════════════════════════
+    def _node(self, prefix):
+        node = self._root
+        for ch in normalize(prefix):
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def complete(self, prefix, limit=8):
+        """Best names/categories starting with prefix (or a word in them)"""
+        node = self._node(prefix)
+        return [text for _, text in node.top[:limit]] if node else []
+
+    def categories(self, prefix):
+        node = self._node(prefix)
+        return list(node.categories) if node else []
+
+
+# ══════════════════════════════════════
+# LOADING FROM MYSQL
+# ══════════════════════════════════════
+AUTOCOMPLETE_SQL = """
+    SELECT p.id, p.name, p.category, p.rating,
+           COALESCE(SUM(oi.quantity), 0) AS sold
+    FROM products p
+    LEFT JOIN order_items oi ON oi.product_id = p.id
+"""
+
+
+def load_rows(conn, product_ids=None):
+    """Every product, or just `product_ids` (one IN (...) query)"""
+    sql, params = AUTOCOMPLETE_SQL, ()
+    if product_ids is not None:
+        params = list(product_ids)
+        sql   += f" WHERE p.id IN ({','.join(['%s'] * len(params))})"
+    cursor = conn.cursor()
+    cursor.execute(sql + " GROUP BY p.id", params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
@@ -0,0 +1,169 @@
+# avatars.py - Profile pictures as small content-hashed thumbnails
+#
+#   python avatars.py gc [--folder static/uploads] [--dry-run]
+#
+# An upload is streamed to a temp file, then decoded and cut to square
+# 100px and 200px (2x screens) WebP + JPEG thumbnails on the image pool
+# (images.py); the original is deleted. users.profile_image holds
+# "avatars/<hash>", the first 16 hex digits of the upload's sha256, so a
+# thumbnail's URL changes exactly when its content does and /avatars/ can
+# send them as immutable. A profile page ships a few KB instead of the
+# camera original.
+#
+# Replacing a picture deletes the old thumbnails once no user points at
+# them (two users may upload the same file). `gc` catches what that
+# misses - files from a failed update, pre-thumbnail uploads nobody uses,
+# temp files left by a crash. Values without the "avatars/" prefix are
+# such older uploads and are still served from static/uploads.
+
+import argparse
+import os
+import time
+
+import pymysql
+from flask import abort, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+from assets import IMMUTABLE
+from database import connect_kwargs_from_url
+from images import stream_to_temp, variant_names
+
+AVATAR_DIR = 'avatars'                           # under UPLOAD_FOLDER
+PREFIX     = AVATAR_DIR + '/'                    # users.profile_image of a hashed avatar
+DEFAULT    = 'default.png'
+SIZES      = {100: (100, 100), 200: (200, 200)}  # 1x / 2x of the 100px profile avatar
+GC_GRACE   = 3600                                # seconds before gc touches a new file
+
+
+def is_hashed(value):
+    return bool(value) and value.startswith(PREFIX)
+
+
+def avatar_files(upload_folder, value):
+    """Paths on disk behind a profile_image value"""
+    if is_hashed(value):
+        folder = os.path.join(upload_folder, AVATAR_DIR)
+        return [os.path.join(folder, name) for name in variant_names(value[len(PREFIX):], SIZES)]
+    if value and value != DEFAULT:
+        path = safe_join(upload_folder, value)
+        return [path] if path else []
+    return []
+
+
+def save_avatar(pipeline, upload, upload_folder, max_bytes):
+    """Thumbnail an uploaded FileStorage; returns the new profile_image value.
+    Raises images.InvalidImage / images.ImageBusy."""
+    folder = os.path.join(upload_folder, AVATAR_DIR)
+    src, digest = stream_to_temp(upload.stream, folder, max_bytes)
+    try:
+        stem = digest[:16]
+        pipeline.variants(src, folder, stem, SIZES, crop=True)
+    finally:
+        os.remove(src)
+    return PREFIX + stem
+
+
+def discard_avatar(cursor, upload_folder, value):
+    """Delete a superseded avatar's files unless another user still has it
+    (call after the UPDATE is committed); returns the files removed"""
+    if not value or value == DEFAULT:
+        return 0
+    cursor.execute("SELECT 1 FROM users WHERE profile_image = %s LIMIT 1", (value,))
+    if cursor.fetchone():
+        return 0
+    removed = 0
+    for path in avatar_files(upload_folder, value):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Avatar cleanup error ({path}): {e}")
+    return removed
+
+
+def init_avatars(app):
+    """Register avatar_url() for templates and the /avatars/ route"""
+    def avatar_url(value, size, fmt='jpg'):
+        if is_hashed(value):
+            return url_for('avatar', filename=f'{value[len(PREFIX):]}-{size}.{fmt}')
+        return url_for('static', filename='uploads/' + value)
+
+    @app.route('/avatars/<filename>')
+    def avatar(filename):
+        if filename.endswith(('.part', '.tmp')):
+            abort(404)
+        folder   = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], AVATAR_DIR))
+        response = send_from_directory(folder, filename)
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    app.jinja_env.globals['avatar_url'] = avatar_url
+
+
+# ══════════════════════════════════════
+# GARBAGE COLLECTION (cron)
+# ══════════════════════════════════════
+def collect(conn, upload_folder, dry_run=False, grace=GC_GRACE):
+    """Remove avatar files no user references; returns (files, bytes)"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT DISTINCT profile_image FROM users WHERE profile_image IS NOT NULL")
+        in_use = {row['profile_image'] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+    stems  = {value[len(PREFIX):] for value in in_use if is_hashed(value)}
+    cutoff = time.time() - grace
+
+    candidates = []
+    folder     = os.path.join(upload_folder, AVATAR_DIR)
+    if os.path.isdir(folder):
+        for entry in os.scandir(folder):
+            # <stem>-<size>.<ext>, or an upload / write that never finished
+            if entry.is_file() and (entry.name.endswith(('.part', '.tmp'))
+                                    or entry.name.split('-', 1)[0] not in stems):
+                candidates.append(entry)
+    if os.path.isdir(upload_folder):
+        for entry in os.scandir(upload_folder):
+            # Uploads from before thumbnails: the filename was the value
+            if entry.is_file() and entry.name not in in_use and entry.name != DEFAULT:
+                candidates.append(entry)
+
+    files = size = 0
+    for entry in candidates:
+        stat = entry.stat()
+        if stat.st_mtime > cutoff:
+            continue                    # may belong to an upload still in progress
+        files += 1
+        size  += stat.st_size
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+    return files, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Remove unused SecureShop avatar files')
+    parser.add_argument('command', choices=('gc',))
+    parser.add_argument('--folder', default='static/uploads', help='UPLOAD_FOLDER')
+    parser.add_argument('--grace', type=int, default=GC_GRACE,
+                        help='leave files younger than this many seconds')
+    parser.add_argument('--dry-run', action='store_true', help='report only, delete nothing')
+    args = parser.parse_args()
+
+    connect_kwargs = connect_kwargs_from_url(os.environ.get('DATABASE_URL'))
+    if connect_kwargs is None:
+        raise SystemExit('DATABASE_URL is not set')
+    conn = pymysql.connect(**connect_kwargs)
+    try:
+        files, size = collect(conn, args.folder, args.dry_run, args.grace)
+    finally:
+        conn.close()
+    print(f"{'Would remove' if args.dry_run else 'Removed'} {files} files ({size / 1024:,.0f} KB)")
+
+
+if __name__ == '__main__':
+    main()
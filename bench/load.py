@@ -0,0 +1,371 @@
+# bench/load.py - Replay a SecureShop traffic mix and report latency per route
+#
+#   python fake_razorpay.py &                     # stub gateway on :8099
+#   RAZORPAY_BASE_URL=http://127.0.0.1:8099 gunicorn app:app &
+#   python worker.py &
+#   python bench/load.py --clients 20 --duration 60 --save-baseline
+#   ... change app.py ...
+#   python bench/load.py --clients 20 --duration 60 --baseline bench/results/baseline.json
+#
+# Each client is a thread with its own cookie session, logged in as one of
+# the bench users from bench/seed.py. It loops over a weighted mix of
+# scenarios - home, product listings, product pages, search keystrokes,
+# cart AJAX and a full checkout (create order → signed verify → status
+# polling) - and every HTTP call is timed under its Flask endpoint name.
+#
+# The run is written to bench/results/<timestamp>.json. With --baseline,
+# p50/p95/p99 and throughput are compared route by route, and the exit
+# status is 1 if any route got slower than --threshold.
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+ROOT        = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+SCHEMA_PATH = os.path.join(ROOT, 'schema.sql')
+
+sys.path.insert(0, ROOT)
+from seed import BENCH_PASSWORD   # noqa: E402  (bench/ is on sys.path as the script dir)
+
+# scenario → weight (share of iterations)
+MIX = {
+    'home':     10,
+    'browse':   30,
+    'product':  20,
+    'search':   20,
+    'cart':     15,
+    'checkout':  5,
+}
+SORTS = ('', 'price_asc', 'price_desc', 'rating')
+
+_CSRF_META_RE = re.compile(r'<meta name="csrf-token" content="([^"]+)"')
+_CSRF_FORM_RE = re.compile(r'name="csrf_token" value="([^"]+)"')
+_CART_ID_RE   = re.compile(r'removeFromCart\((\d+)\)')
+_PRODUCT_RE   = re.compile(r"^\s*\('([^']+)', '([^']+)', [\d.]+,", re.M)
+
+
+def catalog_terms(path=SCHEMA_PATH):
+    """(categories, search words) taken from the seed products"""
+    with open(path, encoding='utf-8') as f:
+        rows = _PRODUCT_RE.findall(f.read())
+    categories = sorted({category for _, category in rows})
+    words      = sorted({w.lower() for name, _ in rows
+                         for w in name.split() if w.isalpha() and len(w) > 3})
+    return categories, words
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+# ══════════════════════════════════════
+# RECORDING
+# ══════════════════════════════════════
+class Recorder:
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._samples = {}    # route → [seconds]
+        self._errors  = {}    # route → count
+        self.active   = False  # samples before this are warm-up and dropped
+
+    def add(self, route, seconds, ok):
+        if not self.active:
+            return
+        with self._lock:
+            self._samples.setdefault(route, []).append(seconds)
+            if not ok:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def summary(self, elapsed):
+        routes = {}
+        with self._lock:
+            for route, samples in sorted(self._samples.items()):
+                samples = sorted(samples)
+                routes[route] = {
+                    'count':   len(samples),
+                    'errors':  self._errors.get(route, 0),
+                    'rps':     round(len(samples) / elapsed, 2),
+                    'p50_ms':  round(percentile(samples, 50) * 1000, 2),
+                    'p95_ms':  round(percentile(samples, 95) * 1000, 2),
+                    'p99_ms':  round(percentile(samples, 99) * 1000, 2),
+                    'mean_ms': round(sum(samples) / len(samples) * 1000, 2),
+                    'max_ms':  round(samples[-1] * 1000, 2),
+                }
+        return routes
+
+
+# ══════════════════════════════════════
+# ONE VIRTUAL CLIENT
+# ══════════════════════════════════════
+class Client:
+    def __init__(self, args, recorder, rng, email, categories, words):
+        self.args       = args
+        self.base       = args.base_url.rstrip('/')
+        self.recorder   = recorder
+        self.rng        = rng
+        self.email      = email
+        self.categories = categories
+        self.words      = words
+        self.http       = requests.Session()
+        self.csrf       = ''
+
+    def call(self, route, method, path, ok_status=(200,), **kwargs):
+        """Timed request; a non-2xx/3xx status or a connection error counts as an error"""
+        kwargs.setdefault('timeout', self.args.timeout)
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base + path, **kwargs)
+        except requests.RequestException:
+            self.recorder.add(route, time.perf_counter() - started, False)
+            return None
+        ok = response.status_code in ok_status
+        self.recorder.add(route, time.perf_counter() - started, ok)
+        match = _CSRF_META_RE.search(response.text) if 'html' in response.headers.get(
+            'Content-Type', '') else None
+        if match:
+            self.csrf = match.group(1)
+        return response
+
+    def ajax(self, route, path, payload):
+        response = self.call(route, 'POST', path, json=payload,
+                             headers={'X-CSRFToken': self.csrf})
+        try:
+            return response.json() if response is not None else {}
+        except ValueError:
+            return {}
+
+    def login(self):
+        page  = self.http.get(self.base + '/login', timeout=self.args.timeout)
+        token = _CSRF_FORM_RE.search(page.text)
+        response = self.call('login', 'POST', '/login', ok_status=(302,), allow_redirects=False,
+                             data={'csrf_token': token.group(1) if token else '',
+                                   'email': self.email, 'password': self.args.password})
+        if response is None or response.status_code != 302:
+            raise SystemExit(f'Login failed for {self.email} - run bench/seed.py first?')
+        # Picks up the session-bound CSRF token for the AJAX calls
+        self.call('home', 'GET', '/')
+
+    def product_id(self):
+        return self.rng.randint(1, self.args.products)
+
+    # ── scenarios ────────────────────────────────────────
+    def home(self):
+        self.call('home', 'GET', '/')
+
+    def browse(self):
+        params = {'sort': self.rng.choice(SORTS)}
+        if self.rng.random() < 0.7:
+            params['category'] = self.rng.choice(self.categories)
+        self.call('products', 'GET', '/products', params=params)
+        for page in range(2, 2 + self.rng.randint(0, 3)):
+            self.call('products', 'GET', '/products', params=dict(params, page=page))
+
+    def product(self):
+        self.call('product_detail', 'GET', f'/product/{self.product_id()}')
+
+    def search(self):
+        # search.js asks /search once per keystroke (past the debounce) from 2 chars
+        word = self.rng.choice(self.words)
+        for end in range(2, len(word) + 1):
+            self.call('search', 'GET', '/search', params={'q': word[:end]})
+            time.sleep(self.args.keystroke)
+        if self.rng.random() < 0.3:
+            self.call('search_results', 'GET', '/search-results', params={'q': word})
+
+    def cart(self):
+        self.ajax('add_to_cart', '/cart/add', {'product_id': self.product_id(), 'quantity': 1})
+        page = self.call('cart', 'GET', '/cart')
+        ids  = _CART_ID_RE.findall(page.text) if page is not None else []
+        if ids:
+            cart_id = int(self.rng.choice(ids))
+            if self.rng.random() < 0.5:
+                self.ajax('update_cart', '/cart/update',
+                          {'cart_id': cart_id, 'quantity': self.rng.randint(1, 3)})
+            else:
+                self.ajax('remove_from_cart', '/cart/remove', {'cart_id': cart_id})
+
+    def checkout(self):
+        self.ajax('add_to_cart', '/cart/add', {'product_id': self.product_id(), 'quantity': 1})
+        self.call('payment', 'GET', '/payment')
+        order = self.ajax('create_payment_order', '/payment/create-order', {})
+        if not order.get('success'):
+            return
+        started    = time.perf_counter()
+        payment_id = f'pay_bench{self.rng.getrandbits(48):x}'
+        signature  = hmac.new(self.args.razorpay_secret.encode(),
+                              f"{order['order_id']}|{payment_id}".encode(),
+                              hashlib.sha256).hexdigest()
+        result = self.ajax('verify_payment', '/payment/verify', {
+            'razorpay_order_id':   order['order_id'],
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature':  signature,
+        })
+        status = 'failed'
+        if result.get('success'):
+            deadline = time.monotonic() + self.args.checkout_timeout
+            while time.monotonic() < deadline:
+                response = self.call('payment_status', 'GET', result['status_url'])
+                status   = response.json().get('status') if response is not None else 'failed'
+                if status in ('done', 'failed'):
+                    break
+                time.sleep(self.args.poll)
+        # Verify → order written by the worker, as the shopper waits for it
+        self.recorder.add('checkout_end_to_end', time.perf_counter() - started,
+                          status == 'done')
+
+    def run(self, mix, deadline):
+        scenarios, weights = zip(*mix.items())
+        while time.monotonic() < deadline:
+            getattr(self, self.rng.choices(scenarios, weights)[0])()
+            if self.args.think:
+                time.sleep(self.rng.expovariate(1 / self.args.think))
+
+
+# ══════════════════════════════════════
+# REPORTING + BASELINE COMPARISON
+# ══════════════════════════════════════
+def print_report(routes, elapsed):
+    print(f"\n{'route':24} {'count':>7} {'err':>5} {'req/s':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, r in routes.items():
+        print(f"{route:24} {r['count']:7} {r['errors']:5} {r['rps']:8.2f} "
+              f"{r['p50_ms']:8.1f} {r['p95_ms']:8.1f} {r['p99_ms']:8.1f} {r['max_ms']:8.1f}")
+    total = sum(r['count'] for route, r in routes.items() if route != 'checkout_end_to_end')
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+
+
+def compare(current, baseline, threshold, min_ms):
+    """Print per-route diffs; returns the routes that regressed"""
+    regressions = []
+    print(f"\n{'route':24} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'req/s':>16}")
+    for route in sorted(set(current) | set(baseline)):
+        now, before = current.get(route), baseline.get(route)
+        if now is None or before is None:
+            print(f"{route:24} {'only in ' + ('baseline' if now is None else 'this run')}")
+            continue
+        cells, slower = [], False
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            delta = now[key] - before[key]
+            pct   = delta / before[key] * 100 if before[key] else 0.0
+            cells.append(f"{now[key]:7.1f} {pct:+7.1f}%  ")
+            if pct > threshold and delta > min_ms and key != 'p99_ms':
+                slower = True
+        rps_pct = (now['rps'] - before['rps']) / before['rps'] * 100 if before['rps'] else 0.0
+        flag    = '  ← REGRESSION' if slower else ''
+        print(f"{route:24} {''.join(cells)}{now['rps']:7.2f} {rps_pct:+6.1f}%{flag}")
+        if slower:
+            regressions.append(route)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SecureShop load test')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients',  type=int,   default=10,  help='concurrent virtual shoppers')
+    parser.add_argument('--duration', type=float, default=60,  help='measured seconds')
+    parser.add_argument('--warmup',   type=float, default=10,  help='unmeasured seconds first')
+    parser.add_argument('--users',    type=int,   default=50,  help='bench users to log in as (bench1..N)')
+    parser.add_argument('--products', type=int,   default=1000, help='highest product id to request')
+    parser.add_argument('--password', default=BENCH_PASSWORD)
+    parser.add_argument('--razorpay-secret', default=None,
+                        help="key secret used to sign payments (default: app.py's)")
+    parser.add_argument('--mix', default='',
+                        help='scenario weights, e.g. "browse=50,search=50" (default: %s)'
+                        % ','.join(f'{k}={v}' for k, v in MIX.items()))
+    parser.add_argument('--think',     type=float, default=0.0,  help='mean pause between scenarios (s)')
+    parser.add_argument('--keystroke', type=float, default=0.05, help='pause between search keystrokes (s)')
+    parser.add_argument('--poll',      type=float, default=0.5,  help='payment status poll interval (s)')
+    parser.add_argument('--checkout-timeout', type=float, default=30)
+    parser.add_argument('--timeout',   type=float, default=30,   help='per-request timeout (s)')
+    parser.add_argument('--seed',      type=int,   default=1)
+    parser.add_argument('--out', help='result file (default: bench/results/<timestamp>.json)')
+    parser.add_argument('--baseline', help='compare against this result file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='also write the run to bench/results/baseline.json')
+    parser.add_argument('--threshold', type=float, default=20,
+                        help='p50/p95 slowdown in %% that counts as a regression')
+    parser.add_argument('--min-ms', type=float, default=2,
+                        help='ignore slowdowns smaller than this many ms')
+    args = parser.parse_args()
+
+    if args.razorpay_secret is None:
+        os.environ.setdefault('DATABASE_URL', 'mysql://bench@localhost/bench')
+        from app import RAZORPAY_KEY_SECRET
+        args.razorpay_secret = RAZORPAY_KEY_SECRET
+
+    mix = dict(MIX)
+    if args.mix:
+        mix = {k: float(v) for k, v in (item.split('=') for item in args.mix.split(','))}
+        unknown = set(mix) - set(MIX)
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    categories, words = catalog_terms()
+    recorder = Recorder()
+    clients  = []
+    print(f"Logging in {args.clients} clients at {args.base_url} ...")
+    for i in range(args.clients):
+        client = Client(args, recorder, random.Random(args.seed * 100003 + i),
+                        f'bench{i % args.users + 1}@example.com', categories, words)
+        client.login()
+        clients.append(client)
+
+    started  = time.monotonic()
+    deadline = started + args.warmup + args.duration
+    threads  = [threading.Thread(target=c.run, args=(mix, deadline), daemon=True) for c in clients]
+    for t in threads:
+        t.start()
+    print(f"Warming up for {args.warmup:.0f}s, then measuring for {args.duration:.0f}s ...")
+    time.sleep(args.warmup)
+    recorder.active = True
+    measured_from   = time.monotonic()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - measured_from
+
+    routes = recorder.summary(elapsed)
+    print_report(routes, elapsed)
+
+    result = {
+        'started':  datetime.now().isoformat(timespec='seconds'),
+        'base_url': args.base_url,
+        'clients':  args.clients,
+        'duration': round(elapsed, 2),
+        'mix':      mix,
+        'routes':   routes,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    out   = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    paths = [out] + ([os.path.join(RESULTS_DIR, 'baseline.json')] if args.save_baseline else [])
+    for path in paths:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(routes, baseline['routes'], args.threshold, args.min_ms)
+        if regressions:
+            print(f"\nSlower than {args.baseline}: {', '.join(regressions)}")
+            sys.exit(1)
+        print(f"\nNo route more than {args.threshold:.0f}% slower than {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
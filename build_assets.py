@@ -0,0 +1,181 @@
+# build_assets.py - Build the fingerprinted CSS/JS bundles in static/dist
+#
+#   python build_assets.py            # run on every deploy, before starting gunicorn
+#
+# For each bundle in assets.BUNDLES: concatenate the sources, minify,
+# name the result after its content hash (css/site.3f9c2e1a7b.css), and
+# write .gz and .br copies next to it for nginx gzip_static/brotli_static
+# (and the /assets/ fallback route). manifest.json maps bundle names to
+# the hashed files. Files from earlier builds are kept so pages rendered
+# before a deploy can still load theirs; --clean removes them.
+#
+# The minifiers are deliberately conservative: comments and whitespace
+# go, strings / template literals / regexes are copied untouched, and JS
+# keeps its line breaks so automatic semicolon insertion is unchanged.
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+
+import brotli
+
+from assets import BUNDLES, DIST_DIR, MANIFEST_NAME, bundle_source
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+
+
+# ══════════════════════════════════════
+# MINIFIERS
+# ══════════════════════════════════════
+_CSS_TOKEN_RE   = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|(\s+)''', re.S)
+_CSS_TIGHT_RE   = re.compile(r'\s*([{};,>])\s*')
+_CSS_COLON_RE   = re.compile(r':\s+')
+_CSS_LAST_SEMI  = re.compile(r';}')
+
+
+def minify_css(css):
+    """Drop comments and collapse whitespace outside strings"""
+    literals = []
+
+    def keep(match):
+        string, comment, space = match.groups()
+        if string:
+            literals.append(string)
+            return f'\x00{len(literals) - 1}\x00'
+        return '' if comment else ' '
+
+    css = _CSS_TOKEN_RE.sub(keep, css)
+    css = _CSS_TIGHT_RE.sub(r'\1', css)
+    css = _CSS_COLON_RE.sub(':', css)        # never before ':' - `a :hover` ≠ `a:hover`
+    css = _CSS_LAST_SEMI.sub('}', css).strip()
+    return re.sub(r'\x00(\d+)\x00', lambda m: literals[int(m.group(1))], css)
+
+
+_JS_REGEX_AFTER = set('(,=:[!&|?{};+-*%<>~^\n')
+_JS_TIGHT       = set('{}()[];,:=<>!&|?+-*%')
+
+
+def minify_js(js):
+    """Strip comments, indentation and blank lines; squeeze spaces next to
+    punctuation. Newlines are kept (ASI)."""
+    out  = []
+    i, n = 0, len(js)
+
+    def last_significant():
+        for chunk in reversed(out):
+            stripped = chunk.rstrip(' ')
+            if stripped:
+                return stripped[-1]
+        return '\n'
+
+    while i < n:
+        c = js[i]
+        if c in '"\'`':                                  # string / template literal
+            j = i + 1
+            while j < n and js[j] != c:
+                j += 2 if js[j] == '\\' else 1
+            out.append(js[i:j + 1])
+            i = j + 1
+        elif js.startswith('//', i):
+            j = js.find('\n', i)
+            i = n if j < 0 else j
+        elif js.startswith('/*', i):
+            j = js.find('*/', i + 2)
+            i = n if j < 0 else j + 2
+        elif c == '/' and last_significant() in _JS_REGEX_AFTER:
+            j, in_class = i + 1, False                   # regex literal
+            while j < n and (in_class or js[j] != '/'):
+                if js[j] == '\\':
+                    j += 1
+                elif js[j] == '[':
+                    in_class = True
+                elif js[j] == ']':
+                    in_class = False
+                j += 1
+            while j + 1 < n and js[j + 1].isalpha():     # flags
+                j += 1
+            out.append(js[i:j + 1])
+            i = j + 1
+        elif c.isspace():
+            j = i
+            while j < n and js[j].isspace():
+                j += 1
+            newline = '\n' in js[i:j]
+            prev    = last_significant()
+            nxt     = js[j] if j < n else '\n'
+            if newline:
+                if prev != '\n':
+                    while out and out[-1] == ' ':
+                        out.pop()
+                    out.append('\n')
+            elif prev not in _JS_TIGHT and nxt not in _JS_TIGHT and prev != '\n':
+                out.append(' ')
+            elif (prev in '+-' and nxt == prev):         # keep `a + +b`, `a - -b`
+                out.append(' ')
+            i = j
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out).strip() + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+# ══════════════════════════════════════
+# BUILD
+# ══════════════════════════════════════
+def write_bundle(dist, bundle, content):
+    """Write name.<hash>.ext plus .gz/.br; returns the path relative to dist"""
+    data   = content.encode('utf-8')
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    stem, ext = os.path.splitext(bundle)
+    name   = f'{stem}.{digest}{ext}'
+    path   = os.path.join(dist, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(data)
+        with open(path + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted CSS/JS bundles')
+    parser.add_argument('--clean', action='store_true',
+                        help='delete files from earlier builds')
+    parser.add_argument('--no-minify', action='store_true')
+    args = parser.parse_args()
+
+    dist     = os.path.join(STATIC_DIR, DIST_DIR)
+    manifest = {}
+    for bundle in BUNDLES:
+        source  = bundle_source(STATIC_DIR, bundle)
+        minify  = MINIFIERS[os.path.splitext(bundle)[1]]
+        content = source if args.no_minify else minify(source)
+        manifest[bundle] = write_bundle(dist, bundle, content)
+        sizes = [os.path.getsize(os.path.join(dist, manifest[bundle]) + s) for s in ('', '.gz', '.br')]
+        print(f"  {bundle:18} {len(source.encode()):>7,} → {sizes[0]:>7,} min  "
+              f"{sizes[1]:>6,} gz  {sizes[2]:>6,} br   {manifest[bundle]}")
+
+    with open(os.path.join(dist, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if args.clean:
+        current = {p + s for p in manifest.values() for s in ('', '.gz', '.br')} | {MANIFEST_NAME}
+        for root, _, files in os.walk(dist):
+            for name in files:
+                rel = os.path.relpath(os.path.join(root, name), dist).replace(os.sep, '/')
+                if rel not in current:
+                    os.remove(os.path.join(root, name))
+    print(f"Wrote {len(manifest)} bundles and {DIST_DIR}/{MANIFEST_NAME}")
+
+
+if __name__ == '__main__':
+    main()
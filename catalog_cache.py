@@ -0,0 +1,299 @@
+# catalog_cache.py - In-process cache for the product catalog
+#
+# The products table is ~1000 rows that change only on stock/price writes,
+# so listing and detail pages read it from here instead of MySQL. Entries
+# expire after a TTL, the least recently used ones are evicted when the
+# cache is full, and writers call invalidate_products() / clear().
+#
+# Cached rows are shared between requests - treat them as read-only.
+
+import threading
+import time
+from collections import OrderedDict
+
+from pagination import anchors_query, page_query
+
+_MISSING = object()
+
+
+# ══════════════════════════════════════
+# GENERIC TTL + LRU CACHE
+# ══════════════════════════════════════
+class TTLCache:
+    """Thread-safe LRU mapping whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize=2048, ttl=300):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._data   = OrderedDict()   # key → (expires_at, value)
+        self._lock   = threading.Lock()
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            # Load outside the lock; a concurrent miss just loads twice
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def drop_where(self, predicate):
+        """Remove every entry whose key matches predicate(key)"""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ══════════════════════════════════════
+# CATALOG CACHE
+# ══════════════════════════════════════
+class CatalogCache:
+    """Product rows by id, listings by (category, sort), and category names.
+
+    Keys:
+      ('product', id)                       single product row (or None)
+      ('categories',)                       SELECT DISTINCT category rows
+      ('featured', limit)                   top rated in-stock products
+      ('listing', category, sort, limit, after, before)   one keyset page
+      ('anchors', category, sort, per_page) page-boundary keys for page jumps
+      ('counts',)                           in-stock count per category
+      ('modified',)                         newest updated_at in the catalog
+
+    `version` increases on every invalidation so callers can build
+    cache keys / validators that change whenever the catalog does.
+    """
+
+    def __init__(self, maxsize=2048, ttl=300):
+        self._cache  = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock   = threading.Lock()
+        self._placed = {}       # product id → _placement() of the last row seen
+        self.version = 1
+
+    # ── reads ────────────────────────────────────────────
+    def product(self, db, product_id):
+        def load():
+            cursor = db.cursor()
+            cursor.execute("SELECT * FROM products WHERE id = %s", (product_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            return self._remember([row])[0] if row else row
+        return self._cache.get_or_load(('product', product_id), load)
+
+    def cached_product(self, product_id):
+        """The product row if it is cached, else None - never queries"""
+        return self._cache.get(('product', product_id))
+
+    def products_by_ids(self, db, ids):
+        """{id: row} for the given ids, one IN (...) query for the misses"""
+        found, missing = {}, []
+        for pid in ids:
+            row = self._cache.get(('product', pid), _MISSING)
+            if row is _MISSING:
+                missing.append(pid)
+            elif row is not None:
+                found[pid] = row
+        if missing:
+            cursor = db.cursor()
+            placeholders = ','.join(['%s'] * len(missing))
+            cursor.execute(
+                f"SELECT * FROM products WHERE id IN ({placeholders})", missing)
+            for row in self._remember(cursor.fetchall()):
+                found[row['id']] = row
+            cursor.close()
+        return found
+
+    def categories(self, db):
+        def load():
+            cursor = db.cursor()
+            cursor.execute("SELECT DISTINCT category FROM products ORDER BY category")
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+        return self._cache.get_or_load(('categories',), load)
+
+    def featured(self, db, limit):
+        def load():
+            cursor = db.cursor()
+            cursor.execute("""
+                SELECT * FROM products
+                WHERE stock > 0
+                ORDER BY rating DESC
+                LIMIT %s
+            """, (limit,))
+            rows = cursor.fetchall()
+            cursor.close()
+            return self._remember(rows)
+        return self._cache.get_or_load(('featured', limit), load)
+
+    def listing(self, db, category, sort, limit, after=None, before=None):
+        """One page in (category, sort) order, after/before a (value, id) key"""
+        def load():
+            sql, params = page_query(category, sort, limit, after, before)
+            cursor = db.cursor()
+            cursor.execute(sql, params)
+            rows = list(cursor.fetchall())
+            cursor.close()
+            if before is not None:
+                rows.reverse()
+            return self._remember(rows)
+        return self._cache.get_or_load(
+            ('listing', category, sort, limit, after, before), load)
+
+    def page_anchors(self, db, category, sort, per_page):
+        """[(value, id), ...] - anchors[n] is the `after` key of page n + 2"""
+        def load():
+            sql, params = anchors_query(category, sort, per_page)
+            cursor = db.cursor()
+            cursor.execute(sql, params)
+            anchors = [(str(r['sort_value']), r['id']) for r in cursor.fetchall()]
+            cursor.close()
+            return anchors
+        return self._cache.get_or_load(('anchors', category, sort, per_page), load)
+
+    def count(self, db, category):
+        """In-stock products in a category ('' = all), from one cached GROUP BY"""
+        def load():
+            cursor = db.cursor()
+            cursor.execute("""
+                SELECT category, COUNT(*) as total FROM products
+                WHERE stock > 0
+                GROUP BY category
+            """)
+            counts = {r['category']: r['total'] for r in cursor.fetchall()}
+            cursor.close()
+            return counts
+        counts = self._cache.get_or_load(('counts',), load)
+        return counts.get(category, 0) if category else sum(counts.values())
+
+    def last_modified(self, db=None):
+        """Newest products.updated_at - changes on any write to the table.
+        Without db, only a cached value is returned (or None)."""
+        def load():
+            cursor = db.cursor()
+            cursor.execute("SELECT MAX(updated_at) as modified FROM products")
+            row = cursor.fetchone()
+            cursor.close()
+            return row['modified'] if row else None
+        if db is None:
+            return self._cache.get(('modified',))
+        return self._cache.get_or_load(('modified',), load)
+
+    def _remember(self, rows):
+        # Listing rows are full product rows - reuse them for detail lookups
+        for row in rows:
+            self._cache.set(('product', row['id']), row)
+            self._placed[row['id']] = _placement(row)
+        return rows
+
+    # ── writes ───────────────────────────────────────────
+    def invalidate_products(self, product_ids, rows=None):
+        """Call after writing stock/price/name of these products.
+
+        rows  {id: new row} with at least category, price, rating and
+              stock (a missing id was deleted). Without it every listing,
+              anchor list and count goes. With it only the listings of
+              the products' categories go, and page anchors / counts only
+              where a product changed category, sort key or sold out /
+              came back - a checkout's stock decrement keeps them.
+        """
+        ids = set(product_ids)
+        if not ids:
+            return
+        if rows is None:
+            self._cache.drop_where(
+                lambda k: (k[0] == 'product' and k[1] in ids) or k[0] != 'product')
+            self._bump()
+            return
+
+        listed, moved, recount = {''}, set(), False   # '' = the all-categories listing
+        for product_id in ids:
+            row = rows.get(product_id)
+            new = _placement(row) if row else None
+            old = self._placed.pop(product_id, None)
+            if new:
+                self._placed[product_id] = new
+            # Not seen before: assume its category held it (a category
+            # change then leaves the old one's anchors to the TTL)
+            categories = {p[0] for p in (old, new) if p}
+            listed |= categories
+            if old != new:
+                moved   |= categories
+                recount |= old is None or new is None or old[0] != new[0] or old[3] != new[3]
+        if moved:
+            moved.add('')
+
+        def stale(key):
+            kind = key[0]
+            if kind == 'product':
+                return key[1] in ids
+            if kind == 'listing':
+                return key[1] in listed
+            if kind == 'anchors':
+                return key[1] in moved
+            if kind in ('counts', 'categories'):
+                return recount
+            return True                    # featured, modified
+        self._cache.drop_where(stale)
+        self._bump()
+
+    def clear(self):
+        self._cache.clear()
+        self._placed.clear()
+        self._bump()
+
+    def _bump(self):
+        with self._lock:
+            self.version += 1
+
+    def stats(self):
+        c = self._cache
+        lookups = c.hits + c.misses
+        return {
+            'entries':   len(c),
+            'maxsize':   c.maxsize,
+            'ttl':       c.ttl,
+            'hits':      c.hits,
+            'misses':    c.misses,
+            'evictions': c.evictions,
+            'hit_ratio': round(c.hits / lookups, 4) if lookups else 0.0,
+            'version':   self.version,
+        }
+
+
+def _placement(row):
+    """Where a row sits in the listings: (category, price, rating, in stock)"""
+    return (row['category'], str(row['price']), str(row['rating']), row['stock'] > 0)
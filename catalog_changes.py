@@ -0,0 +1,142 @@
+# catalog_changes.py - Cross-process product change feed (catalog_changes table)
+#
+# import_catalog.py and the payment worker (checkout stock) run outside
+# the web workers, so their catalog cache, search index and random-pick
+# pools can't see what they wrote. Each import chunk and each order
+# appends the ids it touched to catalog_changes in the same transaction as
+# the product rows; every web worker tails the table every
+# CATALOG_CHANGES_POLL seconds and refreshes just those products.
+#
+# A worker that falls more than `batch` changes behind (a big import)
+# stops refreshing one by one: it clears its catalog cache and rebuilds
+# the search index and pick pools in the background instead.
+#
+# AUTO_INCREMENT ids are handed out at INSERT, not at COMMIT: a chunk that
+# commits late can land below ids a worker has already read past. Ids
+# skipped below the position are kept as gaps and looked up again on each
+# poll until they show up or are `gap_timeout` seconds old (a rolled-back
+# chunk leaves gaps that never fill).
+
+import threading
+import time
+
+KEEP_HOURS = 24   # import_catalog.py and worker.py prune older changes
+
+
+def record_changes(cursor, product_ids):
+    """Log changed products (part of the caller's transaction)"""
+    cursor.executemany(
+        "INSERT INTO catalog_changes (product_id) VALUES (%s)",
+        [(product_id,) for product_id in product_ids]
+    )
+
+
+def prune_changes(cursor, keep_hours=KEEP_HOURS):
+    cursor.execute(
+        "DELETE FROM catalog_changes WHERE changed_at < NOW() - INTERVAL %s HOUR",
+        (keep_hours,)
+    )
+    return cursor.rowcount
+
+
+class ChangeFeed:
+    """One web worker's position in catalog_changes.
+
+    interval     seconds between polls (0 = never poll)
+    batch        most changes applied one by one per poll
+    gap_timeout  seconds a skipped id is waited for
+    """
+
+    def __init__(self, interval=5, batch=2000, gap_timeout=60):
+        self.interval    = interval
+        self.batch       = batch
+        self.gap_timeout = gap_timeout
+        self.last_id     = None      # set on the first poll
+        self._gaps       = {}        # id not seen below last_id → monotonic time it was skipped
+        self._next_poll  = 0.0
+        self._lock       = threading.Lock()
+        self._stats      = {'polls': 0, 'changes': 0, 'late': 0, 'gaps_expired': 0, 'resets': 0}
+
+    def due(self):
+        return self.interval > 0 and time.monotonic() >= self._next_poll
+
+    def poll(self, db):
+        """(product ids changed since the last poll, too_many).
+
+        too_many means the backlog was over `batch`: the ids are empty and
+        the caller should drop everything. The first poll only records the
+        current position - nothing is cached yet. Returns None if another
+        thread is polling right now.
+        """
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            now = time.monotonic()
+            self._next_poll = now + self.interval
+            cursor = db.cursor()
+            try:
+                if self.last_id is None:
+                    self._jump_to_end(cursor, now)
+                    return set(), False
+                self._stats['polls'] += 1
+                late = self._fill_gaps(cursor, now)
+                cursor.execute("""
+                    SELECT id, product_id FROM catalog_changes
+                    WHERE id > %s ORDER BY id LIMIT %s
+                """, (self.last_id, self.batch + 1))
+                rows = cursor.fetchall()
+                if len(rows) > self.batch:
+                    self._jump_to_end(cursor, now)
+                    self._stats['resets'] += 1
+                    return set(), True
+                if rows:
+                    self._skipped({r['id'] for r in rows}, self.last_id, rows[-1]['id'], now)
+                    self.last_id = rows[-1]['id']
+                self._stats['changes'] += len(rows) + len(late)
+                return {r['product_id'] for r in [*late, *rows]}, False
+            finally:
+                cursor.close()
+        finally:
+            self._lock.release()
+
+    def _jump_to_end(self, cursor, now):
+        """Start from the newest change (nothing cached, or everything just
+        dropped), still watching for late commits among the last `batch` ids"""
+        cursor.execute("SELECT id FROM catalog_changes ORDER BY id DESC LIMIT %s", (self.batch,))
+        ids = [r['id'] for r in cursor.fetchall()]
+        self._gaps.clear()
+        if ids:
+            self._skipped(set(ids), ids[-1], ids[0], now)
+        self.last_id = ids[0] if ids else 0
+
+    def _fill_gaps(self, cursor, now):
+        """Rows that have committed since their id was skipped"""
+        for change_id, skipped_at in list(self._gaps.items()):
+            if now - skipped_at > self.gap_timeout:
+                del self._gaps[change_id]
+                self._stats['gaps_expired'] += 1
+        if not self._gaps:
+            return []
+        ids = list(self._gaps)
+        cursor.execute(f"""
+            SELECT id, product_id FROM catalog_changes
+            WHERE id IN ({','.join(['%s'] * len(ids))})
+        """, ids)
+        rows = cursor.fetchall()
+        for r in rows:
+            del self._gaps[r['id']]
+        self._stats['late'] += len(rows)
+        return rows
+
+    def _skipped(self, seen, low, high, now):
+        """Record ids in (low, high) that weren't among `seen`, keeping at
+        most `batch` gaps (the newest)"""
+        for change_id in range(max(low + 1, high - self.batch), high):
+            if change_id not in seen:
+                self._gaps[change_id] = now
+        while len(self._gaps) > self.batch:
+            del self._gaps[next(iter(self._gaps))]
+
+    def stats(self):
+        return dict(self._stats, last_id=self.last_id, gaps=len(self._gaps),
+                    interval=self.interval, batch=self.batch)
@@ -0,0 +1,117 @@
+# checkout.py - Order write path for a verified payment
+#
+# A checkout is one transaction with the same handful of statements no
+# matter how many lines the cart has:
+#   1. lock the cart lines and their products (SELECT ... FOR UPDATE)
+#   2. decrement stock for every line in one guarded UPDATE ... JOIN
+#      that skips any product whose stock would go negative
+#   3. insert the order (bumping the user's order stats), then all
+#      order_items in one multi-row INSERT
+#   4. log the products to catalog_changes, clear the cart and COMMIT
+#      once - every web worker's change feed then refreshes their stock
+# If a product sold out in the meantime, nothing is written and
+# OutOfStock says which ones. The cart can also change between paying and
+# the worker getting to the job, so the locked lines must add up to the
+# amount the Razorpay order was created for (AmountMismatch otherwise).
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from catalog_changes import record_changes
+
+
+class CheckoutError(Exception):
+    """The cart cannot be turned into an order; nothing was written"""
+    user_message = 'Your cart could not be checked out'
+
+
+class EmptyCart(CheckoutError):
+    user_message = 'Your cart is empty'
+
+
+class OutOfStock(CheckoutError):
+    user_message = 'Some items in your cart just sold out'
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Not enough stock for products {self.product_ids}")
+
+
+class AmountMismatch(CheckoutError):
+    user_message = 'Your cart changed after you paid'
+
+    def __init__(self, cart_paise, paid_paise):
+        super().__init__(f"Cart total {cart_paise} paise, payment {paid_paise} paise")
+
+
+def to_paise(amount):
+    """Rupees (Decimal, float or str) → whole paise, rounded half up"""
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+
+
+def place_order(db, user_id, transaction_id, razorpay_order_id=None, paid_paise=None):
+    """Turn the user's cart into a paid order.
+
+    paid_paise  what the payment was for; the cart must still total this
+    Returns (order id, [product ids]) after committing; on CheckoutError
+    or any database error the transaction is rolled back.
+    """
+    cursor = db.cursor()
+    try:
+        # 1. Lock the lines and product rows so prices and stock can't move
+        cursor.execute("""
+            SELECT c.quantity, p.id as product_id, p.price, p.stock
+            FROM cart c JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = %s
+            FOR UPDATE
+        """, (user_id,))
+        lines = cursor.fetchall()
+        if not lines:
+            raise EmptyCart("Cart is empty")
+        if any(line['quantity'] < 1 for line in lines):
+            raise CheckoutError("Cart has an invalid quantity")
+        short = {l['product_id'] for l in lines if l['stock'] < l['quantity']}
+        if short:
+            raise OutOfStock(short)
+        total = sum(l['price'] * l['quantity'] for l in lines)
+        if paid_paise is not None and to_paise(total) != paid_paise:
+            raise AmountMismatch(to_paise(total), paid_paise)
+
+        # 2. Every line or none: the stock guard is checked per row
+        cursor.execute("""
+            UPDATE products p JOIN cart c ON c.product_id = p.id
+            SET p.stock = p.stock - c.quantity
+            WHERE c.user_id = %s AND p.stock >= c.quantity
+        """, (user_id,))
+        if cursor.rowcount != len(lines):
+            raise OutOfStock({l['product_id'] for l in lines})
+
+        # 3. Order + all of its items
+        cursor.execute("""
+            INSERT INTO orders (user_id, total_amount, payment_status,
+                                transaction_id, razorpay_order_id, item_count)
+            VALUES (%s, %s, 'paid', %s, %s, %s)
+        """, (user_id, total, transaction_id, razorpay_order_id, len(lines)))
+        order_id = cursor.lastrowid
+        cursor.execute("""
+            UPDATE users SET order_count = order_count + 1,
+                             total_spent = total_spent + %s
+            WHERE id = %s
+        """, (total, user_id))
+
+        # pymysql sends executemany() INSERTs as a single multi-row statement
+        cursor.executemany("""
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            VALUES (%s, %s, %s, %s)
+        """, [(order_id, l['product_id'], l['quantity'], l['price']) for l in lines])
+
+        # 4. Stock changed: tell every worker. Clear cart, one commit for everything
+        record_changes(cursor, [l['product_id'] for l in lines])
+        cursor.execute("DELETE FROM cart WHERE user_id = %s", (user_id,))
+        db.commit()
+        return order_id, [l['product_id'] for l in lines]
+
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
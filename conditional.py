@@ -0,0 +1,42 @@
+# conditional.py - ETag / Last-Modified validators and 304 responses
+#
+# A page's validator is a hash of what it is built from: catalog data
+# (a product's updated_at, or the newest updated_at in the catalog for
+# listings) plus whatever of the visitor's session is rendered into it.
+# Routes work the validator out from values already in memory and answer
+# 304 before any query or template; when something would need a query to
+# be exact, they render as usual and attach the validator afterwards.
+#
+# Logged-in pages are `private, no-cache` - the browser keeps a copy but
+# revalidates on every view. Responses that are the same for everyone
+# (the /search JSON) can be `public` with a short max-age instead.
+
+import hashlib
+
+from flask import Response, request
+
+PRIVATE = 'private, no-cache'
+
+
+def make_etag(*parts):
+    """Short hash of the values a response was built from"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:20]
+
+
+def with_validators(response, etag, last_modified=None, cache_control=PRIVATE):
+    """Attach a weak ETag, Last-Modified and Cache-Control to a response"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def not_modified(etag, last_modified=None, cache_control=PRIVATE):
+    """A 304 if the request's If-None-Match has this ETag, else None.
+
+    If-Modified-Since alone never gives a 304: the date only covers the
+    catalog side of a page, the ETag also covers the visitor's state."""
+    if request.method not in ('GET', 'HEAD') or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_validators(Response(status=304), etag, last_modified, cache_control)
@@ -0,0 +1,247 @@
+# facets.py - Faceted browse for /products over column arrays of the catalog
+#
+# Each worker keeps NumPy columns - id, category code, price (paise),
+# rating (tenths), stock and price bucket - one slot per product. A filter
+# combination is a few vectorised boolean masks, so any mix of categories,
+# price ranges and a minimum rating costs the same O(n) pass, with no SQL.
+#
+# Counts follow the usual facet rule: each facet is counted with every
+# filter applied except its own, so "Men (120)" still shows while Women
+# is selected. Pages come from a precomputed row order per sort:
+# order[mask[order]] lists the matching rows already sorted, and page k is
+# a slice of that - no per-request sort, and page 500 costs what page 1
+# does.
+#
+# refresh_products() keeps the columns current in place. Stock-only
+# changes (checkouts) leave the sort orders alone; price, rating or new
+# products make the next query re-sort once.
+
+import threading
+import time
+from decimal import Decimal
+
+import numpy as np
+import pymysql.cursors
+
+# Price buckets in ₹: under 500, 500-1000, ..., 5000 and above
+PRICE_EDGES  = (500, 1000, 2000, 5000)
+RATING_STEPS = (4, 3, 2)   # "4★ & up", ...
+_EDGES_PAISE = np.array(PRICE_EDGES, dtype=np.int64) * 100
+
+FACET_ROWS_SQL = "SELECT id, category, price, rating, stock FROM products"
+
+
+def price_label(bucket):
+    """'Under ₹500', '₹500 – ₹1,000', ..., '₹5,000 & above'"""
+    if bucket == 0:
+        return f'Under ₹{PRICE_EDGES[0]:,}'
+    if bucket == len(PRICE_EDGES):
+        return f'₹{PRICE_EDGES[-1]:,} & above'
+    return f'₹{PRICE_EDGES[bucket - 1]:,} – ₹{PRICE_EDGES[bucket]:,}'
+
+
+def _paise(value):
+    return int(Decimal(value) * 100) if value is not None else 0
+
+
+def _tenths(value):
+    return int(Decimal(value) * 10) if value is not None else 0
+
+
+def load_rows(conn, product_ids=None):
+    """(id, category, price, rating, stock) tuples, streamed"""
+    sql, params = FACET_ROWS_SQL, ()
+    if product_ids is not None:
+        params = list(product_ids)
+        sql   += f" WHERE id IN ({','.join(['%s'] * len(params))})"
+    cursor = conn.cursor(pymysql.cursors.SSCursor)
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(50000)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+class FacetResult:
+    __slots__ = ('ids', 'total', 'categories', 'prices', 'ratings')
+
+    def __init__(self, ids, total, categories, prices, ratings):
+        self.ids        = ids          # product ids of the requested page, in order
+        self.total      = total        # matching products
+        self.categories = categories   # [(name, count)] - counted without the category filter
+        self.prices     = prices       # [(bucket, label, count)] - without the price filter
+        self.ratings    = ratings      # [(stars, count)] - "stars & up", without the rating filter
+
+
+class FacetIndex:
+    def __init__(self):
+        self._lock       = threading.Lock()    # writers; readers use a snapshot
+        self._cols       = self._empty(0)
+        self._n          = 0
+        self._pos        = {}                  # product id → slot
+        self._categories = []                  # code → name
+        self._codes      = {}                  # name → code
+        self._orders     = {}                  # sort → slots in that order (for _n slots)
+        self.built_at    = None
+
+    @staticmethod
+    def _empty(size):
+        return {
+            'id':       np.zeros(size, dtype=np.int32),
+            'category': np.zeros(size, dtype=np.int16),
+            'price':    np.zeros(size, dtype=np.int64),
+            'rating':   np.zeros(size, dtype=np.int16),
+            'stock':    np.zeros(size, dtype=np.int32),   # -1 = removed
+            'bucket':   np.zeros(size, dtype=np.int8),    # price bucket
+        }
+
+    # ══════════════════════════════════════
+    # BUILD / INCREMENTAL UPDATES
+    # ══════════════════════════════════════
+    def build(self, rows):
+        """rows: (id, category, price, rating, stock) from load_rows()"""
+        ids, codes, prices, ratings, stocks = [], [], [], [], []
+        names, code_of = [], {}
+        for product_id, category, price, rating, stock in rows:
+            code = code_of.get(category)
+            if code is None:
+                code = code_of[category] = len(names)
+                names.append(category)
+            ids.append(product_id)
+            codes.append(code)
+            prices.append(price or 0)
+            ratings.append(rating or 0)
+            stocks.append(stock or 0)
+
+        cols = self._empty(len(ids))
+        cols['id'][:]       = ids
+        cols['category'][:] = codes
+        cols['price'][:]    = np.rint(np.array(prices, dtype=np.float64) * 100)
+        cols['rating'][:]   = np.rint(np.array(ratings, dtype=np.float64) * 10)
+        cols['stock'][:]    = stocks
+        cols['bucket'][:]   = np.searchsorted(_EDGES_PAISE, cols['price'], side='right')
+        with self._lock:
+            self._cols, self._n = cols, len(ids)
+            self._pos = {product_id: slot for slot, product_id in enumerate(ids)}
+            self._categories, self._codes = names, code_of
+            self._orders  = {}
+            self.built_at = time.monotonic()
+
+    def mark_stale(self):
+        """Have the next use rebuild this in the background"""
+        if self.built_at is not None:
+            self.built_at = float('-inf')
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    def upsert(self, row):
+        """row: a product dict (id, category, price, rating, stock)"""
+        with self._lock:
+            self._put(row['id'], row['category'], row['price'], row['rating'], row['stock'])
+
+    def remove(self, product_id):
+        with self._lock:
+            slot = self._pos.get(product_id)
+            if slot is not None:
+                self._cols['stock'][slot] = -1
+
+    def _put(self, product_id, category, price, rating, stock):
+        code = self._codes.get(category)
+        if code is None:
+            code = self._codes[category] = len(self._categories)
+            self._categories.append(category)
+        price, rating = _paise(price), _tenths(rating)
+
+        slot = self._pos.get(product_id)
+        cols = self._cols
+        if slot is None:
+            if self._n == len(cols['id']):
+                grown = self._empty(max(1024, 2 * self._n))
+                for name, column in cols.items():
+                    grown[name][:self._n] = column[:self._n]
+                self._cols = cols = grown      # readers keep the old arrays
+            slot = self._pos[product_id] = self._n
+            cols['id'][slot] = product_id
+            self._n += 1
+            self._orders = {}
+        elif cols['price'][slot] != price or cols['rating'][slot] != rating:
+            self._orders = {}
+        cols['category'][slot] = code
+        cols['price'][slot]    = price
+        cols['rating'][slot]   = rating
+        cols['stock'][slot]    = stock or 0
+        cols['bucket'][slot]   = np.searchsorted(_EDGES_PAISE, price, side='right')
+
+    # ══════════════════════════════════════
+    # QUERIES
+    # ══════════════════════════════════════
+    def _order(self, sort, cols, n):
+        """Slots sorted like pagination.SORT_KEYS (id breaks ties)"""
+        orders = self._orders
+        order  = orders.get(sort)
+        if order is None or len(order) != n:
+            ids = cols['id'][:n]
+            if sort in ('price_asc', 'price_desc'):
+                order = np.lexsort((ids, cols['price'][:n]))
+                if sort == 'price_desc':
+                    order = order[::-1]
+            elif sort == 'rating':
+                order = np.lexsort((ids, cols['rating'][:n]))[::-1]
+            else:
+                order = np.argsort(ids)[::-1]
+            order = np.ascontiguousarray(order, dtype=np.int32)
+            orders[sort] = order
+        return order
+
+    def query(self, categories=(), price_buckets=(), min_rating=None,
+              sort='', offset=0, limit=20):
+        """One page of in-stock products plus the facet counts"""
+        with self._lock:
+            cols, n  = self._cols, self._n
+            names    = list(self._categories)
+            codes    = [self._codes[c] for c in categories if c in self._codes]
+        category = cols['category'][:n]
+        bucket   = cols['bucket'][:n]
+        rating   = cols['rating'][:n]
+        base     = cols['stock'][:n] > 0
+
+        everything = np.ones(n, dtype=bool)
+        by_category = np.isin(category, codes) if categories else everything
+        by_price    = np.isin(bucket, list(price_buckets)) if price_buckets else everything
+        by_rating   = rating >= int(min_rating * 10) if min_rating else everything
+
+        matching = base & by_category & by_price & by_rating
+        order    = self._order(sort, cols, n)
+        hits     = order[matching[order]]
+        page_ids = cols['id'][hits[offset:offset + limit]].tolist()
+
+        category_counts = np.bincount(category[base & by_price & by_rating], minlength=len(names))
+        price_counts    = np.bincount(bucket[base & by_category & by_rating],
+                                      minlength=len(PRICE_EDGES) + 1)
+        rated           = rating[base & by_category & by_price]
+        return FacetResult(
+            ids        = page_ids,
+            total      = len(hits),
+            categories = sorted((names[code], int(count))
+                                for code, count in enumerate(category_counts) if count),
+            prices     = [(b, price_label(b), int(count)) for b, count in enumerate(price_counts)],
+            ratings    = [(stars, int(np.count_nonzero(rated >= 10 * stars)))
+                          for stars in RATING_STEPS],
+        )
+
+    def stats(self):
+        cols, n = self._cols, self._n
+        return {
+            'products':    n,
+            'in_stock':    int(np.count_nonzero(cols['stock'][:n] > 0)),
+            'categories':  len(self._categories),
+            'sort_orders': sorted(self._orders),
+            'bytes':       sum(c.nbytes for c in cols.values()) +
+                           sum(o.nbytes for o in self._orders.values()),
+        }
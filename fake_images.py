@@ -0,0 +1,124 @@
+# fake_images.py - Local image host for offline product image tests
+#
+# Stands in for the servers products.image_url points at, so /img/ and the
+# import pre-warm can be exercised and load-tested without the internet:
+#
+#   python fake_images.py --port 8098 --latency 0.3
+#   python bench/seed.py --scale small --image-base http://127.0.0.1:8098
+#
+# GET /<anything>.jpg (or .png / .webp) returns a camera-sized image,
+# generated from the path so the same URL always gets the same picture;
+# /<w>x<h>/<anything>.jpg picks the size. Paths under /missing/ are 404s,
+# --fail-rate answers that fraction with a 503, --latency / --jitter delay
+# every answer. GET /_stats lists how often each path was fetched - a
+# working /img/ cache fetches each one once.
+
+import argparse
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+FORMATS = {'jpg': ('JPEG', 'image/jpeg'), 'jpeg': ('JPEG', 'image/jpeg'),
+           'png': ('PNG', 'image/png'), 'webp': ('WEBP', 'image/webp')}
+
+_fetches = Counter()
+_lock    = threading.Lock()
+
+
+def render(path, fmt, size):
+    """A deterministic picture for `path`: a colour gradient with a few shapes"""
+    seed  = int(hashlib.sha1(path.encode('utf-8')).hexdigest()[:8], 16)
+    rng   = random.Random(seed)
+    start = [rng.randrange(256) for _ in range(3)]
+    end   = [rng.randrange(256) for _ in range(3)]
+    strip = Image.new('RGB', (1, 256))
+    for y in range(256):
+        strip.putpixel((0, y), tuple(s + (e - s) * y // 255 for s, e in zip(start, end)))
+    im   = strip.resize(size)
+    draw = ImageDraw.Draw(im)
+    for _ in range(6):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        r    = rng.randrange(size[0] // 10, size[0] // 3)
+        draw.ellipse((x - r, y - r, x + r, y + r),
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    im.save(out, FORMATS[fmt][0], quality=92)
+    return out.getvalue()
+
+
+class FakeImageHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    options          = argparse.Namespace(latency=0.0, jitter=0.0, fail_rate=0.0,
+                                          width=1600, height=1200)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/_stats':
+            with _lock:
+                stats = dict(_fetches)
+            return self._send(200, json.dumps(stats, indent=1).encode(), 'application/json')
+
+        opts  = self.options
+        delay = opts.latency + random.uniform(0, opts.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        with _lock:
+            _fetches[path] += 1
+
+        match = re.search(r'\.(jpe?g|png|webp)$', path, re.I)
+        if path.startswith('/missing/') or not match:
+            return self._send(404, b'Not found', 'text/plain')
+        if opts.fail_rate and random.random() < opts.fail_rate:
+            return self._send(503, b'Simulated failure', 'text/plain')
+
+        fmt  = match.group(1).lower()
+        size = re.match(r'/(\d{1,4})x(\d{1,4})/', path)
+        size = (max(1, int(size.group(1))), max(1, int(size.group(2)))) if size else \
+               (opts.width, opts.height)
+        self._send(200, render(path, fmt, size), FORMATS[fmt][1])
+
+    do_HEAD = do_GET
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake product image host')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8098)
+    parser.add_argument('--width',     type=int,   default=1600, help='default image width')
+    parser.add_argument('--height',    type=int,   default=1200, help='default image height')
+    parser.add_argument('--latency',   type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter',    type=float, default=0.0, help='extra random 0..jitter seconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction answered with 503')
+    args = parser.parse_args()
+
+    FakeImageHandler.options = args
+    server = ThreadingHTTPServer((args.host, args.port), FakeImageHandler)
+    server.daemon_threads = True
+    print(f"Fake image host listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
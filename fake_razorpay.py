@@ -0,0 +1,127 @@
+# fake_razorpay.py - Local stand-in for the Razorpay Orders API
+#
+# Lets the payment adapter be exercised and load-tested offline:
+#
+#   python fake_razorpay.py --port 8099 --latency 0.2 --fail-rate 0.05
+#   RAZORPAY_BASE_URL=http://127.0.0.1:8099 python app.py
+#
+# Implements POST /v1/orders and GET /v1/orders/<id> with Razorpay-shaped
+# JSON. --latency / --jitter add a delay per request, --fail-rate answers
+# that fraction with a 503 SERVER_ERROR, and --hang-rate never answers
+# (until the client's read timeout fires).
+
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_orders = {}
+_lock   = threading.Lock()
+
+
+class FakeRazorpayHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # keep-alive, like the real API
+    options          = argparse.Namespace(latency=0.0, jitter=0.0,
+                                          fail_rate=0.0, hang_rate=0.0)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    # ── helpers ──────────────────────────────────────────
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, code, description):
+        self._send(status, {'error': {'code': code, 'description': description}})
+
+    def _simulate(self):
+        """Latency / failures; False if the request was already answered"""
+        opts = self.options
+        if opts.hang_rate and random.random() < opts.hang_rate:
+            time.sleep(3600)
+        delay = opts.latency + random.uniform(0, opts.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if opts.fail_rate and random.random() < opts.fail_rate:
+            self._error(503, 'SERVER_ERROR', 'Simulated gateway failure')
+            return False
+        return True
+
+    # ── routes ───────────────────────────────────────────
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw    = self.rfile.read(length) if length else b'{}'
+        if self.path.rstrip('/') != '/v1/orders':
+            return self._error(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found')
+        if not self.headers.get('Authorization'):
+            return self._error(401, 'BAD_REQUEST_ERROR', 'Authentication failed')
+        if not self._simulate():
+            return
+        try:
+            data = json.loads(raw or b'{}')
+        except ValueError:
+            return self._error(400, 'BAD_REQUEST_ERROR', 'Invalid JSON')
+        if not isinstance(data.get('amount'), int) or data['amount'] < 100:
+            return self._error(400, 'BAD_REQUEST_ERROR',
+                               'Order amount less than minimum amount allowed')
+
+        order = {
+            'id':          'order_' + secrets.token_hex(7),
+            'entity':      'order',
+            'amount':      data['amount'],
+            'amount_paid': 0,
+            'amount_due':  data['amount'],
+            'currency':    data.get('currency', 'INR'),
+            'receipt':     data.get('receipt'),
+            'status':      'created',
+            'attempts':    0,
+            'notes':       data.get('notes', []),
+            'created_at':  int(time.time()),
+        }
+        with _lock:
+            _orders[order['id']] = order
+        self._send(200, order)
+
+    def do_GET(self):
+        prefix = '/v1/orders/'
+        if not self.path.startswith(prefix):
+            return self._error(404, 'BAD_REQUEST_ERROR', 'The requested URL was not found')
+        if not self._simulate():
+            return
+        with _lock:
+            order = _orders.get(self.path[len(prefix):])
+        if order is None:
+            return self._error(400, 'BAD_REQUEST_ERROR', 'The id provided does not exist')
+        self._send(200, order)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Razorpay Orders API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency',   type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--jitter',    type=float, default=0.0, help='extra random 0..jitter seconds')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction answered with 503')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='fraction never answered')
+    args = parser.parse_args()
+
+    FakeRazorpayHandler.options = args
+    server = ThreadingHTTPServer((args.host, args.port), FakeRazorpayHandler)
+    server.daemon_threads = True
+    print(f"Fake Razorpay listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
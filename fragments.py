@@ -0,0 +1,42 @@
+# fragments.py - Cached HTML fragments for the home page
+#
+# The hero slider, category strip and featured grid are the same for every
+# visitor, so they are rendered once per catalog version and reused. The
+# only per-visitor value inside them is the CSRF token of the Buy Now forms:
+# fragments are rendered with a placeholder token that personalize() swaps
+# for the real one on each request.
+
+from markupsafe import Markup
+
+from catalog_cache import TTLCache
+
+CSRF_PLACEHOLDER = '__SECURESHOP_CSRF_TOKEN__'
+
+
+class FragmentCache:
+    def __init__(self, ttl=300, maxsize=64):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_or_render(self, name, version, render):
+        """render() must produce HTML using CSRF_PLACEHOLDER as the token"""
+        return self._cache.get_or_load((name, version), render)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return {'entries': len(self._cache),
+                'hits':    self._cache.hits,
+                'misses':  self._cache.misses}
+
+
+def placeholder_csrf_token():
+    """Stand-in for csrf_token() while rendering a shared fragment"""
+    return CSRF_PLACEHOLDER
+
+
+def personalize(html, csrf_token):
+    """Fill in this visitor's token; csrf_token is only called if needed"""
+    if CSRF_PLACEHOLDER in html:
+        html = html.replace(CSRF_PLACEHOLDER, csrf_token())
+    return Markup(html)
@@ -0,0 +1,120 @@
+# idsets.py - Compact product-id sets for "is this card a favourite / in
+# the cart" checks on listing pages
+#
+# The session keeps favourites and cart lines as lists (newest first, for
+# the profile page); turning those into a set on every listing request
+# costs O(n) per page for a user with thousands of favourites. Instead
+# each worker keeps one IdSet per user and kind, built once and then
+# updated in place by toggle_favorite and the cart routes.
+#
+# An IdSet is a bitmap over [lowest id, highest id] when the ids are
+# dense enough for that to be smaller than a sorted array (4 bytes per
+# id), else the sorted array: membership is O(1) or O(log n), and either
+# way it costs at most 4 bytes per id.
+
+import bisect
+from array import array
+
+from catalog_cache import TTLCache
+
+
+class IdSet:
+    __slots__ = ('_base', '_bits', '_ids')
+
+    def __init__(self, ids=()):
+        ids = sorted(set(ids))
+        self._base = ids[0] if ids else 0
+        self._bits = None
+        self._ids  = None
+        if ids and (ids[-1] - ids[0]) // 8 + 1 <= 4 * len(ids):
+            self._bits = bytearray((ids[-1] - self._base) // 8 + 1)
+            for product_id in ids:
+                offset = product_id - self._base
+                self._bits[offset >> 3] |= 1 << (offset & 7)
+        else:
+            self._ids = array('i', ids)
+
+    def __contains__(self, product_id):
+        if self._bits is not None:
+            offset = product_id - self._base
+            return (0 <= offset < 8 * len(self._bits)
+                    and bool(self._bits[offset >> 3] & (1 << (offset & 7))))
+        i = bisect.bisect_left(self._ids, product_id)
+        return i < len(self._ids) and self._ids[i] == product_id
+
+    def __iter__(self):
+        if self._ids is not None:
+            return iter(self._ids)
+        return (self._base + 8 * byte + bit
+                for byte, value in enumerate(self._bits) if value
+                for bit in range(8) if value & (1 << bit))
+
+    def __len__(self):
+        if self._ids is not None:
+            return len(self._ids)
+        return sum(bin(value).count('1') for value in self._bits)
+
+    def add(self, product_id):
+        if product_id in self:
+            return
+        if self._bits is not None:
+            offset = product_id - self._base
+            if 0 <= offset < 8 * len(self._bits):
+                self._bits[offset >> 3] |= 1 << (offset & 7)
+            else:
+                self.__init__([*self, product_id])     # outside the bitmap: re-pick the layout
+        else:
+            bisect.insort(self._ids, product_id)
+
+    def discard(self, product_id):
+        if product_id not in self:
+            return
+        if self._bits is not None:
+            offset = product_id - self._base
+            self._bits[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+        else:
+            del self._ids[bisect.bisect_left(self._ids, product_id)]
+
+    @property
+    def nbytes(self):
+        return len(self._bits) if self._bits is not None else self._ids.itemsize * len(self._ids)
+
+
+class MembershipCache:
+    """(kind, user id) → IdSet, valid while the session stamp it was built
+    for (fav_ids_at / cart_count_at) is still the session's stamp"""
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, kind, user_id, stamp, ids):
+        """The cached set, or one built from ids (any iterable). A None
+        stamp (ids not cached in the session) is never cached here."""
+        if stamp is None:
+            return IdSet(ids)
+        entry = self._cache.get((kind, user_id))
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        members = IdSet(ids)
+        self._cache.set((kind, user_id), (stamp, members))
+        return members
+
+    def update(self, kind, user_id, old_stamp, new_stamp, add=(), remove=()):
+        """Apply a write in place if the cached set is the one for
+        old_stamp; otherwise drop it and let the next get() rebuild"""
+        entry = self._cache.get((kind, user_id))
+        if entry is None:
+            return
+        if entry[0] != old_stamp or new_stamp is None:
+            self._cache.pop((kind, user_id))
+            return
+        members = entry[1]
+        for product_id in add:
+            members.add(product_id)
+        for product_id in remove:
+            members.discard(product_id)
+        self._cache.set((kind, user_id), (new_stamp, members))
+
+    def stats(self):
+        c = self._cache
+        return {'entries': len(c), 'hits': c.hits, 'misses': c.misses}
@@ -0,0 +1,243 @@
+# images.py - Decoding and resizing images off the request thread
+#
+# Decoding a camera JPEG and resampling it is tens to hundreds of ms of
+# CPU, and a crafted file can claim billions of pixels. Uploads are first
+# copied to a temp file in chunks (never held in memory); the decode,
+# validation and resizing then run on a bounded process pool, like the
+# bcrypt pool in passwords.py - a bad image can at worst take down a pool
+# process, and a burst of uploads gets ImageBusy instead of a backlog.
+#
+# Each size is written as WebP plus a JPEG fallback, named
+# <stem>-<size>.<ext>. Callers pick a content-hashed stem, so a file never
+# changes once written and can be served as immutable.
+
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+
+MAX_PIXELS    = 40_000_000                     # decompression bomb guard
+FORMATS       = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+OUTPUT_TYPES  = (('webp', 'WEBP', {'quality': 80, 'method': 4}),
+                 ('jpg',  'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}))
+CHUNK_SIZE    = 64 * 1024
+
+
+class ImageBusy(Exception):
+    """Too many images in flight (or one took too long)"""
+
+
+class InvalidImage(ValueError):
+    """Not an image we accept (unreadable, wrong format, too many pixels)"""
+
+
+def stream_to_temp(stream, directory, max_bytes):
+    """Copy a file-like object to a temp file in `directory`, CHUNK_SIZE
+    at a time; returns (path, sha256 hex). Raises InvalidImage past
+    max_bytes (the temp file is removed)."""
+    os.makedirs(directory, exist_ok=True)
+    digest = hashlib.sha256()
+    size   = 0
+    fd, path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise InvalidImage(f'larger than {max_bytes:,} bytes')
+                digest.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def variant_names(stem, sizes):
+    """Every file make_variants() writes for this stem"""
+    return [f'{stem}-{size}.{ext}' for size in sizes for ext, _, _ in OUTPUT_TYPES]
+
+
+# ── run inside the pool processes ────────────────────────
+def _open(src):
+    # Pillow only warns between its limit and twice that - refuse both
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+    warnings.simplefilter('error', Image.DecompressionBombWarning)
+    try:
+        with Image.open(src) as im:
+            if im.format not in FORMATS:
+                raise InvalidImage(f'{im.format or "unknown"} images are not accepted')
+            im.verify()
+        im = Image.open(src)
+        im.draft('RGB', (2048, 2048))         # JPEG: decode at a reduced scale when possible
+        im = ImageOps.exif_transpose(im)
+        im.load()
+    except InvalidImage:
+        raise
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError,
+            Image.DecompressionBombWarning) as e:
+        raise InvalidImage(str(e) or type(e).__name__)
+    if im.mode not in ('RGB', 'RGBA'):
+        im = im.convert('RGBA' if 'A' in im.getbands() or 'transparency' in im.info else 'RGB')
+    return im
+
+
+def _write(im, path, fmt, options):
+    if fmt == 'JPEG' and im.mode == 'RGBA':
+        flat = Image.new('RGB', im.size, (255, 255, 255))
+        flat.paste(im, mask=im.getchannel('A'))
+        im = flat
+    tmp = f'{path}.{os.getpid()}.tmp'
+    im.save(tmp, fmt, **options)
+    os.replace(tmp, path)
+
+
+def make_variants(src, out_dir, stem, sizes, crop=False):
+    """Write <stem>-<size>.webp/.jpg into out_dir for each size.
+
+    sizes  {name: (width, height)}; crop=True fills the box exactly
+           (centre crop), otherwise the image is scaled to fit inside
+           it and never enlarged.
+    Files that already exist are kept (same stem = same content)."""
+    names = variant_names(stem, sizes)
+    if all(os.path.exists(os.path.join(out_dir, n)) for n in names):
+        return names
+    im = _open(src)
+    os.makedirs(out_dir, exist_ok=True)
+    for size, box in sizes.items():
+        if crop:
+            resized = ImageOps.fit(im, box, Image.LANCZOS)
+        else:
+            resized = im.copy()
+            resized.thumbnail(box, Image.LANCZOS)
+        for ext, fmt, options in OUTPUT_TYPES:
+            _write(resized, os.path.join(out_dir, f'{stem}-{size}.{ext}'), fmt, options)
+    return names
+
+
+class ImagePipeline:
+    """make_variants() on a bounded process pool.
+
+    workers    pool processes (0 = run inline on the calling thread)
+    max_queue  images allowed to wait for a free process
+    timeout    seconds a caller waits for its result
+    """
+
+    def __init__(self, workers=2, max_queue=8, timeout=15.0):
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.timeout   = timeout
+        self._lock     = threading.Lock()
+        self._pid      = None
+        self._executor = None
+        self._slots    = None
+        self._stats    = {
+            'processed':     0,
+            'invalid':       0,
+            'rejected':      0,
+            'timeouts':      0,
+            'crashes':       0,
+            'seconds_total': 0.0,
+            'seconds_max':   0.0,
+        }
+
+    def _pool(self):
+        # Same as PasswordHasher: a pool inherited through fork() is restarted
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context(
+                        'forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=context)
+                    self._slots    = threading.BoundedSemaphore(self.workers + self.max_queue)
+                    self._pid      = os.getpid()
+        return self._executor, self._slots
+
+    def variants(self, src, out_dir, stem, sizes, crop=False):
+        """make_variants() in a pool process; raises InvalidImage or ImageBusy"""
+        started = time.monotonic()
+        try:
+            if self.workers == 0:
+                names = make_variants(src, out_dir, stem, sizes, crop)
+            else:
+                names = self._run(src, out_dir, stem, sizes, crop)
+        except InvalidImage:
+            self._count('invalid')
+            raise
+        finally:
+            self._time(time.monotonic() - started)
+        self._count('processed')
+        return names
+
+    def _run(self, *args):
+        # Like PasswordHasher._run: a process that died - even after its
+        # caller stopped waiting - breaks the pool for every later submit,
+        # so restart it and try once more
+        try:
+            return self._submit(*args)
+        except BrokenProcessPool:
+            self._count('crashes')
+        try:
+            return self._submit(*args)
+        except BrokenProcessPool:
+            self._count('crashes')
+            raise ImageBusy('Image processing failed')
+
+    def _submit(self, *args):
+        pool, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            self._count('rejected')
+            raise ImageBusy('Image queue is full')
+        try:
+            try:
+                future = pool.submit(make_variants, *args)
+            except Exception:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _: slots.release())
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count('timeouts')
+            raise ImageBusy('Image processing timed out')
+        except BrokenProcessPool:
+            self._restart(pool)
+            raise
+
+    def _restart(self, pool):
+        with self._lock:
+            if self._executor is pool:
+                self._pid = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # ── stats ────────────────────────────────────────────
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _time(self, seconds):
+        with self._lock:
+            self._stats['seconds_total'] += seconds
+            self._stats['seconds_max']    = max(self._stats['seconds_max'], seconds)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        calls = s['processed'] + s['invalid']
+        s['seconds_avg']   = round(s['seconds_total'] / calls, 4) if calls else 0.0
+        s['seconds_total'] = round(s['seconds_total'], 4)
+        s['seconds_max']   = round(s['seconds_max'], 4)
+        s['workers']       = self.workers
+        s['max_queue']     = self.max_queue
+        return s
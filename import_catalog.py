@@ -0,0 +1,363 @@
+# import_catalog.py - Stream a product feed (CSV or JSONL) into the catalog
+#
+#   DATABASE_URL=mysql://... python import_catalog.py feed.csv [--key sku] [--chunk 1000]
+#   gzip -dc feed.jsonl.gz | python import_catalog.py - --format jsonl
+#   DATABASE_URL=mysql://... python import_catalog.py --prewarm    # images only
+#
+# Rows are read and written one chunk at a time, so memory stays flat
+# however long the feed is. For each chunk the matching products are
+# loaded by key, rows identical to what is stored are skipped, and the
+# rest go out as one multi-row INSERT ... ON DUPLICATE KEY UPDATE. The ids
+# written are logged to catalog_changes in the same transaction, which is
+# how the web workers know what to drop from their caches (see
+# catalog_changes.py). Users, carts and orders are never touched.
+#
+# Each image_url in the feed is fetched and resized for /img/ on a few
+# threads while the import runs (see product_images.py), so the first
+# shopper to see a new product doesn't wait for its image. Images already
+# on disk are skipped; --no-images turns this off. --prewarm does just the
+# images, for every product already in the catalog (e.g. after schema.sql).
+#
+# Feed columns: sku (or id with --key id), name, category, price,
+# original_price, description, image_url, stock, rating. Columns missing
+# from a row keep their stored value (or the column default for a new
+# product), so a stock-only feed is just sku,stock. New products need at
+# least name, category and price. Bad rows are reported and skipped.
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+import pymysql
+
+from catalog_changes import prune_changes, record_changes
+from database import connect_kwargs_from_url
+from images import ImagePipeline
+from product_images import Prewarmer, ProductImages
+
+FIELDS   = ('name', 'category', 'price', 'original_price', 'description',
+            'image_url', 'stock', 'rating')
+REQUIRED = ('name', 'category', 'price')
+MAX_LEN  = {'sku': 64, 'name': 200, 'category': 100, 'image_url': 500}
+CENTS    = Decimal('0.01')
+TENTHS   = Decimal('0.1')
+
+
+class RowError(ValueError):
+    """A feed row that can't be imported (reported, then skipped)"""
+
+
+# ══════════════════════════════════════
+# READING + CLEANING FEED ROWS
+# ══════════════════════════════════════
+def read_feed(stream, fmt):
+    """(line number, dict or RowError) per feed row"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_no, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, RowError(f'invalid JSON ({e})')
+            continue
+        yield line_no, row if isinstance(row, dict) else RowError('not a JSON object')
+
+
+def _text(value, field):
+    value = str(value).strip()
+    limit = MAX_LEN.get(field, 65535)   # description is TEXT
+    if len(value) > limit:
+        raise RowError(f'{field} longer than {limit} characters')
+    return value or None
+
+
+def _decimal(value, field, places):
+    try:
+        number = Decimal(str(value).strip()).quantize(places)
+    except (InvalidOperation, ValueError):
+        raise RowError(f'{field} is not a number: {value!r}')
+    if number < 0:
+        raise RowError(f'{field} is negative')
+    return number
+
+
+def clean_row(raw, key):
+    """(key value, {column: value}) with values typed the way pymysql
+    returns them, so a row can be compared with the stored product"""
+    if key == 'id':
+        try:
+            key_value = int(raw.get('id'))
+        except (TypeError, ValueError):
+            raise RowError('missing or invalid id')
+    else:
+        key_value = _text(raw.get('sku') or '', 'sku')
+        if not key_value:
+            raise RowError('missing sku')
+
+    row = {}
+    for field in FIELDS:
+        value = raw.get(field)
+        if value is None:
+            continue                     # not in this feed: keep what's stored
+        if isinstance(value, str) and not value.strip():
+            value = None                 # present but empty
+        if value is None:
+            if field in REQUIRED:
+                raise RowError(f'{field} is empty')
+            row[field] = None
+        elif field in ('price', 'original_price'):
+            row[field] = _decimal(value, field, CENTS)
+        elif field == 'rating':
+            row[field] = _decimal(value, field, TENTHS)
+            if row[field] > 5:
+                raise RowError('rating above 5')
+        elif field == 'stock':
+            try:
+                row[field] = int(value)
+            except (TypeError, ValueError):
+                raise RowError(f'stock is not a whole number: {value!r}')
+        else:
+            row[field] = _text(value, field)
+    return key_value, row
+
+
+# ══════════════════════════════════════
+# ONE CHUNK: DIFF → UPSERT → CHANGE LOG
+# ══════════════════════════════════════
+def diff_chunk(cursor, key, rows):
+    """Split {key: row} into (new, changed {key: (id, row)}, unchanged count,
+    incomplete) - incomplete being new products without name/category/price"""
+    cursor.execute(f"""
+        SELECT id, sku, {', '.join(FIELDS)} FROM products
+        WHERE {key} IN ({', '.join(['%s'] * len(rows))})
+    """, list(rows))
+    stored = {r[key]: r for r in cursor.fetchall()}
+    new, changed, unchanged, incomplete = {}, {}, 0, []
+    for key_value, row in rows.items():
+        current = stored.get(key_value)
+        if current is None:
+            if all(f in row for f in REQUIRED):
+                new[key_value] = row
+            else:
+                incomplete.append(key_value)
+        elif any(current[f] != v for f, v in row.items()):
+            changed[key_value] = (current['id'], row)
+        else:
+            unchanged += 1
+    return new, changed, unchanged, incomplete
+
+
+def upsert(cursor, key, rows):
+    """One multi-row statement per column set (feeds normally have one)"""
+    by_columns = {}
+    for key_value, row in rows.items():
+        by_columns.setdefault(tuple(row), []).append((key_value, *row.values()))
+    for columns, values in by_columns.items():
+        cursor.executemany(f"""
+            INSERT INTO products ({key}, {', '.join(columns)})
+            VALUES ({', '.join(['%s'] * (len(columns) + 1))})
+            ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in columns)}
+        """, values)
+
+
+def import_chunk(conn, key, rows, dry_run):
+    """Write one chunk in its own transaction; returns
+    (new, changed, unchanged, incomplete keys)"""
+    cursor = conn.cursor()
+    try:
+        new, changed, unchanged, incomplete = diff_chunk(cursor, key, rows)
+        counts = (len(new), len(changed), unchanged, incomplete)
+        if dry_run or not (new or changed):
+            conn.rollback()
+            return counts
+
+        upsert(cursor, key, {**new, **{k: row for k, (_, row) in changed.items()}})
+        ids = [product_id for product_id, _ in changed.values()]
+        if new and key == 'id':
+            ids += list(new)
+        elif new:
+            cursor.execute(f"""
+                SELECT id FROM products WHERE sku IN ({', '.join(['%s'] * len(new))})
+            """, list(new))
+            ids += [r['id'] for r in cursor.fetchall()]
+        record_changes(cursor, ids)
+        conn.commit()
+        return counts
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def catalog_image_urls(conn):
+    """Every distinct image_url in the catalog"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT DISTINCT image_url FROM products
+            WHERE image_url IS NOT NULL AND image_url != ''
+        """)
+        return [r['image_url'] for r in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+# ══════════════════════════════════════
+# CLI
+# ══════════════════════════════════════
+class Progress:
+    def __init__(self, raw, interval):
+        self.raw      = raw       # binary file under the text reader (None for stdin)
+        self.size     = os.fstat(raw.fileno()).st_size if raw else 0
+        self.interval = interval
+        self.started  = time.monotonic()
+        self._last    = 0.0
+        self.counts   = {'rows': 0, 'new': 0, 'changed': 0, 'unchanged': 0, 'rejected': 0}
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        c       = self.counts
+        elapsed = max(now - self.started, 1e-6)
+        done    = f" ({self.raw.tell() / self.size:5.1%})" if self.size else ''
+        print(f"  {c['rows']:>12,} rows{done}  new {c['new']:,}  changed {c['changed']:,}  "
+              f"unchanged {c['unchanged']:,}  rejected {c['rejected']:,}  "
+              f"{c['rows'] / elapsed:,.0f} rows/s", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import a product feed into SecureShop')
+    parser.add_argument('feed', nargs='?', help='CSV or JSONL file, or - for stdin')
+    parser.add_argument('--prewarm', action='store_true',
+                        help='no feed: fetch the images of every product in the catalog')
+    parser.add_argument('--format', choices=('csv', 'jsonl'),
+                        help='default: from the file extension (csv for stdin)')
+    parser.add_argument('--key', choices=('sku', 'id'), default='sku',
+                        help='column that matches feed rows to products')
+    parser.add_argument('--chunk', type=int, default=1000, help='rows per transaction')
+    parser.add_argument('--max-rejects', type=int, default=1000,
+                        help='stop after this many bad rows (-1 = never)')
+    parser.add_argument('--progress', type=float, default=2.0, help='seconds between progress lines')
+    parser.add_argument('--dry-run', action='store_true', help='diff only, write nothing')
+    parser.add_argument('--no-images', action='store_true', help="don't pre-fetch product images")
+    parser.add_argument('--image-folder',
+                        default=os.environ.get('PRODUCT_IMAGE_FOLDER', 'static/product_images'),
+                        help="the web app's PRODUCT_IMAGE_FOLDER")
+    parser.add_argument('--image-threads', type=int, default=8, help='concurrent image downloads')
+    args = parser.parse_args()
+    if (args.feed is None) != args.prewarm:
+        parser.error('give a feed, or --prewarm on its own')
+
+    connect_kwargs = connect_kwargs_from_url(os.environ.get('DATABASE_URL'))
+    if connect_kwargs is None:
+        raise SystemExit('DATABASE_URL is not set')
+    if args.prewarm:
+        return prewarm(connect_kwargs, args)
+
+    fmt = args.format or ('jsonl' if args.feed.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    raw    = None if args.feed == '-' else open(args.feed, 'rb')
+    stream = io.TextIOWrapper(raw or sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    conn   = pymysql.connect(**connect_kwargs)
+    prog   = Progress(raw, args.progress)
+    counts = prog.counts
+    print(f"Importing {args.feed} ({fmt}, key={args.key}, {args.chunk} rows per chunk)"
+          + (' - dry run' if args.dry_run else ''))
+
+    warmer = None if args.no_images or args.dry_run else make_prewarmer(args)
+
+    def flush(rows):
+        new, changed, unchanged, incomplete = import_chunk(conn, args.key, rows, args.dry_run)
+        counts['new']       += new
+        counts['changed']   += changed
+        counts['unchanged'] += unchanged
+        for key_value in incomplete:
+            reject(f"{args.key} {key_value}", f"new product needs {', '.join(REQUIRED)}")
+        if warmer:
+            for row in rows.values():
+                if row.get('image_url'):
+                    warmer.submit(row['image_url'])
+        prog.report()
+
+    def reject(where, error):
+        counts['rejected'] += 1
+        print(f"  {where}: {error}")
+        if 0 <= args.max_rejects < counts['rejected']:
+            raise SystemExit(f"Stopped: more than {args.max_rejects} bad rows")
+
+    try:
+        rows = {}    # key → row; a key repeated within a chunk keeps its last row
+        for line_no, raw_row in read_feed(stream, fmt):
+            counts['rows'] += 1
+            try:
+                if isinstance(raw_row, RowError):
+                    raise raw_row
+                key_value, row = clean_row(raw_row, args.key)
+            except RowError as e:
+                reject(f"line {line_no}", e)
+                continue
+            rows[key_value] = row
+            if len(rows) >= args.chunk:
+                flush(rows)
+                rows = {}
+        if rows:
+            flush(rows)
+        if not args.dry_run:
+            cursor = conn.cursor()
+            prune_changes(cursor)
+            conn.commit()
+            cursor.close()
+    finally:
+        prog.report(force=True)
+        conn.close()
+        stream.close()
+        if warmer:
+            print("Waiting for product images...", flush=True)
+            images_ready, images_failed = warmer.close()
+
+    written = counts['new'] + counts['changed']
+    print(f"{'Would write' if args.dry_run else 'Wrote'} {written:,} products "
+          f"({counts['new']:,} new, {counts['changed']:,} changed) in "
+          f"{time.monotonic() - prog.started:.1f}s")
+    if warmer:
+        print(f"Product images: {images_ready:,} ready, {images_failed:,} could not be fetched")
+
+
+
+def make_prewarmer(args):
+    pipeline = ImagePipeline(workers=os.cpu_count() or 1, max_queue=args.image_threads, timeout=60)
+    return Prewarmer(ProductImages(args.image_folder, pipeline), threads=args.image_threads)
+
+
+def prewarm(connect_kwargs, args):
+    """--prewarm: resize every catalog image that isn't on disk yet"""
+    conn = pymysql.connect(**connect_kwargs)
+    try:
+        urls = catalog_image_urls(conn)
+    finally:
+        conn.close()
+    print(f"Pre-warming {len(urls):,} product images into {args.image_folder}", flush=True)
+    started = time.monotonic()
+    warmer  = make_prewarmer(args)
+    for url in urls:
+        warmer.submit(url)
+    ready, failed = warmer.close()
+    print(f"Product images: {ready:,} ready, {failed:,} could not be fetched "
+          f"in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+# jobs.py - Durable payment job queue (the payment_jobs table)
+#
+# /payment/verify checks the Razorpay signature and enqueues a job; the
+# order itself is written by worker.py. Workers claim jobs with
+# SELECT ... FOR UPDATE SKIP LOCKED, so several of them can drain the
+# queue without double-processing. A claimed job is leased until
+# run_after; if its worker dies the job becomes claimable again.
+#
+# Finalize jobs are idempotent on razorpay_order_id: enqueueing twice
+# returns the same job, and a retry that finds the order already
+# written just marks the job done. A finalize job carries the amount the
+# Razorpay order was created for; the order is only written if the cart
+# still adds up to it. A verified payment that can't become an order
+# (cart changed, sold out, gave up) is recorded as 'refund_due' with the
+# amount captured, so it can be found and refunded.
+
+from checkout import CheckoutError, place_order
+
+MAX_ATTEMPTS  = 5
+LEASE_SECONDS = 60   # a claimed job is re-run after this if not finished
+RETRY_DELAY   = 5    # seconds before retry n is 5 × 2^(n-1)
+
+VERIFY_FAILED_MESSAGE = 'Payment verification failed'
+GAVE_UP_MESSAGE       = 'Your order could not be completed. Please contact support.'
+REFUND_NOTE           = 'Your payment will be refunded.'
+
+
+# ══════════════════════════════════════
+# ENQUEUE + STATUS (web process)
+# ══════════════════════════════════════
+def enqueue_finalize(db, user_id, razorpay_order_id, payment_id, amount):
+    """Queue order creation for a verified payment of `amount` paise
+    (None if unknown - the job then ends as refund_due); returns the job id"""
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO payment_jobs
+            (kind, idempotency_key, user_id, razorpay_order_id, payment_id, amount)
+        VALUES ('finalize', %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    """, (razorpay_order_id, user_id, razorpay_order_id, payment_id, amount))
+    job_id = cursor.lastrowid
+    db.commit()
+    cursor.close()
+    return job_id
+
+
+def enqueue_failure(db, user_id, razorpay_order_id, payment_id):
+    """Queue recording of a payment whose signature did not verify"""
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO payment_jobs
+            (kind, user_id, razorpay_order_id, payment_id, last_error)
+        VALUES ('record_failure', %s, %s, %s, %s)
+    """, (user_id, razorpay_order_id, payment_id, VERIFY_FAILED_MESSAGE))
+    job_id = cursor.lastrowid
+    db.commit()
+    cursor.close()
+    return job_id
+
+
+def job_status(db, job_id, user_id):
+    cursor = db.cursor()
+    cursor.execute("""
+        SELECT id, kind, status, order_id, last_error FROM payment_jobs
+        WHERE id = %s AND user_id = %s
+    """, (job_id, user_id))
+    job = cursor.fetchone()
+    cursor.close()
+    return job
+
+
+# ══════════════════════════════════════
+# CLAIM + RUN (worker process)
+# ══════════════════════════════════════
+def claim(db, limit):
+    """Lease up to `limit` due jobs to this worker"""
+    cursor = db.cursor()
+    try:
+        cursor.execute("""
+            SELECT * FROM payment_jobs
+            WHERE status IN ('queued', 'running') AND run_after <= NOW()
+            ORDER BY run_after, id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (limit,))
+        jobs = cursor.fetchall()
+        if jobs:
+            ids = [job['id'] for job in jobs]
+            cursor.execute(f"""
+                UPDATE payment_jobs
+                SET status = 'running', attempts = attempts + 1,
+                    run_after = NOW() + INTERVAL %s SECOND
+                WHERE id IN ({','.join(['%s'] * len(ids))})
+            """, [LEASE_SECONDS] + ids)
+            for job in jobs:
+                job['attempts'] += 1
+        db.commit()
+        return jobs
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def run_job(db, job):
+    """Process one claimed job. Returns the ids of products whose stock
+    changed (empty unless an order was written)."""
+    try:
+        if job['kind'] == 'finalize':
+            order_id, product_ids = _finalize(db, job)
+            _finish(db, job, 'done', order_id)
+            return product_ids
+        _finish(db, job, 'failed', _record_failure(db, job, verified=False),
+                job['last_error'])
+
+    except CheckoutError as e:
+        # Payment is genuine but there is nothing to fulfil - don't retry
+        print(f"Payment job {job['id']}: {e}")
+        db.rollback()
+        _finish(db, job, 'failed', _record_failure(db, job, verified=True),
+                f"{e.user_message}. {REFUND_NOTE}")
+
+    except Exception as e:
+        db.rollback()
+        print(f"Payment job {job['id']} attempt {job['attempts']}: {e}")
+        if job['attempts'] >= MAX_ATTEMPTS:
+            verified = job['kind'] == 'finalize'
+            _finish(db, job, 'failed', _record_failure(db, job, verified),
+                    f"{GAVE_UP_MESSAGE} {REFUND_NOTE}" if verified else GAVE_UP_MESSAGE)
+        else:
+            _retry(db, job, e)
+    return []
+
+
+def _finalize(db, job):
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT id FROM orders WHERE razorpay_order_id = %s",
+        (job['razorpay_order_id'],)
+    )
+    existing = cursor.fetchone()
+    cursor.close()
+    if existing:
+        # Written by an earlier attempt that died before marking the job done
+        return existing['id'], []
+    if job['amount'] is None:
+        raise CheckoutError("Amount paid is unknown")
+    return place_order(db, job['user_id'], job['payment_id'],
+                       job['razorpay_order_id'], job['amount'])
+
+
+def _record_failure(db, job, verified):
+    """Insert the order row for a payment that didn't become an order (not
+    committed; _finish commits it).
+
+    A verified payment was captured: its row is 'refund_due' with the
+    amount paid. Only a verified payment may claim its razorpay_order_id -
+    an unverified one could otherwise block the genuine order for that id.
+    """
+    paid = job.get('amount') if verified else None
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO orders (user_id, total_amount, payment_status,
+                            transaction_id, razorpay_order_id)
+        VALUES (%s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    """, (job['user_id'], (paid or 0) / 100, 'refund_due' if verified else 'failed',
+          job['payment_id'] or 'unknown',
+          job['razorpay_order_id'] if verified else None))
+    order_id = cursor.lastrowid
+    if cursor.rowcount == 1:   # a new row, not an earlier attempt's
+        cursor.execute(
+            "UPDATE users SET order_count = order_count + 1 WHERE id = %s",
+            (job['user_id'],)
+        )
+    cursor.close()
+    return order_id
+
+
+def _finish(db, job, status, order_id, message=None):
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE payment_jobs SET status = %s, order_id = %s, last_error = %s
+        WHERE id = %s
+    """, (status, order_id, message, job['id']))
+    db.commit()
+    cursor.close()
+
+
+def _retry(db, job, error):
+    delay = RETRY_DELAY * 2 ** (job['attempts'] - 1)
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE payment_jobs
+        SET status = 'queued', run_after = NOW() + INTERVAL %s SECOND,
+            last_error = %s
+        WHERE id = %s
+    """, (delay, str(error)[:500], job['id']))
+    db.commit()
+    cursor.close()
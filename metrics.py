@@ -0,0 +1,245 @@
+# metrics.py - Per-request SQL / timing instrumentation for SecureShop
+#
+# Every pooled connection uses InstrumentedCursor, which times each
+# statement and files it under the current request. Flask's
+# before/after_request hooks and the template signals add the request
+# latency and render time, and routes wrap gateway calls in
+# track('gateway'). Per endpoint this gives: request count and latency,
+# queries per request, DB time, render time, gateway time and the slowest
+# statement seen - exported in Prometheus text format at /metrics.
+#
+# Metrics live in each worker process; every series carries a `pid`
+# label so a scrape that lands on another worker doesn't look like a
+# counter reset.
+#
+# With SLOW_REQUEST_SECONDS > 0, requests slower than that are printed
+# with their full query list.
+
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import pymysql.cursors
+from flask import before_render_template, g, has_app_context, request, template_rendered
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS   = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_WS_RE      = re.compile(r'\s+')
+_IN_LIST_RE = re.compile(r'\(\s*%s(?:\s*,\s*%s)+\s*\)')
+
+
+def normalize_sql(sql):
+    """One line, IN (%s, %s, ...) lists folded, so statements group together"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    return _IN_LIST_RE.sub('(%s, ...)', _WS_RE.sub(' ', sql).strip())
+
+
+# ══════════════════════════════════════
+# PER-REQUEST RECORDING
+# ══════════════════════════════════════
+class RequestStats:
+    __slots__ = ('started', 'queries', 'db_seconds', 'timers', 'render_depth',
+                 'render_started')
+
+    def __init__(self):
+        self.started        = time.perf_counter()
+        self.queries        = []     # (sql as sent, seconds)
+        self.db_seconds     = 0.0
+        self.timers         = {}     # 'render' / 'gateway' / ... → seconds
+        self.render_depth   = 0
+        self.render_started = 0.0
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+
+def _current():
+    return g.get('_request_stats') if has_app_context() else None
+
+
+class InstrumentedCursor(pymysql.cursors.DictCursor):
+    """DictCursor that reports every statement to the current request.
+
+    executemany() goes through execute() too, so bulk inserts are counted
+    once per statement actually sent.
+    """
+
+    def execute(self, query, args=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            stats = _current()
+            if stats is not None:
+                seconds = time.perf_counter() - started
+                stats.queries.append((query, seconds))
+                stats.db_seconds += seconds
+
+
+@contextmanager
+def track(name):
+    """Add the time spent in the block to the request's `name` timer"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current()
+        if stats is not None:
+            stats.add_time(name, time.perf_counter() - started)
+
+
+# ══════════════════════════════════════
+# AGGREGATES + PROMETHEUS TEXT FORMAT
+# ══════════════════════════════════════
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts  = [0] * (len(buckets) + 1)   # last slot = +Inf
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+
+class Metrics:
+    HISTOGRAMS = {
+        # name → (help, buckets)
+        'request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+        'db_queries_per_request':   ('SQL statements per request', COUNT_BUCKETS),
+        'db_seconds_per_request':   ('Time in SQL statements per request', LATENCY_BUCKETS),
+        'render_seconds':           ('Template render time per request', LATENCY_BUCKETS),
+        'gateway_seconds':          ('Payment gateway time per request', LATENCY_BUCKETS),
+    }
+
+    def __init__(self, prefix='secureshop'):
+        self.prefix    = prefix
+        self._lock     = threading.Lock()
+        self._requests = {}   # (endpoint, method, status) → count
+        self._hists    = {}   # (name, endpoint) → Histogram
+        self._slowest  = {}   # endpoint → (seconds, normalized sql)
+
+    def _hist(self, name, endpoint):
+        key = (name, endpoint)
+        hist = self._hists.get(key)
+        if hist is None:
+            hist = self._hists[key] = Histogram(self.HISTOGRAMS[name][1])
+        return hist
+
+    def record(self, endpoint, method, status, seconds, stats):
+        slowest = max(stats.queries, key=lambda q: q[1], default=None)
+        with self._lock:
+            key = (endpoint, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._hist('request_duration_seconds', endpoint).observe(seconds)
+            self._hist('db_queries_per_request', endpoint).observe(len(stats.queries))
+            self._hist('db_seconds_per_request', endpoint).observe(stats.db_seconds)
+            if 'render' in stats.timers:
+                self._hist('render_seconds', endpoint).observe(stats.timers['render'])
+            if 'gateway' in stats.timers:
+                self._hist('gateway_seconds', endpoint).observe(stats.timers['gateway'])
+            if slowest and slowest[1] > self._slowest.get(endpoint, (0.0, ''))[0]:
+                self._slowest[endpoint] = (slowest[1], normalize_sql(slowest[0]))
+
+    def render(self):
+        """All series in Prometheus text exposition format 0.0.4"""
+        pid   = os.getpid()
+        p     = self.prefix
+        lines = []
+        with self._lock:
+            lines += [f'# HELP {p}_requests_total Requests handled',
+                      f'# TYPE {p}_requests_total counter']
+            for (endpoint, method, status), n in sorted(self._requests.items()):
+                labels = _labels(pid=pid, endpoint=endpoint, method=method, status=status)
+                lines.append(f'{p}_requests_total{{{labels}}} {n}')
+
+            for name, (help_text, buckets) in self.HISTOGRAMS.items():
+                lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} histogram']
+                for (hist_name, endpoint), hist in sorted(self._hists.items()):
+                    if hist_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(buckets + ('+Inf',), hist.counts):
+                        cumulative += n
+                        labels = _labels(pid=pid, endpoint=endpoint, le=bound)
+                        lines.append(f'{p}_{name}_bucket{{{labels}}} {cumulative}')
+                    labels = _labels(pid=pid, endpoint=endpoint)
+                    lines.append(f'{p}_{name}_sum{{{labels}}} {hist.sum:.6f}')
+                    lines.append(f'{p}_{name}_count{{{labels}}} {hist.count}')
+
+            lines += [f'# HELP {p}_slowest_query_seconds Slowest statement seen per endpoint',
+                      f'# TYPE {p}_slowest_query_seconds gauge']
+            for endpoint, (seconds, sql) in sorted(self._slowest.items()):
+                labels = _labels(pid=pid, endpoint=endpoint, sql=sql[:200])
+                lines.append(f'{p}_slowest_query_seconds{{{labels}}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return ','.join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+
+# ══════════════════════════════════════
+# FLASK WIRING
+# ══════════════════════════════════════
+def _slow_log(endpoint, seconds, stats):
+    print(f"Slow request: {request.method} {request.full_path.rstrip('?')} "
+          f"({endpoint}) {seconds * 1000:.1f} ms, {len(stats.queries)} queries, "
+          f"db {stats.db_seconds * 1000:.1f} ms, "
+          + ', '.join(f"{k} {v * 1000:.1f} ms" for k, v in sorted(stats.timers.items())))
+    for sql, q_seconds in stats.queries:
+        print(f"    {q_seconds * 1000:8.2f} ms  {normalize_sql(sql)}")
+
+
+def init_metrics(app, pool):
+    """Instrument the pool's connections and the request cycle"""
+    metrics = Metrics()
+    slow    = app.config['SLOW_REQUEST_SECONDS']
+    if pool.connect_kwargs is not None:
+        pool.connect_kwargs['cursorclass'] = InstrumentedCursor
+
+    @app.before_request
+    def _start_request():
+        g._request_stats = RequestStats()
+
+    @app.after_request
+    def _finish_request(response):
+        stats = g.pop('_request_stats', None)
+        if stats is not None:
+            seconds  = time.perf_counter() - stats.started
+            endpoint = request.endpoint or 'unmatched'
+            metrics.record(endpoint, request.method, response.status_code, seconds, stats)
+            if slow and seconds >= slow:
+                _slow_log(endpoint, seconds, stats)
+        return response
+
+    def _render_started(sender, template, context, **extra):
+        stats = _current()
+        if stats is not None:
+            if stats.render_depth == 0:
+                stats.render_started = time.perf_counter()
+            stats.render_depth += 1
+
+    def _render_finished(sender, template, context, **extra):
+        stats = _current()
+        if stats is not None and stats.render_depth:
+            stats.render_depth -= 1
+            if stats.render_depth == 0:
+                stats.add_time('render', time.perf_counter() - stats.render_started)
+
+    before_render_template.connect(_render_started, app, weak=False)
+    template_rendered.connect(_render_finished, app, weak=False)
+
+    app.extensions['metrics'] = metrics
+    return metrics
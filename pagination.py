@@ -0,0 +1,106 @@
+# pagination.py - Keyset (seek) pagination for the /products listing
+#
+# Instead of LIMIT n OFFSET m (which reads and throws away m rows), each
+# page starts right after the sort key + id of the previous page's last
+# row. The position travels in the URL as an opaque cursor, so page 500
+# costs the same single index range read as page 1.
+#
+# /products only takes this path until the worker's facet index
+# (facets.py) is built; from then on it pages through the index in memory.
+
+import base64
+import json
+
+# sort param → (sort column, direction). `id` is always the tie-breaker
+# in the same direction so the order is total and matches the indexes
+# (category, <column>, id, stock) / (<column>, id, stock) in schema.sql.
+SORT_KEYS = {
+    'price_asc':  ('price',  'ASC'),
+    'price_desc': ('price',  'DESC'),
+    'rating':     ('rating', 'DESC'),
+}
+DEFAULT_SORT_KEY = ('id', 'DESC')
+
+
+def sort_key(sort):
+    return SORT_KEYS.get(sort, DEFAULT_SORT_KEY)
+
+
+def encode_cursor(sort, row):
+    """Cursor pointing at `row` (the last row shown, or the first for 'before')"""
+    column, _ = sort_key(sort)
+    return encode_key(row[column], row['id'])
+
+
+def encode_key(value, row_id):
+    """Opaque URL-safe token for a (sort value, id) position"""
+    payload = json.dumps([str(value), row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """(sort value, id) from a cursor, or None if it is missing/garbled"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return str(value), int(last_id)
+    except (ValueError, TypeError):
+        return None
+
+
+def where_clause(category):
+    if category:
+        return "WHERE stock > 0 AND category = %s", [category]
+    return "WHERE stock > 0", []
+
+
+def page_query(category, sort, limit, after=None, before=None):
+    """SQL + params for one page starting after/before a (value, id) key.
+
+    With `before` the rows come back in reverse order; the caller flips them.
+    """
+    column, direction = sort_key(sort)
+    where, params = where_clause(category)
+    backwards = before is not None
+    key = before if backwards else after
+
+    if key is not None:
+        # "next" in a DESC listing means smaller keys, in an ASC one larger
+        forward_op = '<' if direction == 'DESC' else '>'
+        op = {'<': '>', '>': '<'}[forward_op] if backwards else forward_op
+        if column == 'id':
+            where += f" AND id {op} %s"
+            params.append(key[1])
+        else:
+            where += f" AND ({column}, id) {op} (%s, %s)"
+            params.extend(key)
+
+    if backwards:
+        direction = 'ASC' if direction == 'DESC' else 'DESC'
+    order = (f"ORDER BY id {direction}" if column == 'id'
+             else f"ORDER BY {column} {direction}, id {direction}")
+    return f"SELECT * FROM products {where} {order} LIMIT %s", params + [limit]
+
+
+def anchors_query(category, sort, per_page):
+    """Sort key of the last row of every full page, read from the index only.
+
+    anchors[n] is the `after` key for page n + 2, so numbered page links
+    can jump straight to any page without an OFFSET scan.
+    """
+    column, direction = sort_key(sort)
+    where, params = where_clause(category)
+    order = (f"ORDER BY id {direction}" if column == 'id'
+             else f"ORDER BY {column} {direction}, id {direction}")
+    sql = f"""
+        SELECT sort_value, id FROM (
+            SELECT {column} AS sort_value, id,
+                   ROW_NUMBER() OVER ({order}) AS row_num
+            FROM products {where}
+        ) numbered
+        WHERE row_num %% %s = 0
+        ORDER BY row_num
+    """
+    return sql, params + [per_page]
@@ -0,0 +1,180 @@
+# passwords.py - bcrypt hashing off the request thread
+#
+# A bcrypt hash or check at cost 12 is ~250 ms of pure CPU. Run inline,
+# a burst of logins holds the GIL and stalls every other route on the
+# worker. Here the work runs on a process pool sized to the cores, and
+# only `workers + max_queue` calls may be in flight per web process -
+# beyond that the caller gets HasherBusy at once instead of queueing
+# behind a backlog it would time out in anyway.
+#
+# Changing BCRYPT_ROUNDS only affects new hashes; existing users are
+# re-hashed at the new cost the next time they log in.
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+
+class HasherBusy(Exception):
+    """Too many password operations in flight (or one took too long)"""
+
+
+# ── run inside the pool processes ────────────────────────
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def hash_rounds(hashed):
+    """Cost factor stored in a bcrypt hash ($2b$12$... → 12), or None"""
+    try:
+        return int(hashed.split('$')[2])
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+class PasswordHasher:
+    """bcrypt on a bounded process pool.
+
+    rounds     bcrypt cost for new hashes
+    workers    pool processes (0 = hash inline on the calling thread)
+    max_queue  calls allowed to wait for a free process
+    timeout    seconds a caller waits for its result
+    """
+
+    def __init__(self, rounds=12, workers=None, max_queue=None, timeout=5.0):
+        self.rounds    = rounds
+        self.workers   = (os.cpu_count() or 1) if workers is None else workers
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.timeout   = timeout
+        self._lock     = threading.Lock()
+        self._pid      = None
+        self._executor = None
+        self._slots    = None
+        self._stats    = {
+            'hashed':        0,
+            'checked':       0,
+            'rehashed':      0,
+            'rejected':      0,
+            'timeouts':      0,
+            'crashes':       0,
+            'seconds_total': 0.0,
+            'seconds_max':   0.0,
+        }
+
+    # ── pool management ──────────────────────────────────
+    def _pool(self):
+        # Child processes belong to the process that started them; a pool
+        # inherited through fork() (gunicorn --preload) is started afresh
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    methods = multiprocessing.get_all_start_methods()
+                    context = multiprocessing.get_context(
+                        'forkserver' if 'forkserver' in methods else 'spawn')
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=context)
+                    self._slots    = threading.BoundedSemaphore(self.workers + self.max_queue)
+                    self._pid      = os.getpid()
+        return self._executor, self._slots
+
+    def _restart(self, pool):
+        # Like ImagePipeline: the next call starts a fresh pool
+        with self._lock:
+            if self._executor is pool:
+                self._pid = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+        try:
+            return self._submit(fn, *args)
+        except BrokenProcessPool:
+            # A pool process died (e.g. OOM-killed): restart the pool and
+            # try once more, so one crash doesn't fail every queued login
+            self._count('crashes')
+        try:
+            return self._submit(fn, *args)
+        except BrokenProcessPool:
+            self._count('crashes')
+            raise HasherBusy('Password hashing failed')
+
+    def _submit(self, fn, *args):
+        pool, slots = self._pool()
+        if not slots.acquire(blocking=False):
+            self._count('rejected')
+            raise HasherBusy('Password hashing queue is full')
+        started = time.monotonic()
+        try:
+            try:
+                future = pool.submit(fn, *args)
+            except Exception:
+                slots.release()
+                raise
+            # The slot stays taken until the process is done, even if we stop waiting
+            future.add_done_callback(lambda _: slots.release())
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            self._count('timeouts')
+            raise HasherBusy('Password hashing timed out')
+        except BrokenProcessPool:
+            self._restart(pool)
+            raise
+        finally:
+            self._time(time.monotonic() - started)
+
+    # ── public API ───────────────────────────────────────
+    def hash(self, password):
+        """bcrypt hash of `password` at the configured cost (str)"""
+        hashed = self._run(_hash, password.encode('utf-8'), self.rounds)
+        self._count('hashed')
+        return hashed.decode('utf-8')
+
+    def verify(self, password, hashed):
+        ok = self._run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+        self._count('checked')
+        return ok
+
+    def needs_rehash(self, hashed):
+        return hash_rounds(hashed) != self.rounds
+
+    def rehash(self, password):
+        """New hash for a just-verified password, or None if the pool is busy
+        (the next login tries again)"""
+        try:
+            hashed = self.hash(password)
+        except HasherBusy:
+            return None
+        self._count('rehashed')
+        return hashed
+
+    # ── stats ────────────────────────────────────────────
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _time(self, seconds):
+        with self._lock:
+            self._stats['seconds_total'] += seconds
+            self._stats['seconds_max']    = max(self._stats['seconds_max'], seconds)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        calls = s['hashed'] + s['checked']
+        s['seconds_avg']   = round(s['seconds_total'] / calls, 4) if calls else 0.0
+        s['seconds_total'] = round(s['seconds_total'], 4)
+        s['seconds_max']   = round(s['seconds_max'], 4)
+        s['rounds']        = self.rounds
+        s['workers']       = self.workers
+        s['max_queue']     = self.max_queue
+        return s
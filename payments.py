@@ -0,0 +1,201 @@
+# payments.py - Razorpay gateway adapter for SecureShop
+#
+# One razorpay.Client per worker process on a keep-alive requests.Session,
+# so order creation reuses open TLS connections instead of handshaking on
+# every checkout. Every call has connect/read timeouts and a bounded
+# number of retries with exponential backoff, and order.create runs on a
+# small thread pool: when the gateway is slow the request gives up after
+# a fixed deadline, and when the pool is full it fails fast (GatewayBusy)
+# instead of piling more threads onto a stalled upstream.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import razorpay
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class GatewayError(Exception):
+    """Order creation failed (gateway error, timeout, or too busy)"""
+
+
+class GatewayTimeout(GatewayError):
+    pass
+
+
+class GatewayBusy(GatewayError):
+    pass
+
+
+class _TimeoutSession(requests.Session):
+    """requests.Session that applies a default (connect, read) timeout -
+    the razorpay SDK never passes one, so a stalled gateway would block forever"""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+class PaymentGateway:
+    """Shared Razorpay client + bounded worker pool.
+
+    connect_timeout / read_timeout   per HTTP attempt, in seconds
+    retries       extra attempts on connection errors (any method) and on
+                  429/5xx for idempotent GETs; POSTs are never re-sent
+                  once the request reached the gateway
+    backoff       base of the exponential backoff between attempts
+    max_workers   concurrent gateway calls per process; at most as many
+                  again may queue, anything beyond gets GatewayBusy at once
+    """
+
+    def __init__(self, key_id, key_secret, base_url=None, connect_timeout=3.0,
+                 read_timeout=10.0, retries=2, backoff=0.3, max_workers=8):
+        self.key_id          = key_id
+        self.key_secret      = key_secret
+        self.base_url        = base_url
+        self.connect_timeout = connect_timeout
+        self.read_timeout    = read_timeout
+        self.retries         = retries
+        self.backoff         = backoff
+        self.max_workers     = max_workers
+        self._lock           = threading.Lock()
+        self._pid            = None
+        self._stats          = {
+            'calls':         0,
+            'errors':        0,
+            'timeouts':      0,
+            'busy':          0,
+            'seconds_total': 0.0,
+            'seconds_max':   0.0,
+        }
+
+    # ── per-process state ────────────────────────────────
+    def _ensure_started(self):
+        # Sessions and threads don't survive fork(); each worker builds its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            session = _TimeoutSession((self.connect_timeout, self.read_timeout))
+            adapter = HTTPAdapter(
+                pool_connections = 1,
+                pool_maxsize     = self.max_workers,
+                max_retries      = Retry(
+                    total            = self.retries,
+                    backoff_factor   = self.backoff,
+                    status_forcelist = (429, 500, 502, 503, 504),
+                    raise_on_status  = False,
+                ),
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            options = {'base_url': self.base_url} if self.base_url else {}
+            self._client   = razorpay.Client(session=session,
+                                             auth=(self.key_id, self.key_secret),
+                                             **options)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='razorpay')
+            self._slots    = threading.BoundedSemaphore(self.max_workers * 2)
+            self._pid      = os.getpid()
+
+    @property
+    def client(self):
+        self._ensure_started()
+        return self._client
+
+    @property
+    def deadline(self):
+        """Longest a caller waits for a POST: every connect attempt timing
+        out plus backoff, then one read (a sent POST is never retried)"""
+        attempts = self.retries + 1
+        backoff  = sum(self.backoff * (2 ** i) for i in range(1, attempts))
+        return attempts * self.connect_timeout + self.read_timeout + backoff
+
+    # ── calls ────────────────────────────────────────────
+    def _call(self, fn, *args, **kwargs):
+        self._ensure_started()
+        if not self._slots.acquire(blocking=False):
+            self._record('busy')
+            raise GatewayBusy('Payment gateway is busy, try again')
+        started = time.monotonic()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+            future.add_done_callback(lambda _: self._slots.release())
+        except Exception:
+            self._slots.release()
+            raise
+        try:
+            return future.result(timeout=self.deadline)
+        except FutureTimeout:
+            self._record('timeouts')
+            raise GatewayTimeout('Payment gateway timed out')
+        except requests.exceptions.Timeout as e:
+            self._record('timeouts')
+            raise GatewayTimeout(str(e))
+        except Exception as e:
+            self._record('errors')
+            raise GatewayError(str(e))
+        finally:
+            self._record_time(time.monotonic() - started)
+
+    def create_order(self, amount, currency='INR', **extra):
+        """Razorpay order for `amount` paise (dict with 'id', 'amount', ...)"""
+        data = dict(extra, amount=amount, currency=currency)
+        return self._call(self.client.order.create, data=data)
+
+    def fetch_order(self, order_id):
+        """An existing Razorpay order (dict with 'id', 'amount', 'status', ...)"""
+        return self._call(self.client.order.fetch, order_id)
+
+    def verify_signature(self, order_id, payment_id, signature):
+        """Local HMAC check - raises razorpay.errors.SignatureVerificationError"""
+        return self.client.utility.verify_payment_signature({
+            'razorpay_order_id':   order_id,
+            'razorpay_payment_id': payment_id,
+            'razorpay_signature':  signature,
+        })
+
+    # ── stats ────────────────────────────────────────────
+    def _record(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def _record_time(self, seconds):
+        with self._lock:
+            self._stats['calls']         += 1
+            self._stats['seconds_total'] += seconds
+            self._stats['seconds_max']    = max(self._stats['seconds_max'], seconds)
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s['seconds_avg']   = round(s['seconds_total'] / s['calls'], 4) if s['calls'] else 0.0
+        s['seconds_total'] = round(s['seconds_total'], 4)
+        s['seconds_max']   = round(s['seconds_max'], 4)
+        s['max_workers']   = self.max_workers
+        s['deadline']      = round(self.deadline, 2)
+        return s
+
+
+def init_gateway(app, key_id, key_secret):
+    """Create the gateway from app.config"""
+    gateway = PaymentGateway(
+        key_id, key_secret,
+        base_url        = app.config['RAZORPAY_BASE_URL'],
+        connect_timeout = app.config['RAZORPAY_CONNECT_TIMEOUT'],
+        read_timeout    = app.config['RAZORPAY_READ_TIMEOUT'],
+        retries         = app.config['RAZORPAY_RETRIES'],
+        max_workers     = app.config['RAZORPAY_WORKERS'],
+    )
+    app.extensions['payment_gateway'] = gateway
+    return gateway
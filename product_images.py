@@ -0,0 +1,270 @@
+# product_images.py - Local, resized copies of product images (/img/)
+#
+# products.image_url points at other people's servers, at whatever size
+# they host. Templates ask for {{ product_image(product, 'card') }}
+# instead and get /img/<product id>/card/<key>, where <key> is a hash of
+# the image_url. The original is fetched once, the image pool (images.py)
+# writes thumb / card / hero variants as WebP + JPEG under
+# PRODUCT_IMAGE_FOLDER, and from then on the file is served from disk -
+# WebP to browsers that accept it - as immutable: a new image_url is a
+# new key, so a URL never changes content.
+#
+# A request never waits on the origin: a miss is redirected (no-store) to
+# the original image while a small background pool fetches it, one fetch
+# per key however many requests miss at once. Only URLs in the catalog
+# are fetched (the product id is looked up, and its key must match). A
+# source that fails is not retried for FAILURE_TTL seconds; meanwhile the
+# route redirects to a local placeholder. import_catalog.py pre-warms the
+# variants of every product it writes, and `import_catalog.py --prewarm`
+# those of the whole catalog, so shoppers rarely see a miss at all.
+
+import functools
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from flask import abort, redirect, request, send_from_directory, url_for
+
+from assets import IMMUTABLE
+from catalog_cache import TTLCache
+from images import ImageBusy, InvalidImage, stream_to_temp, variant_names
+
+# Boxes the image is scaled to fit (never enlarged); 2x the CSS sizes
+VARIANTS = {
+    'thumb': (160, 160),      # cart, payment, search dropdown, favourites (44-80px)
+    'card':  (600, 600),      # product cards (~280 x 200px)
+    'hero':  (1200, 1200),    # product page, home slider
+}
+PLACEHOLDER      = 'img/no-image.svg'        # under static/
+MAX_SOURCE_BYTES = 15 * 1024 * 1024
+FAILURE_TTL      = 300                       # seconds before a failed source is tried again
+USER_AGENT       = 'SecureShop-ImageFetcher/1.0'
+
+
+@functools.lru_cache(maxsize=65536)
+def image_key(url):
+    """Name of a source image's variants on disk"""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+
+
+class ProductImages:
+    """Fetch-once variant store for product image URLs"""
+
+    def __init__(self, folder, pipeline, timeout=(3, 10), max_bytes=MAX_SOURCE_BYTES,
+                 failure_ttl=FAILURE_TTL, threads=4):
+        self.folder    = folder
+        self.pipeline  = pipeline
+        self.timeout   = timeout               # (connect, read) seconds for the origin
+        self.max_bytes = max_bytes
+        self.threads   = threads               # background fetches (fill_later)
+        self._local    = threading.local()     # a requests.Session per thread
+        self._lock     = threading.Lock()
+        self._inflight = {}                    # key → Event set when its fetch ends
+        self._queued   = set()                 # keys waiting for / in a background fetch
+        self._executor = None
+        self._pid      = None
+        self._failed   = TTLCache(maxsize=10000, ttl=failure_ttl)
+        self._stats    = {
+            'hits':          0,
+            'fetched':       0,
+            'fetch_errors':  0,
+            'invalid':       0,
+            'busy':          0,
+            'queued':        0,
+            'queue_full':    0,
+            'bytes_fetched': 0,
+        }
+
+    def failed_recently(self, key):
+        return bool(self._failed.get(key))
+
+    def has(self, key):
+        return all(os.path.exists(os.path.join(self.folder, name))
+                   for name in variant_names(key, VARIANTS))
+
+    def ensure(self, url):
+        """The url's key once its variants are on disk (fetching them if
+        needed), or None if they can't be had right now"""
+        key = image_key(url)
+        if self.has(key):
+            self._count('hits')
+            return key
+        if self.failed_recently(key):
+            return None
+
+        with self._lock:
+            event  = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if not leader:
+            # Someone else is fetching this one - wait for it instead
+            event.wait(sum(self.timeout) + self.pipeline.timeout)
+            return key if self.has(key) else None
+
+        try:
+            self._fetch(url, key)
+            self._count('fetched')
+            return key
+        except (requests.RequestException, InvalidImage) as e:
+            self._count('invalid' if isinstance(e, InvalidImage) else 'fetch_errors')
+            self._failed.set(key, True)
+            print(f"Product image error ({url}): {e}")
+            return None
+        except ImageBusy:
+            self._count('busy')
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def fill_later(self, url):
+        """ensure(url) on the background pool, at most once at a time per
+        key. At most 4 x threads keys wait; beyond that returns False (a
+        later miss asks again)."""
+        key = image_key(url)
+        with self._lock:
+            if os.getpid() != self._pid:
+                # Threads don't survive fork(): start this process's own
+                self._executor = ThreadPoolExecutor(max_workers=self.threads,
+                                                    thread_name_prefix='product-image')
+                self._queued   = set()
+                self._pid      = os.getpid()
+            if key in self._queued:
+                return True
+            if len(self._queued) >= 4 * self.threads:
+                self._stats['queue_full'] += 1
+                return False
+            self._queued.add(key)
+            self._stats['queued'] += 1
+            executor = self._executor
+
+        def fill():
+            try:
+                self.ensure(url)
+            finally:
+                with self._lock:
+                    self._queued.discard(key)
+        executor.submit(fill)
+        return True
+
+    def _session(self):
+        http = getattr(self._local, 'session', None)
+        if http is None:
+            http = self._local.session = requests.Session()
+            http.headers['User-Agent'] = USER_AGENT
+        return http
+
+    def _fetch(self, url, key):
+        if urlparse(url).scheme not in ('http', 'https'):
+            raise InvalidImage('not an http(s) URL')
+        with self._session().get(url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            src, _ = stream_to_temp(response.raw, self.folder, self.max_bytes)
+        try:
+            with self._lock:
+                self._stats['bytes_fetched'] += os.path.getsize(src)
+            self.pipeline.variants(src, self.folder, key, VARIANTS)
+        finally:
+            os.remove(src)
+
+    def _count(self, counter):
+        with self._lock:
+            self._stats[counter] += 1
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        s['fetching']       = len(self._inflight)
+        s['waiting']        = len(self._queued)
+        s['failed_sources'] = len(self._failed)
+        return s
+
+
+class Prewarmer:
+    """ProductImages.ensure() for a stream of URLs on a few threads, with
+    at most 2 x threads waiting (used by import_catalog.py)"""
+
+    def __init__(self, images, threads=8):
+        self.images    = images
+        self.ready     = 0
+        self.failed    = 0
+        self._lock     = threading.Lock()
+        self._slots    = threading.BoundedSemaphore(2 * threads)
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='prewarm')
+
+    def submit(self, url):
+        self._slots.acquire()
+        future = self._executor.submit(self.images.ensure, url)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self._slots.release()
+        ok = future.exception() is None and future.result() is not None
+        with self._lock:
+            if ok:
+                self.ready += 1
+            else:
+                self.failed += 1
+
+    def close(self):
+        """Wait for everything submitted; returns (ready, failed)"""
+        self._executor.shutdown(wait=True)
+        return self.ready, self.failed
+
+
+def init_product_images(app, pipeline, source_url):
+    """Register product_image() for templates and the /img/ route.
+    source_url(product_id) → that product's image_url (or None)."""
+    images = ProductImages(app.config['PRODUCT_IMAGE_FOLDER'], pipeline,
+                           timeout=(app.config['PRODUCT_IMAGE_CONNECT_TIMEOUT'],
+                                    app.config['PRODUCT_IMAGE_READ_TIMEOUT']),
+                           threads=app.config['PRODUCT_IMAGE_FETCH_THREADS'])
+
+    @app.route('/img/<int:product_id>/<variant>/<key>')
+    def product_image(product_id, variant, key):
+        if variant not in VARIANTS:
+            abort(404)
+        # Only on an explicit image/webp: browsers without WebP send */* too
+        ext  = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpg'
+        name = f'{key}-{variant}.{ext}'
+        if not os.path.exists(os.path.join(images.folder, name)):
+            url = source_url(product_id)
+            if not url:
+                abort(404)
+            if image_key(url) != key:
+                # Page rendered before the product's image changed
+                return _no_store(redirect(url_for('product_image', product_id=product_id,
+                                                  variant=variant, key=image_key(url))))
+            if images.failed_recently(key):
+                return _no_store(redirect(url_for('static', filename=PLACEHOLDER)))
+            # Not resized yet: the original this once, the variants meanwhile
+            images.fill_later(url)
+            return _no_store(redirect(url))
+        response = send_from_directory(os.path.abspath(images.folder), name)
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept')
+        return response
+
+    def product_image_url(product, variant):
+        return image_url_for(product['id'], product['image_url'], variant)
+
+    app.jinja_env.globals['product_image'] = product_image_url
+    return images
+
+
+def image_url_for(product_id, url, variant):
+    """/img/ URL of a product image variant (the placeholder if it has none)"""
+    if not url:
+        return url_for('static', filename=PLACEHOLDER)
+    return url_for('product_image', product_id=product_id, variant=variant, key=image_key(url))
+
+
+def _no_store(response):
+    response.headers['Cache-Control'] = 'no-store'
+    return response
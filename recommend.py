@@ -0,0 +1,360 @@
+# recommend.py - "Users also bought": item-item co-purchase recommendations
+#
+# Every paid order is a basket; every user's favourites are a second,
+# lighter-weighted basket. With B the basket × product incidence matrix
+# (scipy.sparse), C = BᵀB counts how often two products were bought
+# together, and C[i, i] how often i was bought at all. Neighbours of i are
+# ranked by cosine similarity C[i, j] / sqrt(C[i, i] · C[j, j]), so a
+# bestseller doesn't turn up next to everything.
+#
+# A full build precomputes two compact lookup tables: the top-N neighbours
+# of every product, and the top-N products for every user (their order
+# and favourite history scored against the neighbour table, minus what
+# they already have). update() folds in order lines and favourites added
+# since the last build or update, recomputing only the products and users
+# they touch. Removed favourites and the small drift in other products'
+# scores wait for the next full build.
+#
+# Ids are assigned at INSERT, not at COMMIT, so a checkout that commits
+# late can add lines below the last id already folded in. Each update
+# re-reads the last `rescan` ids and skips the rows it has already seen.
+
+import copy
+import threading
+import time
+
+import numpy as np
+import pymysql.cursors
+import scipy.sparse as sp
+
+_EMPTY_IDS    = np.empty(0, dtype=np.int32)
+_EMPTY_SCORES = np.empty(0, dtype=np.float32)
+
+
+# ══════════════════════════════════════
+# LOADING (streamed straight into arrays)
+# ══════════════════════════════════════
+def _fetch_array(conn, sql, args, columns):
+    cursor = conn.cursor(pymysql.cursors.SSCursor)   # unbuffered tuples
+    chunks = []
+    try:
+        cursor.execute(sql, args)
+        while True:
+            rows = cursor.fetchmany(50000)
+            if not rows:
+                break
+            chunks.append(np.array(rows, dtype=np.int64))
+    finally:
+        cursor.close()
+    return np.concatenate(chunks) if chunks else np.empty((0, columns), dtype=np.int64)
+
+
+def load_order_lines(conn, after_id=0):
+    """(line id, order id, user id, product id) of paid orders, by line id"""
+    return _fetch_array(conn, """
+        SELECT oi.id, oi.order_id, o.user_id, oi.product_id
+        FROM order_items oi
+        JOIN orders o ON o.id = oi.order_id
+        WHERE oi.id > %s AND o.payment_status = 'paid'
+        ORDER BY oi.id
+    """, (after_id,), 4)
+
+
+def load_favorites(conn, after_id=0):
+    """(favourite id, user id, product id), by id"""
+    return _fetch_array(conn, """
+        SELECT id, user_id, product_id FROM favorites
+        WHERE id > %s ORDER BY id
+    """, (after_id,), 3)
+
+
+def _unseen(rows, seen, window):
+    """(rows whose id - column 0 - isn't in `seen`, the ids to remember:
+    seen plus theirs, within `window` of the highest)"""
+    fresh = rows[~np.isin(rows[:, 0], seen)]
+    ids   = np.union1d(seen, fresh[:, 0])
+    return fresh, ids[ids > ids.max(initial=0) - window]
+
+
+def _incidence(rows, cols, shape):
+    """0/1 csr matrix with a 1 at each (row, col)"""
+    m = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape)
+    m.sum_duplicates()
+    m.data[:] = 1
+    return m
+
+
+def _grow(m, shape):
+    if m.shape != shape:
+        m = m.copy()
+        m.resize(shape)
+    return m
+
+
+# ══════════════════════════════════════
+# COMPACT TOP-N TABLE
+# ══════════════════════════════════════
+class TopTable:
+    """key → (ids, scores) best first, packed into flat numpy arrays.
+
+    Rows changed by update() go in a small overlay dict until the next
+    full build repacks everything.
+    """
+
+    def __init__(self, rows=None):
+        rows          = rows or {}
+        self._keys    = np.array(sorted(rows), dtype=np.int64)
+        self._offsets = np.zeros(len(self._keys) + 1, dtype=np.int64)
+        np.cumsum([len(rows[k][0]) for k in self._keys], out=self._offsets[1:])
+        if len(self._keys):
+            self._ids    = np.concatenate([rows[k][0] for k in self._keys]).astype(np.int32)
+            self._scores = np.concatenate([rows[k][1] for k in self._keys]).astype(np.float32)
+        else:
+            self._ids, self._scores = _EMPTY_IDS, _EMPTY_SCORES
+        self._patched = {}
+
+    def get(self, key):
+        row = self._patched.get(key)
+        if row is not None:
+            return row
+        i = np.searchsorted(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            start, end = self._offsets[i], self._offsets[i + 1]
+            return self._ids[start:end], self._scores[start:end]
+        return _EMPTY_IDS, _EMPTY_SCORES
+
+    def patched(self, rows):
+        """Copy of the table with these rows replaced (readers keep the old one)"""
+        table = copy.copy(self)
+        table._patched = {**self._patched, **rows}
+        return table
+
+    def __len__(self):
+        patched = np.fromiter(self._patched, dtype=np.int64, count=len(self._patched))
+        return len(self._keys) + int(np.count_nonzero(~np.isin(patched, self._keys)))
+
+    @property
+    def nbytes(self):
+        return (self._keys.nbytes + self._offsets.nbytes + self._ids.nbytes
+                + self._scores.nbytes)
+
+
+# ══════════════════════════════════════
+# RECOMMENDER
+# ══════════════════════════════════════
+class Recommender:
+    """Co-purchase neighbours per product and recommendations per user.
+
+    top_n            neighbours / recommendations kept per product / user
+    favorite_weight  weight of a favourite relative to a purchase
+    rescan           ids below the last one seen that each update reads again
+    """
+
+    def __init__(self, top_n=12, favorite_weight=0.5, rescan=5000):
+        self.top_n            = top_n
+        self.favorite_weight  = favorite_weight
+        self.rescan           = rescan
+        self._lock            = threading.Lock()   # one build/update at a time
+        self._counts          = sp.csr_matrix((0, 0), dtype=np.float32)   # C
+        self._bought          = sp.csr_matrix((0, 0), dtype=np.float32)   # users × products
+        self._faved           = sp.csr_matrix((0, 0), dtype=np.float32)   # users × products
+        self._neighbours      = TopTable()
+        self._for_user        = TopTable()
+        self._popular         = _EMPTY_IDS
+        self.last_line_id     = 0
+        self.last_favorite_id = 0
+        self._seen_lines      = np.empty(0, dtype=np.int64)   # ids within rescan of the last
+        self._seen_favorites  = np.empty(0, dtype=np.int64)
+        self.built_at         = None
+        self.updated_at       = None
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    @property
+    def lines_after(self):
+        """after_id for load_order_lines() before an update"""
+        return max(0, self.last_line_id - self.rescan)
+
+    @property
+    def favorites_after(self):
+        """after_id for load_favorites() before an update"""
+        return max(0, self.last_favorite_id - self.rescan)
+
+    def mark_stale(self):
+        """Have the next use fold in new orders"""
+        if self.updated_at is not None:
+            self.updated_at = float('-inf')
+
+    # ── build / update ───────────────────────────────────
+    def build(self, lines, favorites):
+        """lines from load_order_lines(), favorites from load_favorites()"""
+        with self._lock:
+            n_users = int(max(lines[:, 2].max(initial=0), favorites[:, 1].max(initial=0))) + 1
+            n_items = int(max(lines[:, 3].max(initial=0), favorites[:, 2].max(initial=0))) + 1
+
+            orders, basket_rows = np.unique(lines[:, 1], return_inverse=True)
+            baskets = _incidence(basket_rows, lines[:, 3], (len(orders), n_items))
+            bought  = _incidence(lines[:, 2], lines[:, 3], (n_users, n_items))
+            faved   = _incidence(favorites[:, 1], favorites[:, 2], (n_users, n_items))
+            counts  = (baskets.T @ baskets + self.favorite_weight * (faved.T @ faved)).tocsr()
+            counts.sort_indices()
+
+            items      = np.flatnonzero(np.diff(counts.indptr))
+            neighbours = TopTable(self._neighbour_rows(counts, items))
+            history    = bought + self.favorite_weight * faved
+            users      = np.flatnonzero(np.diff(history.indptr))
+            for_user   = TopTable(self._user_rows(history, users, neighbours))
+
+            self._counts, self._bought, self._faved = counts, bought, faved
+            self._neighbours, self._for_user = neighbours, for_user
+            self._popular = self._top_sellers(bought)
+            _, seen_lines     = _unseen(lines, np.empty(0, dtype=np.int64), self.rescan)
+            _, seen_favorites = _unseen(favorites, np.empty(0, dtype=np.int64), self.rescan)
+            self._remember(seen_lines, seen_favorites)
+            self.built_at = self.updated_at = time.monotonic()
+
+    def update(self, lines, favorites):
+        """Fold in lines/favourites loaded with after_id = lines_after /
+        favorites_after; rows already folded in are skipped"""
+        with self._lock:
+            lines,     seen_lines     = _unseen(lines, self._seen_lines, self.rescan)
+            favorites, seen_favorites = _unseen(favorites, self._seen_favorites, self.rescan)
+            if not len(lines) and not len(favorites):
+                self.updated_at = time.monotonic()
+                return
+            n_users = int(max(lines[:, 2].max(initial=0), favorites[:, 1].max(initial=0),
+                              self._bought.shape[0] - 1)) + 1
+            n_items = int(max(lines[:, 3].max(initial=0), favorites[:, 2].max(initial=0),
+                              self._counts.shape[0] - 1)) + 1
+
+            counts    = _grow(self._counts, (n_items, n_items))
+            bought    = _grow(self._bought, (n_users, n_items))
+            old_faved = _grow(self._faved, (n_users, n_items))
+
+            # New baskets are new rows of B, so they just add to C. New
+            # favourites extend existing rows of F: with D = F' - F,
+            # F'ᵀF' - FᵀF = DᵀF + FᵀD + DᵀD.
+            orders, basket_rows = np.unique(lines[:, 1], return_inverse=True)
+            baskets = _incidence(basket_rows, lines[:, 3], (len(orders), n_items))
+            faved   = old_faved + _incidence(favorites[:, 1], favorites[:, 2], (n_users, n_items))
+            faved.data[:] = 1
+            added   = (faved - old_faved).tocsr()
+            added.eliminate_zeros()
+            delta   = (baskets.T @ baskets
+                       + self.favorite_weight * (added.T @ old_faved + old_faved.T @ added
+                                                 + added.T @ added)).tocsr()
+            counts  = (counts + delta).tocsr()
+            counts.sort_indices()
+            bought  = bought + _incidence(lines[:, 2], lines[:, 3], (n_users, n_items))
+            bought.data[:] = 1
+
+            items      = np.flatnonzero(np.diff(delta.indptr))
+            neighbours = self._neighbours.patched(self._neighbour_rows(counts, items))
+            history    = bought + self.favorite_weight * faved
+            users      = np.unique(np.concatenate([lines[:, 2], favorites[:, 1]]))
+            for_user   = self._for_user.patched(self._user_rows(history, users, neighbours))
+
+            self._counts, self._bought, self._faved = counts, bought, faved
+            self._neighbours, self._for_user = neighbours, for_user
+            self._popular = self._top_sellers(bought)
+            self._remember(seen_lines, seen_favorites)
+            self.updated_at = time.monotonic()
+
+    def _remember(self, seen_lines, seen_favorites):
+        self._seen_lines, self._seen_favorites = seen_lines, seen_favorites
+        if len(seen_lines):
+            self.last_line_id = int(seen_lines[-1])
+        if len(seen_favorites):
+            self.last_favorite_id = int(seen_favorites[-1])
+
+    def _neighbour_rows(self, counts, items):
+        """{product id: (ids, scores)} for these rows of C"""
+        support = counts.diagonal()
+        rows    = {}
+        for i in items:
+            start, end = counts.indptr[i], counts.indptr[i + 1]
+            cols, vals = counts.indices[start:end], counts.data[start:end]
+            keep       = cols != i
+            cols, vals = cols[keep], vals[keep]
+            scores     = vals / np.sqrt(support[i] * support[cols])
+            rows[int(i)] = _best(cols, scores, self.top_n)
+        return rows
+
+    def _user_rows(self, history, users, neighbours, block=2000):
+        """{user id: (ids, scores)}: history × neighbour scores, minus the
+        user's own products. Users are scored in blocks to bound memory."""
+        rows = {}
+        for b in range(0, len(users), block):
+            chunk   = users[b:b + block]
+            sub     = history[chunk]
+            items   = np.unique(sub.indices)
+            scores  = sub @ _neighbour_matrix(neighbours, items, history.shape[1])
+            scores  = scores.tocsr()
+            for r, user_id in enumerate(chunk):
+                start, end = scores.indptr[r], scores.indptr[r + 1]
+                cols, vals = scores.indices[start:end], scores.data[start:end]
+                owned      = sub.indices[sub.indptr[r]:sub.indptr[r + 1]]
+                keep       = ~np.isin(cols, owned)
+                rows[int(user_id)] = _best(cols[keep], vals[keep], self.top_n)
+        return rows
+
+    @staticmethod
+    def _top_sellers(bought, n=200):
+        """Products bought by the most users, best first"""
+        buyers = np.asarray(bought.sum(axis=0)).ravel()
+        n      = min(n, np.count_nonzero(buyers))
+        top    = np.argpartition(-buyers, n - 1)[:n] if n else _EMPTY_IDS
+        return top[np.argsort(-buyers[top], kind='stable')].astype(np.int32)
+
+    # ── lookups ──────────────────────────────────────────
+    def neighbours(self, product_id, k):
+        """Up to k product ids most often bought with product_id"""
+        return self._neighbours.get(product_id)[0][:k].tolist()
+
+    def for_user(self, user_id, k):
+        """Up to k product ids for this user, best first"""
+        return self._for_user.get(user_id)[0][:k].tolist()
+
+    def popular(self, k):
+        """The k products bought by the most users"""
+        return self._popular[:k].tolist()
+
+    def stats(self):
+        matrices = (self._counts, self._bought, self._faved)
+        return {
+            'built':            self.is_built,
+            'products':         len(self._neighbours),
+            'users':            len(self._for_user),
+            'pairs':            int(self._counts.nnz),
+            'table_bytes':      int(self._neighbours.nbytes + self._for_user.nbytes),
+            'matrix_bytes':     int(sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+                                        for m in matrices)),
+            'last_line_id':     self.last_line_id,
+            'last_favorite_id': self.last_favorite_id,
+            'top_n':            self.top_n,
+        }
+
+
+def _best(ids, scores, n):
+    """The n highest-scoring ids, best first"""
+    if len(ids) > n:
+        top = np.argpartition(-scores, n - 1)[:n]
+        ids, scores = ids[top], scores[top]
+    order = np.argsort(-scores, kind='stable')
+    return ids[order].astype(np.int32), scores[order].astype(np.float32)
+
+
+def _neighbour_matrix(neighbours, items, n_items):
+    """Sparse products × products matrix of neighbour scores, rows `items` only"""
+    rows, cols, vals = [], [], []
+    for i in items:
+        ids, scores = neighbours.get(i)
+        rows.append(np.full(len(ids), i, dtype=np.int64))
+        cols.append(ids)
+        vals.append(scores)
+    if not rows:
+        return sp.csr_matrix((n_items, n_items), dtype=np.float32)
+    return sp.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(n_items, n_items))
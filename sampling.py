@@ -0,0 +1,101 @@
+# sampling.py - Random in-stock product picks without ORDER BY RAND()
+#
+# ORDER BY RAND() LIMIT n assigns a random number to every matching row
+# and sorts them all. Here each worker keeps the ids of in-stock products
+# per category in plain lists, draws k of them with random.sample (O(k)),
+# and the caller fetches the rows from the catalog cache.
+
+import random
+import threading
+import time
+
+ALL = None   # key for "any category"
+
+
+class _IdBag:
+    """List of ids with O(1) add/remove (swap with last) and O(k) sampling"""
+    __slots__ = ('ids', 'pos')
+
+    def __init__(self):
+        self.ids = []
+        self.pos = {}
+
+    def add(self, product_id):
+        if product_id not in self.pos:
+            self.pos[product_id] = len(self.ids)
+            self.ids.append(product_id)
+
+    def discard(self, product_id):
+        i = self.pos.pop(product_id, None)
+        if i is None:
+            return
+        last = self.ids.pop()
+        if last != product_id:
+            self.ids[i] = last
+            self.pos[last] = i
+
+
+class SamplePool:
+    def __init__(self, rng=None):
+        self._lock       = threading.Lock()
+        self._bags       = {ALL: _IdBag()}   # category → _IdBag (ALL = every category)
+        self._category   = {}                # product id → category
+        self._rng        = rng or random.Random()
+        self.built_at    = None
+
+    def build(self, rows):
+        """rows: id + category of every in-stock product"""
+        bags, categories = {ALL: _IdBag()}, {}
+        for row in rows:
+            bags[ALL].add(row['id'])
+            bags.setdefault(row['category'], _IdBag()).add(row['id'])
+            categories[row['id']] = row['category']
+        with self._lock:
+            self._bags, self._category = bags, categories
+            self.built_at = time.monotonic()
+
+    def mark_stale(self):
+        """Have the next use rebuild this in the background"""
+        if self.built_at is not None:
+            self.built_at = float('-inf')
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    def set_stock(self, product_id, category, stock):
+        """Keep the pool current after a stock or category write"""
+        with self._lock:
+            old = self._category.pop(product_id, None)
+            if old is not None:
+                self._bags[ALL].discard(product_id)
+                self._bags[old].discard(product_id)
+            if stock and stock > 0:
+                self._bags[ALL].add(product_id)
+                self._bags.setdefault(category, _IdBag()).add(product_id)
+                self._category[product_id] = category
+
+    def remove(self, product_id):
+        self.set_stock(product_id, None, 0)
+
+    def sample(self, k, category=ALL, exclude=()):
+        """Up to k distinct random in-stock ids, never one from `exclude`"""
+        with self._lock:
+            bag = self._bags.get(category)
+            if bag is None:
+                return []
+            ids = bag.ids
+            take = min(len(ids), k + len(exclude))
+            picked = self._rng.sample(ids, take)
+        return [i for i in picked if i not in exclude][:k]
+
+
+SAMPLE_ROWS_SQL = "SELECT id, category FROM products WHERE stock > 0"
+
+
+def load_rows(conn):
+    cursor = conn.cursor()
+    cursor.execute(SAMPLE_ROWS_SQL)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
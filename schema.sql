@@ -9,6 +9,8 @@ CREATE DATABASE IF NOT EXISTS secure_shop CHARACTER SET utf8mb4 COLLATE utf8mb4_
 USE secure_shop;
 
 -- Drop tables in correct order (child first)
+DROP TABLE IF EXISTS catalog_changes;
+DROP TABLE IF EXISTS payment_jobs;
 DROP TABLE IF EXISTS order_items;
 DROP TABLE IF EXISTS orders;
 DROP TABLE IF EXISTS favorites;
@@ -24,12 +26,19 @@ CREATE TABLE users (
   mobile        VARCHAR(15) NOT NULL,
   password      VARCHAR(255) NOT NULL,
   profile_image VARCHAR(255) DEFAULT 'default.png',
-  created_at    DATETIME DEFAULT CURRENT_TIMESTAMP
+  -- Profile stats, kept current at checkout so the profile page never
+  -- aggregates the whole order history
+  order_count   INT NOT NULL DEFAULT 0,
+  total_spent   DECIMAL(12,2) NOT NULL DEFAULT 0,
+  created_at    DATETIME DEFAULT CURRENT_TIMESTAMP,
+  -- "is anyone else using this picture?" before its files are deleted
+  INDEX idx_profile_image (profile_image)
 ) ENGINE=InnoDB;
 
 -- ── Products ───────────────────────────────────────────────
 CREATE TABLE products (
   id             INT AUTO_INCREMENT PRIMARY KEY,
+  sku            VARCHAR(64),              -- feed key for import_catalog.py
   name           VARCHAR(200) NOT NULL,
   category       VARCHAR(100) NOT NULL,
   price          DECIMAL(10,2) NOT NULL,
@@ -39,9 +48,21 @@ CREATE TABLE products (
   stock          INT DEFAULT 10,
   rating         DECIMAL(2,1) DEFAULT 4.0,
   created_at     DATETIME DEFAULT CURRENT_TIMESTAMP,
+  -- Any write to the row moves this; pages use it (and MAX of it for
+  -- listings) as their Last-Modified / ETag source
+  updated_at     DATETIME(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6)
+                 ON UPDATE CURRENT_TIMESTAMP(6),
   INDEX idx_category (category),
   INDEX idx_stock    (stock),
-  INDEX idx_rating   (rating)
+  -- Keyset pagination: sort column + id in listing order; stock is a
+  -- range filter (stock > 0) so it trails the key and is checked in-index
+  INDEX idx_cat_price  (category, price, id, stock),
+  INDEX idx_cat_rating (category, rating, id, stock),
+  INDEX idx_cat_id     (category, id, stock),
+  INDEX idx_price      (price, id, stock),
+  INDEX idx_rating     (rating, id, stock),
+  INDEX idx_updated    (updated_at),
+  UNIQUE KEY uniq_sku  (sku)
 ) ENGINE=InnoDB;
 
 -- ── Cart ───────────────────────────────────────────────────
@@ -72,12 +93,17 @@ CREATE TABLE orders (
   id               INT AUTO_INCREMENT PRIMARY KEY,
   user_id          INT NOT NULL,
   total_amount     DECIMAL(10,2) NOT NULL,
-  payment_status   ENUM('pending','paid','failed') DEFAULT 'pending',
+  payment_status   ENUM('pending','paid','failed','refund_due') DEFAULT 'pending',  -- refund_due: captured, no order
   order_status     ENUM('processing','shipped','delivered','cancelled') DEFAULT 'processing',
   transaction_id   VARCHAR(255),
   razorpay_order_id VARCHAR(255),
+  item_count       INT NOT NULL DEFAULT 0,   -- order_items lines, set at checkout
   created_at       DATETIME DEFAULT CURRENT_TIMESTAMP,
-  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+  -- Order history pages: newest first, keyset on (created_at, id)
+  INDEX idx_user_created (user_id, created_at),
+  -- One order per Razorpay order, so a retried payment job can't create two
+  UNIQUE KEY uniq_razorpay_order (razorpay_order_id)
 ) ENGINE=InnoDB;
 
 -- ── Order Items ────────────────────────────────────────────
@@ -91,6 +117,41 @@ CREATE TABLE order_items (
   FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
 ) ENGINE=InnoDB;
 
+-- ── Payment Jobs (drained by worker.py) ────────────────────
+-- /payment/verify only checks the signature and queues a job here; the
+-- worker creates the order (or records the failure) and the browser polls
+-- /payment/status/<id>. idempotency_key = razorpay_order_id for finalize
+-- jobs, so a repeated verify call gets the same job back.
+CREATE TABLE payment_jobs (
+  id                INT AUTO_INCREMENT PRIMARY KEY,
+  kind              ENUM('finalize','record_failure') NOT NULL,
+  status            ENUM('queued','running','done','failed') DEFAULT 'queued',
+  idempotency_key   VARCHAR(255),
+  user_id           INT NOT NULL,
+  razorpay_order_id VARCHAR(255),
+  payment_id        VARCHAR(255),
+  amount            INT,                      -- paise the Razorpay order was for (finalize)
+  attempts          INT DEFAULT 0,
+  run_after         DATETIME DEFAULT CURRENT_TIMESTAMP,
+  order_id          INT,
+  last_error        VARCHAR(500),
+  created_at        DATETIME DEFAULT CURRENT_TIMESTAMP,
+  updated_at        DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+  UNIQUE KEY uniq_idempotency (idempotency_key),
+  INDEX idx_pick (status, run_after)
+) ENGINE=InnoDB;
+
+-- ── Catalog Changes (imports and checkouts) ───────────────
+-- Every product an import or an order touched. Each web worker
+-- tails this table to drop just those products from its caches.
+CREATE TABLE catalog_changes (
+  id         BIGINT AUTO_INCREMENT PRIMARY KEY,
+  product_id INT NOT NULL,
+  changed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  INDEX idx_changed_at (changed_at)
+) ENGINE=InnoDB;
+
 -- ════════════════════════════════════════════════════════════
 -- SEED DATA — 1000 Products
 -- ════════════════════════════════════════════════════════════
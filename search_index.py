@@ -0,0 +1,280 @@
+# search_index.py - In-memory product search for /search and /search-results
+#
+# Replaces `name LIKE '%q%' OR category LIKE '%q%'` table scans with
+# character-trigram postings (exact substring semantics, like LIKE) plus
+# word-token postings (multi-word queries in any order). Results are ranked
+# by match quality first and product rating second.
+#
+# The index is built once per worker from the products table and kept up
+# to date with upsert()/remove() when products change.
+
+import heapq
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from catalog_cache import TTLCache
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_SEP      = '\x00'   # never appears in a query, so n-grams can't span fields
+
+# Match-quality tiers (lower = better)
+TIER_EXACT         = 0   # name == query
+TIER_NAME_PREFIX   = 1   # name starts with query
+TIER_WORD_PREFIX   = 2   # a word in the name starts with query
+TIER_NAME_CONTAINS = 3   # query somewhere inside the name
+TIER_CATEGORY      = 4   # only the category matches
+TIER_ALL_WORDS     = 5   # every query word is present, not contiguous
+
+
+def normalize(text):
+    return ' '.join((text or '').lower().split())
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text)
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class IndexedProduct:
+    """The columns live search needs, pre-converted for JSON"""
+    __slots__ = ('id', 'name', 'category', 'price', 'image_url', 'rating',
+                 'stock', 'name_l', 'category_l', 'tokens', 'grams')
+
+    def __init__(self, row):
+        self.id         = row['id']
+        self.name       = row['name']
+        self.category   = row['category']
+        self.price      = float(row['price'])
+        self.image_url  = row['image_url']
+        self.rating     = float(row['rating'] or 0)
+        self.stock      = row['stock'] or 0
+        self.name_l     = normalize(self.name)
+        self.category_l = normalize(self.category)
+        self.tokens     = set(tokenize(self.name_l)) | set(tokenize(self.category_l))
+        # Trailing separator makes every 2-char substring the prefix of a
+        # trigram, so 2-letter queries are answered from the same postings.
+        self.grams      = trigrams(self.name_l + _SEP + self.category_l + _SEP)
+
+    def as_json(self):
+        return {
+            'id':        self.id,
+            'name':      self.name,
+            'price':     self.price,
+            'image_url': self.image_url,
+            'category':  self.category,
+            'rating':    self.rating,
+        }
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock      = threading.RLock()
+        self._docs      = {}   # product id → IndexedProduct
+        self._grams     = {}   # trigram → set(product ids)
+        self._by_bigram = {}   # first two chars → set(trigrams)
+        self._tokens    = {}   # word → set(product ids)
+        self._sorted_tokens = []
+        self._results   = TTLCache(maxsize=1024, ttl=300)   # query → lookup()
+        self.built_at   = None
+        self.version    = 0    # bumped on every change (for response validators)
+
+    # ══════════════════════════════════════
+    # BUILD / INCREMENTAL UPDATES
+    # ══════════════════════════════════════
+    def build(self, rows):
+        fresh = SearchIndex()
+        for row in rows:
+            fresh._add(IndexedProduct(row))
+        fresh._sorted_tokens = sorted(fresh._tokens)
+        with self._lock:
+            self._docs, self._grams = fresh._docs, fresh._grams
+            self._by_bigram, self._tokens = fresh._by_bigram, fresh._tokens
+            self._sorted_tokens = fresh._sorted_tokens
+            self._results.clear()
+            self.built_at = time.monotonic()
+            self.version += 1
+
+    def mark_stale(self):
+        """Have the next use rebuild this in the background"""
+        if self.built_at is not None:
+            self.built_at = float('-inf')
+
+    def upsert(self, row):
+        doc = IndexedProduct(row)
+        with self._lock:
+            self._remove(doc.id)
+            self._add(doc, keep_sorted=True)
+            self._results.clear()
+            self.version += 1
+
+    def remove(self, product_id):
+        with self._lock:
+            self._remove(product_id)
+            self._results.clear()
+            self.version += 1
+
+    def _add(self, doc, keep_sorted=False):
+        self._docs[doc.id] = doc
+        for gram in doc.grams:
+            postings = self._grams.get(gram)
+            if postings is None:
+                postings = self._grams[gram] = set()
+                self._by_bigram.setdefault(gram[:2], set()).add(gram)
+            postings.add(doc.id)
+        for token in doc.tokens:
+            postings = self._tokens.get(token)
+            if postings is None:
+                postings = self._tokens[token] = set()
+                if keep_sorted:
+                    self._sorted_tokens.insert(
+                        bisect_left(self._sorted_tokens, token), token)
+            postings.add(doc.id)
+
+    def _remove(self, product_id):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        for gram in doc.grams:
+            postings = self._grams[gram]
+            postings.discard(product_id)
+            if not postings:
+                del self._grams[gram]
+                siblings = self._by_bigram[gram[:2]]
+                siblings.discard(gram)
+                if not siblings:
+                    del self._by_bigram[gram[:2]]
+        for token in doc.tokens:
+            postings = self._tokens[token]
+            postings.discard(product_id)
+            if not postings:
+                del self._tokens[token]
+                i = bisect_left(self._sorted_tokens, token)
+                if i < len(self._sorted_tokens) and self._sorted_tokens[i] == token:
+                    del self._sorted_tokens[i]
+
+    @property
+    def is_built(self):
+        return self.built_at is not None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def get(self, product_id):
+        return self._docs.get(product_id)
+
+    # ══════════════════════════════════════
+    # LOOKUPS
+    # ══════════════════════════════════════
+    def _substring_ids(self, q):
+        """ids whose name or category contains q (same as LIKE '%q%')"""
+        if len(q) >= 3:
+            grams = sorted((self._grams.get(g, ()) for g in trigrams(q)), key=len)
+            if not grams or not grams[0]:
+                return set()
+            ids = set(grams[0])
+            for postings in grams[1:]:
+                ids &= postings
+                if not ids:
+                    break
+        elif len(q) == 2:
+            ids = set()
+            for gram in self._by_bigram.get(q, ()):
+                ids |= self._grams[gram]
+        else:
+            ids = self._docs.keys()
+        docs = self._docs
+        return {i for i in ids if q in docs[i].name_l or q in docs[i].category_l}
+
+    def _token_prefix_ids(self, token):
+        ids   = set()
+        words = self._sorted_tokens
+        i     = bisect_left(words, token)
+        while i < len(words) and words[i].startswith(token):
+            ids |= self._tokens[words[i]]
+            i += 1
+        return ids
+
+    def _all_words_ids(self, q):
+        words = tokenize(q)
+        if len(words) < 2:
+            return set()
+        ids = None
+        for word in sorted(words, key=len, reverse=True):
+            found = self._token_prefix_ids(word)
+            ids = found if ids is None else ids & found
+            if not ids:
+                return set()
+        return ids
+
+    @staticmethod
+    def _tier(doc, q):
+        name = doc.name_l
+        if name == q:
+            return TIER_EXACT
+        if name.startswith(q):
+            return TIER_NAME_PREFIX
+        if ' ' + q in name:
+            return TIER_WORD_PREFIX
+        if q in name:
+            return TIER_NAME_CONTAINS
+        if q in doc.category_l:
+            return TIER_CATEGORY
+        return TIER_ALL_WORDS
+
+    def lookup(self, query):
+        """All products matching `query`, as {id: tier} (stock not checked)"""
+        q = normalize(query)
+        if not q:
+            return {}
+        matched = self._results.get(q)
+        if matched is None:
+            with self._lock:
+                docs    = self._docs
+                matched = {i: self._tier(docs[i], q) for i in self._substring_ids(q)}
+                for i in self._all_words_ids(q):
+                    matched.setdefault(i, TIER_ALL_WORDS)
+                self._results.set(q, matched)
+        return matched
+
+    def search(self, query, limit=8, in_stock_only=True):
+        """Best `limit` products, ranked by match tier then rating"""
+        matched = self.lookup(query)
+        docs    = self._docs
+        ranked  = heapq.nsmallest(
+            limit,
+            ((tier, -docs[i].rating, i) for i, tier in matched.items()
+             if i in docs and (docs[i].stock > 0 or not in_stock_only)),
+        )
+        return [docs[i] for _, _, i in ranked]
+
+    def categories(self, query):
+        """Distinct categories of every matching product"""
+        docs = self._docs
+        return sorted({docs[i].category for i in self.lookup(query) if i in docs})
+
+
+# ══════════════════════════════════════
+# LOADING FROM MYSQL
+# ══════════════════════════════════════
+INDEX_COLUMNS_SQL = """
+    SELECT id, name, category, price, image_url, rating, stock
+    FROM products
+"""
+
+
+def load_rows(conn, product_ids=None):
+    """Every product, or just `product_ids` (one IN (...) query)"""
+    sql, params = INDEX_COLUMNS_SQL, ()
+    if product_ids is not None:
+        params = list(product_ids)
+        sql   += f" WHERE id IN ({','.join(['%s'] * len(params))})"
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
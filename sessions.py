@@ -0,0 +1,343 @@
+# sessions.py - Server-side sessions (SESSION_STORE)
+#
+#   SESSION_STORE=cookie                       Flask's signed cookie (default)
+#   SESSION_STORE=memory                       this process only (one worker)
+#   SESSION_STORE=sqlite:///var/lib/secureshop/sessions.db   one host, any workers
+#   SESSION_STORE=unix:///run/secureshop/sessions.sock       shared store process:
+#       python sessions.py serve /run/secureshop/sessions.sock
+#
+# With a server-side store the cookie only carries a signed "sid.version";
+# the session data - login, flashes and the per-user working set (cart
+# lines, cart count, favourite ids) - stays on the server, so it can be
+# much bigger than a cookie allows and costs no request bytes.
+#
+# Each worker keeps recently used sessions in a local LRU in front of a
+# shared store. The cookie's version says whether the local copy is
+# current: every save picks a new random version and re-sets the cookie,
+# and only an exact match is served locally, so a session changed by
+# another worker (even by two saves racing) is re-read from the store.
+#
+# Sessions expire PERMANENT_SESSION_LIFETIME after their last change, in
+# the store and in the browser alike.
+
+import argparse
+import json
+import os
+import secrets
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from itsdangerous import BadSignature, Signer
+
+from catalog_cache import TTLCache
+
+
+# ══════════════════════════════════════
+# STORES: load / save / delete by session id
+# ══════════════════════════════════════
+class MemoryStore:
+    """Sessions in this process (lost on restart, not shared by workers)"""
+
+    def __init__(self, ttl, maxsize=100_000):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def load(self, sid):
+        return self._cache.get(sid)            # (version, payload) or None
+
+    def save(self, sid, version, payload):
+        self._cache.set(sid, (version, payload))
+
+    def delete(self, sid):
+        self._cache.pop(sid)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+class SqliteStore:
+    """Sessions in a SQLite file, shared by every worker on the host"""
+
+    PRUNE_INTERVAL = 300   # seconds between deletes of expired rows
+
+    def __init__(self, path, ttl):
+        self.path    = path
+        self.ttl     = ttl
+        self._local  = threading.local()
+        self._pruned = 0.0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                sid     TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                expires REAL NOT NULL
+            )
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._conn().execute(
+            "SELECT version, payload FROM sessions WHERE sid = ? AND expires > ?",
+            (sid, time.time())).fetchone()
+        return tuple(row) if row else None
+
+    def save(self, sid, version, payload):
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO sessions (sid, version, payload, expires) VALUES (?, ?, ?, ?)",
+            (sid, version, payload, now + self.ttl))
+        if now - self._pruned > self.PRUNE_INTERVAL:
+            self._pruned = now
+            self._conn().execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class SocketStore:
+    """Client for `python sessions.py serve PATH` (one connection per thread).
+    If the store process is down, sessions read as empty and saves are
+    dropped - visitors are logged out, nothing else fails."""
+
+    def __init__(self, path, timeout=1.0):
+        self.path    = path
+        self.timeout = timeout
+        self._local  = threading.local()
+
+    def _call(self, *request):
+        for attempt in (1, 2):          # one retry on a fresh connection
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout)
+                    sock.connect(self.path)
+                    conn = self._local.conn = sock.makefile('rwb')
+                conn.write(json.dumps(request).encode('utf-8') + b'\n')
+                conn.flush()
+                line = conn.readline()
+                if not line:
+                    raise ConnectionError('session store closed the connection')
+                return json.loads(line)
+            except (OSError, ValueError) as e:
+                self._local.conn = None
+                if attempt == 2:
+                    print(f"Session store error ({self.path}): {e}")
+                    return None
+
+    def load(self, sid):
+        result = self._call('load', sid)
+        return tuple(result) if result else None
+
+    def save(self, sid, version, payload):
+        self._call('save', sid, version, payload)
+
+    def delete(self, sid):
+        self._call('delete', sid)
+
+    def __len__(self):
+        return self._call('len') or 0
+
+
+def open_store(url, ttl):
+    """memory | sqlite:///path | unix:///path → store"""
+    if url == 'memory':
+        return MemoryStore(ttl)
+    if url.startswith('sqlite://'):
+        return SqliteStore(url[len('sqlite://'):], ttl)
+    if url.startswith('unix://'):
+        return SocketStore(url[len('unix://'):])
+    raise ValueError(f"Unknown SESSION_STORE: {url!r}")
+
+
+# ══════════════════════════════════════
+# FLASK SESSION INTERFACE
+# ══════════════════════════════════════
+class ServerSession(SecureCookieSession):
+    """Tracks modified / accessed like the cookie session, plus its id"""
+
+    def __init__(self, initial=None, sid=None, version=0):
+        super().__init__(initial)
+        self.sid     = sid
+        self.version = version
+        self.user_id = self.get('user_id')   # as loaded; a change rotates sid
+        self.accessed = False
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = session_json_serializer
+
+    def __init__(self, store, local_size=4096, ttl=31 * 86400):
+        self.store = store
+        # A memory store is already local - no second copy in front of it
+        self.local = None if isinstance(store, MemoryStore) else TTLCache(maxsize=local_size, ttl=ttl)
+        self.hits  = 0   # served from the local copy
+        self.reads = 0   # read from the store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='secureshop-session')
+
+    def open_session(self, app, request):
+        raw = request.cookies.get(self.get_cookie_name(app))
+        if not raw:
+            return ServerSession()
+        try:
+            sid, version = self._signer(app).unsign(raw).decode('ascii').rsplit('.', 1)
+            version = int(version)
+        except (BadSignature, ValueError):
+            return ServerSession()
+
+        entry = self.local.get(sid) if self.local is not None else None
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+        else:
+            self.reads += 1
+            entry = self.store.load(sid)
+            if entry is None:
+                return ServerSession()          # expired or store lost it
+            if self.local is not None:
+                self.local.set(sid, entry)
+        return ServerSession(self.serializer.loads(entry[1]), sid=sid, version=entry[0])
+
+    def should_set_cookie(self, app, session):
+        # The cookie only changes with the version
+        return session.modified
+
+    def save_session(self, app, session, response):
+        name     = self.get_cookie_name(app)
+        settings = dict(domain=self.get_cookie_domain(app), path=self.get_cookie_path(app),
+                        secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+                        httponly=self.get_cookie_httponly(app),
+                        partitioned=self.get_cookie_partitioned(app))
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified:
+                if session.sid:
+                    self._delete(session.sid)
+                response.delete_cookie(name, **settings)
+                response.vary.add('Cookie')
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        sid = session.sid
+        if sid is None or session.get('user_id') != session.user_id:
+            # New session, or someone logged in / out: never reuse an id
+            # the browser had before (session fixation)
+            if sid is not None:
+                self._delete(sid)
+            sid = secrets.token_urlsafe(24)
+        # Random, not +1: two requests saving the same session at once
+        # must not both write version n + 1 with different payloads
+        version = secrets.randbits(52)
+        payload = self.serializer.dumps(dict(session))
+        self.store.save(sid, version, payload)
+        if self.local is not None:
+            self.local.set(sid, (version, payload))
+
+        response.set_cookie(name, self._signer(app).sign(f'{sid}.{version}').decode('ascii'),
+                            expires=self.get_expiration_time(app, session), **settings)
+        response.vary.add('Cookie')
+
+    def _delete(self, sid):
+        self.store.delete(sid)
+        if self.local is not None:
+            self.local.pop(sid)
+
+    def stats(self):
+        lookups = self.hits + self.reads
+        return {
+            'store':         type(self.store).__name__,
+            'stored':        len(self.store),
+            'local_entries': len(self.local) if self.local is not None else None,
+            'local_hits':    self.hits,
+            'store_reads':   self.reads,
+            'hit_ratio':     round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def init_sessions(app):
+    """Install the server-side interface unless SESSION_STORE is 'cookie';
+    returns it (or None)"""
+    url = app.config['SESSION_STORE']
+    if url == 'cookie':
+        return None
+    ttl   = app.permanent_session_lifetime.total_seconds()
+    store = open_store(url, ttl)
+    app.session_interface = ServerSessionInterface(
+        store, local_size=app.config['SESSION_LOCAL_SIZE'], ttl=ttl)
+    return app.session_interface
+
+
+# ══════════════════════════════════════
+# SHARED STORE PROCESS (unix socket)
+# ══════════════════════════════════════
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            try:
+                op, *args = json.loads(line)
+                if op == 'load':
+                    result = store.load(*args)
+                elif op == 'save':
+                    result = store.save(*args)
+                elif op == 'delete':
+                    result = store.delete(*args)
+                elif op == 'len':
+                    result = len(store)
+                else:
+                    raise ValueError(f'unknown op {op!r}')
+            except (TypeError, ValueError) as e:
+                print(f"Bad session store request: {e}")
+                return
+            self.wfile.write(json.dumps(result).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SecureShop shared session store')
+    parser.add_argument('command', choices=('serve',))
+    parser.add_argument('path', help='unix socket to listen on')
+    parser.add_argument('--ttl', type=int, default=31 * 86400, help='seconds a session lives')
+    parser.add_argument('--max-sessions', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        os.remove(args.path)
+    server = _Server(args.path, _Handler)
+    server.store = MemoryStore(args.ttl, maxsize=args.max_sessions)
+    os.chmod(args.path, 0o660)
+    print(f"Session store listening on {args.path} (ttl {args.ttl}s, max {args.max_sessions:,})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.path)
+
+
+if __name__ == '__main__':
+    main()
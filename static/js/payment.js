@@ -60,13 +60,14 @@ function initiatePayment() {
         .then(r => r.json())
         .then(verifyData => {
           if (verifyData.success) {
-            window.location.href = `/order/success/${verifyData.order_id}`;
-          } else {
-            showToast('Payment verification failed. Contact support.', 'error');
+            // Step 4: The order is written in the background - wait for it
             if (payBtn) {
-              payBtn.disabled = false;
-              payBtn.innerHTML = `<i class="fas fa-lock"></i> Pay ${window.PAYMENT_AMOUNT} Securely`;
+              payBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Confirming order...';
             }
+            pollPaymentStatus(verifyData.status_url, 0);
+          } else {
+            showToast('Payment verification failed. Contact support.', 'error');
+            resetPayButton();
           }
         });
       },
@@ -101,3 +102,39 @@ function initiatePayment() {
     }
   });
 }
+
+// Re-enable the pay button after a failure
+function resetPayButton() {
+  const payBtn = document.getElementById('payBtn');
+  if (payBtn) {
+    payBtn.disabled = false;
+    payBtn.innerHTML = `<i class="fas fa-lock"></i> Pay ${window.PAYMENT_AMOUNT} Securely`;
+  }
+}
+
+// Poll the payment job until the worker has created the order
+const PAYMENT_POLL_MS  = 1000;
+const PAYMENT_POLL_MAX = 60;
+
+function pollPaymentStatus(statusUrl, attempt) {
+  fetch(statusUrl, { headers: { 'Accept': 'application/json' } })
+  .then(r => r.json())
+  .then(data => {
+    if (data.status === 'done') {
+      window.location.href = `/order/success/${data.order_id}`;
+    } else if (data.status === 'failed' || !data.success) {
+      showToast(data.message || 'Payment verification failed. Contact support.', 'error');
+      resetPayButton();
+    } else if (attempt + 1 >= PAYMENT_POLL_MAX) {
+      showToast('Payment received - your order is still being confirmed. Check your profile shortly.', 'warning');
+      setTimeout(() => { window.location.href = '/profile'; }, 3000);
+    } else {
+      setTimeout(() => pollPaymentStatus(statusUrl, attempt + 1), PAYMENT_POLL_MS);
+    }
+  })
+  .catch(() => {
+    if (attempt + 1 < PAYMENT_POLL_MAX) {
+      setTimeout(() => pollPaymentStatus(statusUrl, attempt + 1), PAYMENT_POLL_MS);
+    }
+  });
+}
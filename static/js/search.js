@@ -59,7 +59,7 @@
       card.className = 'search-result-card';
       card.innerHTML = `
         <img src="${p.image_url}" alt="${p.name}"
-             onerror="this.src='https://via.placeholder.com/60x60?text=IMG'">
+             onerror="this.src='/static/img/no-image.svg'">
         <div class="search-result-info">
           <span class="search-result-cat">${p.category}</span>
           <p class="search-result-name">${p.name}</p>
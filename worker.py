@@ -0,0 +1,87 @@
+# worker.py - Drains the payment_jobs queue (see jobs.py)
+#
+#   DATABASE_URL=mysql://... python worker.py [--batch 10] [--rate 20]
+#
+# Runs next to the web workers (Procfile `worker:`). --rate caps jobs per
+# second per worker, so a checkout spike waits in the queue instead of
+# hitting MySQL all at once; add workers to drain faster. SIGTERM lets
+# the current batch finish before exiting.
+
+import argparse
+import os
+import signal
+import time
+
+import pymysql
+
+import jobs
+from catalog_changes import prune_changes
+from database import connect_kwargs_from_url
+
+PRUNE_INTERVAL = 3600   # seconds between deletes of old catalog_changes rows
+
+_stopping = False
+
+
+def _stop(signum, frame):
+    global _stopping
+    _stopping = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SecureShop payment job worker')
+    parser.add_argument('--batch', type=int,   default=10,  help='jobs claimed per round')
+    parser.add_argument('--rate',  type=float, default=20,  help='max jobs per second (0 = unlimited)')
+    parser.add_argument('--poll',  type=float, default=1.0, help='seconds to sleep when the queue is empty')
+    args = parser.parse_args()
+
+    connect_kwargs = connect_kwargs_from_url(os.environ.get('DATABASE_URL'))
+    if connect_kwargs is None:
+        raise SystemExit('DATABASE_URL is not set')
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+
+    print(f"Payment worker started (batch={args.batch}, rate={args.rate}/s)")
+    db     = None
+    pruned = 0.0
+    while not _stopping:
+        try:
+            if db is None:
+                db = pymysql.connect(**connect_kwargs)
+            if time.monotonic() - pruned > PRUNE_INTERVAL:
+                # Every order logs its products to catalog_changes
+                cursor = db.cursor()
+                prune_changes(cursor)
+                db.commit()
+                cursor.close()
+                pruned = time.monotonic()
+            batch = jobs.claim(db, args.batch)
+            if not batch:
+                time.sleep(args.poll)
+                continue
+            for job in batch:
+                started = time.monotonic()
+                jobs.run_job(db, job)
+                wait = interval - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        except pymysql.MySQLError as e:
+            # Lost the connection mid-batch: unfinished jobs are re-run
+            # once their lease expires
+            print(f"Worker DB error: {e}")
+            try:
+                db.close()
+            except Exception:
+                pass
+            db = None
+            time.sleep(args.poll)
+
+    if db is not None:
+        db.close()
+    print("Payment worker stopped")
+
+
+if __name__ == '__main__':
+    main()